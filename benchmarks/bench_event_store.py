@@ -0,0 +1,70 @@
+"""! @brief benchmark of the event store: passages recorded and written per second, and latency of seen_within.
+
+Run from the project's root:
+    python3 benchmarks/bench_event_store.py --passages 100000
+    python3 benchmarks/bench_event_store.py --batch-size 1000 --output bench_event_store.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from vehicle_event_store import EventStore
+
+
+def random_plate(generator):
+    return f'{generator.randrange(1, 250)} TU {generator.randrange(1, 10000)}'
+
+
+def main():
+    """records the passages, waits for them to be written, times the lookups and writes the JSON results."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--passages', type=int, default=50000, help="passages recorded")
+    parser.add_argument('--lookups', type=int, default=10000, help="seen_within calls timed")
+    parser.add_argument('--cameras', type=int, default=4, help="cameras the passages are spread over")
+    parser.add_argument('--batch-size', type=int, default=500, help="passages inserted per transaction")
+    parser.add_argument('--path', help="database file (a temporary one by default)")
+    parser.add_argument('--output', default='bench_event_store.json', help="JSON file the results are written to")
+    arguments = parser.parse_args()
+    generator = random.Random(0)
+    directory = tempfile.TemporaryDirectory()
+    path = arguments.path or os.path.join(directory.name, 'passages.db')
+    store = EventStore(path, batch_size=arguments.batch_size, queue_size=arguments.passages + 1, compact_interval_s=0)
+    try:
+        vehicles = [['car', random_plate(generator), 'peugeot', 'Tunisia', 'white'] for _ in range(arguments.passages)]
+        start = time.perf_counter()
+        for index, vehicle in enumerate(vehicles):
+            store.record(vehicle, camera=f'camera-{index % arguments.cameras}')
+        record_s = time.perf_counter() - start
+        store.flush()
+        write_s = time.perf_counter() - start
+        latencies = []
+        for _ in range(arguments.lookups):
+            plate = random_plate(generator)
+            lookup_start = time.perf_counter()
+            store.seen_within(plate, 300, camera='camera-0')
+            latencies.append((time.perf_counter() - lookup_start) * 1e6)
+        results = {
+            'passages': arguments.passages,
+            'record_per_s': arguments.passages / record_s,
+            'written_per_s': arguments.passages / write_s,
+            'seen_within_mean_us': float(np.mean(latencies)),
+            'seen_within_p99_us': float(np.percentile(latencies, 99)),
+            'store': store.stats(),
+        }
+    finally:
+        store.close()
+        directory.cleanup()
+    with open(arguments.output, 'w') as f:
+        json.dump(results, f, indent=4)
+    print(json.dumps({key: value for key, value in results.items() if key != 'store'}))
+
+
+if __name__ == '__main__':
+    main()
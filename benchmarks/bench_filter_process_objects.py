@@ -0,0 +1,115 @@
+"""! @brief micro-benchmark of vehicle_features.filter_process_objects against its previous loop-based implementation.
+
+Run from the project's root:
+    python3 benchmarks/bench_filter_process_objects.py
+"""
+import os
+import sys
+import timeit
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from vehicle_features import class_names, filter_process_objects
+
+
+def legacy_filter_process_objects(results):
+    """previous implementation of filter_process_objects, kept verbatim for the comparison."""
+    for result in results:
+        class_ids=[]
+        confidences=[]
+        for result in results:
+            boxes = result.boxes.cpu().numpy()
+            confidences.append(boxes.conf)
+            class_ids.append(boxes.cls)
+            class_ids_array = np.concatenate(class_ids)
+            confidences_array = np.concatenate(confidences)
+            desired_class_ids_array = class_ids_array.astype(int).tolist()
+            desired_conf_array = confidences_array.astype(float).tolist()
+            result_dict = {}
+            car_found = False
+            LP_found = False
+            Brand_found = False
+
+            for i in range(len(desired_class_ids_array)):
+                if desired_conf_array[i] > 0.3:
+                    result_dict[desired_class_ids_array[i]] = desired_conf_array[i]
+
+            result_dict = dict(sorted(result_dict.items()))
+
+            if len(result_dict)>3: 
+                class_ids_list = list(result_dict.keys())
+                if class_ids_list[0]=='0' and class_ids_list[1]=='1':
+                    if result_dict['0']> result_dict['1']:
+                        del result_dict['1']
+                    else:
+                        del result_dict['0']
+                class_ids_list1 = list(result_dict.keys())
+                while len(result_dict)>3:
+                    if result_dict[class_ids_list1[-1]]>result_dict[class_ids_list1[-2]]:
+                        del result_dict[class_ids_list1[-2]]
+                    else:
+                        del result_dict[class_ids_list1[-1]]
+                    class_ids_list1 = list(result_dict.keys())
+
+            features = list(result_dict.keys())
+            final_features = []
+            if len(result_dict) > 2:
+                for j in result_dict.keys():
+                    if j in [0, 1] and result_dict[j] > 0.1:  
+                        car_found = True
+                    elif j == 2 and result_dict[j] > 0.5:
+                        LP_found = True
+                    elif 3 <= j <= 35 and result_dict[j] > 0.45:
+                        Brand_found = True
+                if car_found and LP_found and Brand_found:
+                    for feature in features:
+                        final_features.append(class_names[feature])
+                    return final_features
+
+
+class SyntheticBoxes:
+    """stands for ultralytics' Boxes: cls and conf arrays, cpu() and numpy() return themselves."""
+
+    def __init__(self, cls, conf):
+        self.cls = cls
+        self.conf = conf
+
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return self
+
+
+class SyntheticResult:
+    """stands for one ultralytics Results object."""
+
+    def __init__(self, cls, conf):
+        self.boxes = SyntheticBoxes(cls, conf)
+
+
+def synthetic_results(detections, rng):
+    """builds the results of one frame with a car, its plate, a brand and random extra detections."""
+    cls = np.concatenate([[0, 2, 14], rng.integers(0, len(class_names), detections - 3)]).astype(np.float32)
+    conf = np.concatenate([[0.9, 0.8, 0.7], rng.uniform(0.1, 0.6, detections - 3)]).astype(np.float32)
+    return [SyntheticResult(cls, conf)]
+
+
+def main():
+    """runs both implementations over synthetic frames and prints the time per call."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=2000, help="calls per measurement")
+    parser.add_argument('--detections', type=int, nargs='+', default=[3, 10, 50, 200, 1000], help="detections per frame")
+    arguments = parser.parse_args()
+    rng = np.random.default_rng(0)
+    print(f"{'detections':>10} {'legacy (us)':>12} {'vectorized (us)':>16} {'speed-up':>9}")
+    for detections in arguments.detections:
+        results = synthetic_results(detections, rng)
+        legacy = min(timeit.repeat(lambda: legacy_filter_process_objects(results), number=arguments.repeat, repeat=3)) / arguments.repeat
+        vectorized = min(timeit.repeat(lambda: filter_process_objects(results), number=arguments.repeat, repeat=3)) / arguments.repeat
+        print(f"{detections:>10} {legacy * 1e6:>12.1f} {vectorized * 1e6:>16.1f} {legacy / vectorized:>8.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,258 @@
+"""! @brief end-to-end benchmark of the pipeline over the test videos and images.
+
+Every frame goes through initialize_components, object_detection_loop, filter_process_objects,
+recognize_license_plate, identify_vehicle_color and an MQTT publish to an in-process stand-in
+broker. The per-stage p50/p95/p99 latency, frames/s, vehicles/s, peak RSS and model load time are
+written as JSON, and a previous run can be given to flag the regressions.
+
+Run from the project's root:
+    python3 benchmarks/bench_pipeline.py --output bench_before.json
+    python3 benchmarks/bench_pipeline.py --output bench_after.json --compare bench_before.json
+"""
+import os
+import sys
+import json
+import time
+import glob
+import resource
+import tempfile
+import argparse
+import subprocess
+from contextlib import contextmanager
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import vehicle_initialize_detection
+import vehicle_features
+import vehicle_license
+import vehicle_color
+import vehicle_models
+import vehicle_mqtt
+import vehicle_frames
+import vehicle_config
+from vehicle_mqtt_broker import StandInBroker
+
+#! stages timed by the benchmark, 'frame' being the whole processing of one frame
+STAGES = ['initialize_components', 'object_detection_loop', 'filter_process_objects', 'recognize_license_plate',
+          'identify_vehicle_color', 'mqtt_publish', 'frame']
+#! compared metrics that are better when higher; the others are better when lower
+HIGHER_IS_BETTER = ('fps', 'vehicles_per_s')
+#! config keys recorded with the results, the ones that change the performance
+CONFIG_KEYS = ['model_backends', 'inference_size', 'frame_stride', 'roi', 'ocr_batch_size', 'ocr_skip_detection',
+               'plate_cache_enabled', 'nationality_europe_margin']
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+
+class StageTimer:
+    """records the duration of every call of every stage."""
+
+    def __init__(self):
+        self.durations = {stage: [] for stage in STAGES}
+
+    @contextmanager
+    def time(self, stage):
+        start = time.perf_counter()
+        yield
+        self.durations[stage].append((time.perf_counter() - start) * 1000)
+
+    def summary(self):
+        """@return {stage: {'calls', 'mean_ms', 'p50_ms', 'p95_ms', 'p99_ms'}} for the stages that ran."""
+        summary = {}
+        for stage, durations in self.durations.items():
+            if durations:
+                summary[stage] = {'calls': len(durations), 'mean_ms': float(np.mean(durations))}
+                summary[stage].update({f'p{q}_ms': float(np.percentile(durations, q)) for q in (50, 95, 99)})
+        return summary
+
+
+def peak_rss_mb():
+    """@return the peak resident memory of the process in MB (ru_maxrss is in KB on Linux)."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def git_commit():
+    """@return the short hash of the checked out commit, or None outside a git checkout."""
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def enrich(frame, results, frame_number, bg_subtractor, timer, publisher):
+    """runs the stages after the detection on one frame, as final_features_optimized in main.py does.
+
+    @return 1 if a vehicle was published, 0 otherwise.
+    """
+    with timer.time('filter_process_objects'):
+        final_features = vehicle_features.filter_process_objects(results)
+    if final_features is None:
+        return 0
+    with timer.time('recognize_license_plate'):
+        try:
+            nationality = vehicle_license.recognize_license_plate(results, frame_number)
+        except Exception:
+            nationality = None
+    if nationality is None:
+        return 0
+    final_features.append(nationality[1])
+    final_features[1] = nationality[0]
+    with timer.time('identify_vehicle_color'):
+        fg_mask = cv2.threshold(bg_subtractor.apply(frame), 120, 255, cv2.THRESH_BINARY)[1]
+        contours, _ = cv2.findContours(fg_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        color = vehicle_color.identify_vehicle_color(frame, contours, 200, frame_number,
+                                                     vehicle_box=vehicle_features.select_vehicle_box(results))
+    if color is None:
+        return 0
+    final_features.append(color)
+    with timer.time('mqtt_publish'):
+        publisher.publish_features(final_features)
+    return 1
+
+
+def run_video(path, timer, publisher, max_frames=0):
+    """benchmarks every frame of a video.
+
+    @return (frames processed, vehicles published).
+    """
+    with timer.time('initialize_components'):
+        model, cap, bg_subtractor = vehicle_initialize_detection.initialize_components(path)
+    frames = vehicles = frame_number = 0
+    try:
+        while not max_frames or frames < max_frames:
+            start = time.perf_counter()
+            try:
+                frame, results, frame_number = vehicle_initialize_detection.object_detection_loop(model, cap, frame_number)
+            except Exception:
+                # the video ended
+                break
+            timer.durations['object_detection_loop'].append((time.perf_counter() - start) * 1000)
+            vehicles += enrich(frame, results, frame_number, bg_subtractor, timer, publisher)
+            timer.durations['frame'].append((time.perf_counter() - start) * 1000)
+            frames += 1
+    finally:
+        cap.release()
+    return frames, vehicles
+
+
+def run_image(path, timer, publisher):
+    """benchmarks one image as a single frame.
+
+    @return (frames processed, vehicles published).
+    """
+    frame = cv2.imread(path)
+    if frame is None:
+        return 0, 0
+    model = vehicle_models.registry.get('general_features_model')
+    start = time.perf_counter()
+    with vehicle_models.registry.inference('general_features_model'):
+        results = model.predict(frame, **vehicle_frames.predict_options())
+    timer.durations['object_detection_loop'].append((time.perf_counter() - start) * 1000)
+    vehicles = enrich(frame, results, 1, cv2.createBackgroundSubtractorMOG2(), timer, publisher)
+    timer.durations['frame'].append((time.perf_counter() - start) * 1000)
+    return 1, vehicles
+
+
+def run_benchmark(inputs, max_frames=0):
+    """runs the benchmark over the input files.
+
+    @param inputs list of video and image paths.
+    @param max_frames frames processed per video (0 for all of them).
+
+    @return the results as a dict ready to be dumped to JSON.
+    """
+    config = vehicle_config.vehicle_det_config
+    start = time.perf_counter()
+    vehicle_models.registry.preload()
+    model_load_s = time.perf_counter() - start
+    broker = StandInBroker().start()
+    publisher = vehicle_mqtt.MQTTPublisher(broker_address=broker.host, broker_port=broker.port,
+                                           spool_dir=tempfile.mkdtemp(prefix='bench_spool_')).start()
+    timer = StageTimer()
+    frames = vehicles = 0
+    start = time.perf_counter()
+    try:
+        for path in inputs:
+            done = run_image(path, timer, publisher) if path.lower().endswith(IMAGE_EXTENSIONS) else run_video(path, timer, publisher, max_frames)
+            frames += done[0]
+            vehicles += done[1]
+            print(f"{path}: {done[0]} frames, {done[1]} vehicles")
+        # the run ends once the broker has every message
+        publisher.flush()
+        broker.wait_for_messages(vehicles)
+    finally:
+        publisher.stop()
+        broker.stop()
+    wall_s = time.perf_counter() - start
+    return {
+        'commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'config': {key: config[key] for key in CONFIG_KEYS if key in config},
+        'inputs': inputs,
+        'frames': frames,
+        'vehicles': vehicles,
+        'mqtt_delivered': len(broker.messages),
+        'wall_s': wall_s,
+        'fps': frames / wall_s if wall_s else 0.0,
+        'vehicles_per_s': vehicles / wall_s if wall_s else 0.0,
+        'peak_rss_mb': peak_rss_mb(),
+        'model_load_s': model_load_s,
+        'model_load': {key: stats['load_s'] for key, stats in vehicle_models.registry.report().items()},
+        'stages': timer.summary(),
+    }
+
+
+def compare(baseline, current, tolerance=0.15, min_ms=1.0, min_calls=10):
+    """compares two runs and prints the change of every metric.
+
+    @param baseline, current the JSON results of two runs.
+    @param tolerance relative change allowed before a metric is flagged (0.15 = 15% worse).
+    @param min_ms stages whose baseline p95 is below this are too noisy to be compared.
+    @param min_calls stages called fewer times than this have no meaningful p95 and are not compared.
+
+    @return the list of regressions, empty if none.
+    """
+    checks = [(name, baseline.get(name), current.get(name)) for name in ('fps', 'vehicles_per_s', 'peak_rss_mb', 'model_load_s')]
+    for stage, stats in current['stages'].items():
+        before = baseline.get('stages', {}).get(stage)
+        if before is not None and before['p95_ms'] >= min_ms and min(before['calls'], stats['calls']) >= min_calls:
+            checks.append((f'{stage} p95_ms', before['p95_ms'], stats['p95_ms']))
+    regressions = []
+    print(f"{'metric':<34} {'baseline':>10} {'current':>10} {'change':>8}")
+    for name, before, after in checks:
+        if not before or after is None:
+            continue
+        change = (after - before) / before
+        worse = -change if name in HIGHER_IS_BETTER else change
+        flag = ' REGRESSION' if worse > tolerance else ''
+        print(f"{name:<34} {before:>10.2f} {after:>10.2f} {change:>+8.1%}{flag}")
+        if flag:
+            regressions.append(f"{name}: {before:.2f} -> {after:.2f} ({change:+.1%})")
+    return regressions
+
+
+def main():
+    """runs the benchmark, writes the JSON results and exits with 1 if a regression was flagged."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('inputs', nargs='*', default=['files_for_test/*.mp4', 'files_for_test/*.png', 'files_for_test/*.jpg'],
+                        help="videos, images or glob patterns (the test files by default)")
+    parser.add_argument('--max-frames', type=int, default=0, help="frames processed per video (0 for all of them)")
+    parser.add_argument('--output', default='bench_pipeline.json', help="JSON file the results are written to")
+    parser.add_argument('--compare', metavar='BASELINE', help="JSON results of a previous run to compare with")
+    parser.add_argument('--tolerance', type=float, default=0.15, help="relative change flagged as a regression")
+    arguments = parser.parse_args()
+    inputs = [path for pattern in arguments.inputs for path in sorted(glob.glob(pattern))]
+    results = run_benchmark(inputs, arguments.max_frames)
+    with open(arguments.output, 'w') as f:
+        json.dump(results, f, indent=4)
+    print(json.dumps({key: results[key] for key in ('frames', 'vehicles', 'fps', 'vehicles_per_s', 'peak_rss_mb', 'model_load_s')}))
+    if arguments.compare:
+        with open(arguments.compare) as f:
+            regressions = compare(json.load(f), results, arguments.tolerance)
+        if regressions:
+            print("regressions:", *regressions, sep='\n  ')
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""! @brief load test of the recognition service: requests/s and tail latency under concurrent clients.
+
+Every client keeps one connection open and posts the test images in turn to /recognize. The
+service is started in-process with the models of main_config.json, unless --url points to one
+already running (python3 main.py --serve).
+
+Run from the project's root:
+    python3 benchmarks/bench_service.py --clients 8 --requests 400
+    python3 benchmarks/bench_service.py --url http://127.0.0.1:8080 --clients 32 --output bench_service.json
+"""
+import os
+import sys
+import json
+import glob
+import time
+import threading
+import argparse
+import http.client
+from collections import Counter
+from urllib.parse import urlsplit
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+
+def client(host, port, images, count, offset, latencies, statuses):
+    """posts count images over one keep-alive connection, recording the latency and status of each request."""
+    connection = http.client.HTTPConnection(host, port, timeout=60)
+    try:
+        for index in range(count):
+            start = time.perf_counter()
+            connection.request('POST', '/recognize', body=images[(offset + index) % len(images)],
+                               headers={'Content-Type': 'application/octet-stream'})
+            response = connection.getresponse()
+            response.read()
+            latencies.append((time.perf_counter() - start) * 1000)
+            statuses.append(response.status)
+    finally:
+        connection.close()
+
+
+def run_load(host, port, images, clients, requests):
+    """sends the requests with the given number of concurrent clients.
+
+    @return the results as a dict ready to be dumped to JSON.
+    """
+    latencies = []
+    statuses = []
+    shares = [requests // clients + (index < requests % clients) for index in range(clients)]
+    threads = [threading.Thread(target=client, args=(host, port, images, share, index, latencies, statuses))
+               for index, share in enumerate(shares)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall_s = time.perf_counter() - start
+    results = {
+        'clients': clients,
+        'requests': len(latencies),
+        'statuses': {str(status): count for status, count in sorted(Counter(statuses).items())},
+        'wall_s': wall_s,
+        'requests_per_s': len(latencies) / wall_s if wall_s else 0.0,
+    }
+    if latencies:
+        results['mean_ms'] = float(np.mean(latencies))
+        results.update({f'p{q}_ms': float(np.percentile(latencies, q)) for q in (50, 95, 99)})
+        results['max_ms'] = float(np.max(latencies))
+    return results
+
+
+def main():
+    """starts the service if needed, runs the load test and writes the JSON results."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('inputs', nargs='*', default=['files_for_test/*.png', 'files_for_test/*.jpg'],
+                        help="images or glob patterns posted in turn (the test images by default)")
+    parser.add_argument('--url', help="service already running, e.g. http://127.0.0.1:8080 (started in-process by default)")
+    parser.add_argument('--clients', type=int, default=8, help="concurrent clients")
+    parser.add_argument('--requests', type=int, default=200, help="total number of requests")
+    parser.add_argument('--warmup', type=int, default=10, help="requests sent before the measure")
+    parser.add_argument('--output', default='bench_service.json', help="JSON file the results are written to")
+    arguments = parser.parse_args()
+    paths = [path for pattern in arguments.inputs for path in sorted(glob.glob(pattern)) if path.lower().endswith(IMAGE_EXTENSIONS)]
+    if not paths:
+        sys.exit("no image to post")
+    images = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            images.append(f.read())
+    service = service_stats = None
+    if arguments.url:
+        address = urlsplit(arguments.url)
+        host, port = address.hostname, address.port or 80
+    else:
+        import vehicle_service
+        service = vehicle_service.RecognitionService(port=0).start()
+        host, port = service.host, service.port
+    try:
+        if arguments.warmup:
+            run_load(host, port, images, 1, arguments.warmup)
+        results = run_load(host, port, images, arguments.clients, arguments.requests)
+    finally:
+        if service is not None:
+            service_stats = service.stats()
+            service.stop()
+    results['service'] = service_stats
+    results['inputs'] = paths
+    with open(arguments.output, 'w') as f:
+        json.dump(results, f, indent=4)
+    print(json.dumps({key: results.get(key) for key in ('requests', 'statuses', 'requests_per_s', 'p50_ms', 'p95_ms', 'p99_ms')}))
+
+
+if __name__ == '__main__':
+    main()
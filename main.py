@@ -31,19 +31,25 @@
 # - a minor work is still needed on the european countries.
 #
 # 
+import argparse
 import cv2
-import json
 import vehicle_color
 import vehicle_license
 import vehicle_initialize_detection
 import vehicle_features
 import vehicle_mqtt
-
-try:
-    with open('main_config.json') as f:
-        vehicle_det_config = json.load(f)
-except :
-    raise FileNotFoundError("The file 'main_config.json' was not found.")
+import vehicle_ocr
+import vehicle_nationality
+import vehicle_models
+import vehicle_stream
+import vehicle_pipeline
+import vehicle_batching
+import vehicle_offline
+import vehicle_backends
+import vehicle_quantize
+import vehicle_metrics
+import vehicle_service
+from vehicle_config import vehicle_det_config
 
 file_path = vehicle_det_config['video_path']
 frame_number=0
@@ -64,12 +70,19 @@ def final_features_optimized(video_file, frame_number):
     while True: 
         # Object detection loop
         frame, results, frame_number = vehicle_initialize_detection.object_detection_loop(model, cap, frame_number)
+        vehicle_metrics.startup.mark('first_frame')
         final_features=[]
         # Filter and process detected objects
         final_features = vehicle_features.filter_process_objects(results)
-        while final_features is not None:
+        if final_features is not None:
             # License plate recognition
-            nationality = vehicle_license.recognize_license_plate(results, frame_number)
+            try:
+                nationality = vehicle_license.recognize_license_plate(results, frame_number)
+            except Exception:
+                # the plate could not be read on this frame, try the next one
+                continue
+            if nationality is None:
+                continue
             final_features.append(nationality[1])
             final_features[1] = nationality[0]
             area_threshold = 200
@@ -79,15 +92,88 @@ def final_features_optimized(video_file, frame_number):
             # Find contours
             contours, _ = cv2.findContours(fg_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
 
-            # color identification
-            color = vehicle_color.identify_vehicle_color(frame, contours, area_threshold, frame_number)
+            # color identification on the vehicle's box
+            vehicle_box = vehicle_features.select_vehicle_box(results)
+            color = vehicle_color.identify_vehicle_color(frame, contours, area_threshold, frame_number, vehicle_box=vehicle_box)
             final_features.append(color)
 
             # Return final features if all required features are found
-            if len(final_features) == 5:
+            if color is not None:
                 return final_features,frame_number
 
-features_list, frame_number = final_features_optimized(file_path, frame_number)
-vehicle_mqtt.run(features_list)
-#print ("frame number: ",frame_number)
-    
+def parse_arguments():
+    """! parses the command line arguments."""
+    parser = argparse.ArgumentParser(description="Detects vehicles and publishes their features over MQTT.")
+    parser.add_argument('--stream', action='store_true',
+                        help="keep running on the stream and publish one event per vehicle passage")
+    parser.add_argument('--pipeline', action='store_true',
+                        help="with --stream, run capture, detection and enrichment on separate threads")
+    parser.add_argument('--cameras', nargs='+', default=vehicle_det_config.get('camera_sources', []),
+                        help="with --stream, serve several cameras with one batched general features model")
+    parser.add_argument('--source', default=file_path,
+                        help="video path, camera index or RTSP url (defaults to 'video_path' in main_config.json)")
+    parser.add_argument('--batch', nargs='+', metavar='INPUT',
+                        help="reprocess offline the videos and images of directories, glob patterns or manifests")
+    parser.add_argument('--output', default='results.jsonl',
+                        help="with --batch, the .jsonl or .csv file the vehicles are appended to")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="with --batch, number of worker processes (defaults to 'offline_workers', 0 for all the cores)")
+    parser.add_argument('--no-resume', action='store_true',
+                        help="with --batch, start over instead of skipping the files of the checkpoint")
+    parser.add_argument('--export', choices=vehicle_backends.BACKENDS[1:],
+                        help="export the four models next to their weights, then select them in 'model_backends'")
+    parser.add_argument('--quantize', choices=vehicle_quantize.MODES,
+                        help="write the INT8 variant of the four models and compare it with the torch models")
+    parser.add_argument('--report', default='quantization_report.json',
+                        help="with --quantize, the json file the latency, memory and accuracy report is written to")
+    parser.add_argument('--serve', action='store_true',
+                        help="answer snapshots posted to http://<service_host>:<service_port>/recognize with the features of their vehicle")
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    # the heavy libraries are only imported when the models are loaded
+    vehicle_metrics.startup.mark('imports')
+    arguments = parse_arguments()
+    # per-stage histograms on http://127.0.0.1:<metrics_port>/metrics and the periodic log line, when enabled
+    vehicle_metrics.start_metrics()
+    # load every model once at startup instead of on the first vehicle (batch workers and the service load their own)
+    warmup_models = vehicle_det_config.get('warmup_models', False)
+    if (vehicle_det_config.get('preload_models', False) or warmup_models) and \
+            not (arguments.batch or arguments.export or arguments.quantize or arguments.serve):
+        vehicle_models.start_models(warm_up=warmup_models)
+    if arguments.quantize:
+        for model_key, model_report in vehicle_quantize.quantization_report(mode=arguments.quantize, output=arguments.report).items():
+            print(model_key, model_report['delta'])
+    elif arguments.export:
+        for model_key, exported in vehicle_backends.export_models(arguments.export).items():
+            print(model_key, "exported to", exported)
+    elif arguments.serve:
+        print("service stats:", vehicle_service.RecognitionService().run())
+    elif arguments.batch:
+        print("batch stats:", vehicle_offline.run_batch(arguments.batch, arguments.output, arguments.workers,
+                                                        resume=not arguments.no_resume))
+    elif arguments.stream and arguments.cameras:
+        sources = [int(camera) if camera.isdigit() else camera for camera in arguments.cameras]
+        print("site stats:", vehicle_batching.SiteServer(sources).run())
+    elif arguments.stream:
+        source = int(arguments.source) if arguments.source.isdigit() else arguments.source
+        stream = vehicle_stream.VehicleStream(source)
+        if arguments.pipeline:
+            try:
+                print("pipeline stats:", vehicle_pipeline.VehiclePipeline(source, stream.handle_features).run())
+            finally:
+                stream.close()
+            print("stream stats:", stream.stats_dict())
+        else:
+            print("stream stats:", stream.run())
+    else:
+        file_path = arguments.source
+        features_list, frame_number = final_features_optimized(file_path, frame_number)
+        vehicle_mqtt.run(features_list)
+    # load time and inference time of each model
+    for model_key, model_stats in vehicle_models.registry.report().items():
+        print(model_key, model_stats)
+    # latency of the OCR per plate
+    print("ocr stats:", vehicle_ocr.plate_ocr.stats())
+    # nationality models runs and cache hit rate
+    print("nationality stats:", vehicle_nationality.nationality_cascade.stats())
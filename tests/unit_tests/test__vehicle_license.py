@@ -39,3 +39,32 @@ def test_predict_generic_nationality():
 
 
 
+
+def test_recognize_license_plate_in_memory(monkeypatch, tmp_path):
+    """Test that the plate crop goes to OCR and nationality as an array, without touching the disk."""
+    import numpy as np
+    import vehicle_license
+
+    frame = np.zeros((100, 200, 3), dtype=np.uint8)
+
+    class Boxes:
+        cls = np.array([0., 2.])
+        xyxy = np.array([[0, 0, 200, 100], [50, 20, 90, 40]], dtype=np.float32)
+        def cpu(self):
+            return self
+        def numpy(self):
+            return self
+        def __len__(self):
+            return 2
+
+    class Result:
+        boxes = Boxes()
+        orig_img = frame
+
+    crops = []
+    monkeypatch.setattr(vehicle_license, 'read_license_plate', lambda crop: crops.append(crop) or "ABC123")
+    monkeypatch.setattr(vehicle_license, 'predict_generic_nationality', lambda crop, plate=None: crops.append(crop) or "tunisia")
+    monkeypatch.chdir(tmp_path)
+    assert recognize_license_plate([Result()], 1) == ("ABC123", "tunisia")
+    assert all(isinstance(crop, np.ndarray) and crop.base is frame for crop in crops)
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,113 @@
+"""! @brief Unit test for vehicle_backends module"""
+import json
+import sys
+import numpy as np
+import pytest
+import torch
+
+try:
+    with open('test_config.json') as f:
+        main_config = json.load(f)
+except :
+    raise FileNotFoundError("The file 'test_config.json' was not found.")
+
+
+sys.path.append(main_config['project_directory'])
+from vehicle_backends import exported_path, export_classifier, export_model, load_exported, OnnxClassifier
+from vehicle_models import ModelRegistry, load_yolo
+
+
+def make_classifier():
+    """small CNN with the input and the 9 outputs of the color model."""
+    torch.manual_seed(0)
+    model = torch.nn.Sequential(torch.nn.Conv2d(3, 8, 3, stride=2), torch.nn.BatchNorm2d(8), torch.nn.ReLU(),
+                                torch.nn.AdaptiveAvgPool2d(1), torch.nn.Flatten(), torch.nn.Linear(8, 9))
+    return model.eval()
+
+
+def reference_and_batch(model):
+    batch = torch.randn(3, 3, 224, 224)
+    with torch.no_grad():
+        return model(batch), batch
+
+
+def test_exported_path():
+    """Test that the exports are named like the ultralytics exports, next to the weights."""
+    assert exported_path('models/best.pt', 'onnx') == 'models/best.onnx'
+    assert exported_path('models/final_model_85.t', 'torchscript') == 'models/final_model_85.torchscript'
+    assert exported_path('models/best.pt', 'openvino') == 'models/best_openvino_model'
+    assert exported_path('models/best.pt', 'torch') == 'models/best.pt'
+
+
+def test_torchscript_parity(tmp_path):
+    """Test that the TorchScript export gives the logits of the torch module."""
+    model = make_classifier()
+    target = export_classifier(model, str(tmp_path / 'color.torchscript'), 'torchscript')
+    reference, batch = reference_and_batch(model)
+    with torch.no_grad():
+        logits = torch.jit.load(target)(batch)
+    assert torch.allclose(logits, reference, atol=1e-5)
+
+
+def test_onnx_parity_with_dynamic_batch(tmp_path):
+    """Test that the ONNX Runtime session gives the logits of the torch module for any batch size."""
+    pytest.importorskip('onnx')
+    pytest.importorskip('onnxruntime')
+    model = make_classifier()
+    target = export_classifier(model, str(tmp_path / 'color.onnx'), 'onnx')
+    classifier = OnnxClassifier(target, threads=1)
+    reference, batch = reference_and_batch(model)
+    logits = classifier(batch)
+    assert isinstance(logits, torch.Tensor) and logits.shape == (3, 9)
+    assert torch.allclose(logits, reference, atol=1e-4)
+    assert torch.allclose(classifier(batch[:1]), reference[:1], atol=1e-4)
+
+
+def test_openvino_parity(tmp_path):
+    """Test that the OpenVINO IR gives the logits of the torch module."""
+    pytest.importorskip('onnx')
+    pytest.importorskip('openvino')
+    model = make_classifier()
+    pickled = str(tmp_path / 'color.t')
+    torch.save(model, pickled)
+    export_model('color_model', pickled, 'openvino')
+    reference, batch = reference_and_batch(model)
+    assert torch.allclose(load_exported('color_model', pickled, 'openvino')(batch), reference, atol=1e-4)
+
+
+def test_registry_loads_the_selected_backend(tmp_path):
+    """Test that 'model_backends' makes the registry load the export of a stage instead of the torch module."""
+    model = make_classifier()
+    pickled = str(tmp_path / 'color.t')
+    torch.save(model, pickled)
+    export_model('color_model', pickled, 'torchscript')
+    registry = ModelRegistry({'color_model': pickled, 'model_backends': {'color_model': 'torchscript'}})
+    loaded = registry.get('color_model')
+    assert isinstance(loaded, torch.jit.ScriptModule)
+    reference, batch = reference_and_batch(model)
+    with torch.no_grad():
+        assert torch.allclose(loaded(batch), reference, atol=1e-5)
+
+
+def test_missing_export_is_reported(tmp_path):
+    """Test that a stage selecting a backend that was never exported fails with the export command."""
+    with pytest.raises(FileNotFoundError, match='--export onnx'):
+        load_exported('color_model', str(tmp_path / 'color.t'), 'onnx')
+
+
+def test_yolo_onnx_parity(tmp_path):
+    """Test that the ONNX export of the general features model finds the same boxes as the .pt weights."""
+    pytest.importorskip('onnx')
+    pytest.importorskip('onnxruntime')
+    with open('main_config.json') as f:
+        weights = json.load(f)['general_features_model']
+    try:
+        model = load_yolo(weights)
+    except Exception as error:
+        pytest.skip(f"the general features model cannot be loaded: {error}")
+    frame = np.random.default_rng(0).integers(0, 255, (480, 640, 3), dtype=np.uint8)
+    export_model('general_features_model', weights, 'onnx')
+    exported = load_exported('general_features_model', weights, 'onnx')
+    reference, candidate = model.predict(frame)[0].boxes, exported.predict(frame)[0].boxes
+    assert len(reference) == len(candidate)
+    assert np.allclose(reference.xyxy.numpy(), candidate.xyxy.numpy(), atol=1.0)
@@ -0,0 +1,100 @@
+"""! @brief Unit test for vehicle_batching module"""
+import json
+import sys
+import threading
+
+try:
+    with open('test_config.json') as f:
+        main_config = json.load(f)
+except :
+    raise FileNotFoundError("The file 'test_config.json' was not found.")
+
+
+sys.path.append(main_config['project_directory'])
+import vehicle_batching
+from vehicle_batching import BatchInferenceServer, SiteServer
+
+
+class BatchModel:
+    """model recording the size of every batch it receives."""
+    def __init__(self):
+        self.batch_sizes = []
+    def predict(self, frames):
+        self.batch_sizes.append(len(frames))
+        return [f'result-{frame}' for frame in frames]
+
+
+def test_results_are_routed_back():
+    """Test that each stream gets the result of its own frame."""
+    model = BatchModel()
+    server = BatchInferenceServer(model, max_batch_size=4, max_wait_s=0.05)
+    server.start()
+    futures = {frame: server.submit(frame) for frame in range(10)}
+    assert all(future.result(timeout=5) == f'result-{frame}' for frame, future in futures.items())
+    server.stop()
+    assert max(model.batch_sizes) <= 4
+    assert sum(model.batch_sizes) == 10
+    assert server.stats()['frames'] == 10
+
+
+def test_streams_share_batches():
+    """Test that frames from several cameras end up in the same predict call."""
+    model = BatchModel()
+    server = BatchInferenceServer(model, max_batch_size=3, max_wait_s=1)
+    server.start()
+    barrier = threading.Barrier(3)
+    results = {}
+
+    def camera(camera_id):
+        barrier.wait()
+        results[camera_id] = server.submit(camera_id).result(timeout=5)
+
+    threads = [threading.Thread(target=camera, args=(camera_id,)) for camera_id in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    server.stop()
+    assert results == {0: 'result-0', 1: 'result-1', 2: 'result-2'}
+    assert model.batch_sizes == [3]
+    assert server.stats()['mean_batch_size'] == 3
+
+
+def test_errors_reach_every_stream():
+    """Test that a failing batch fails every frame of it."""
+    class FailingModel:
+        def predict(self, frames):
+            raise RuntimeError("inference failed")
+    server = BatchInferenceServer(FailingModel(), max_batch_size=2, max_wait_s=0.01)
+    server.start()
+    future = server.submit(0)
+    assert isinstance(future.exception(timeout=5), RuntimeError)
+    server.stop()
+
+
+class FakeCapture:
+    def __init__(self, source):
+        self.frames = [1, 2]
+    def release(self):
+        pass
+
+
+def test_camera_flushes_its_quality_windows_at_the_end(monkeypatch):
+    """Test that the best frames still waiting in a quality window are enriched when the camera's capture ends."""
+    monkeypatch.setattr(vehicle_batching.cv2, 'VideoCapture', FakeCapture)
+    monkeypatch.setattr(vehicle_batching.vehicle_frames, 'read_frame',
+                        lambda cap, sampler: (cap.frames.pop(0), 1) if cap.frames else (None, 0))
+    site = SiteServer(['gate'], model=BatchModel(), publish=lambda features_list: None)
+    stream = site.streams[0]
+    stream.motion_gate, stream.sampler = None, None
+    stream.quality = object()
+    processed, flushed = [], []
+    monkeypatch.setattr(stream, 'process_frame', lambda frame, results, frame_number, bg_subtractor: processed.append(frame))
+    monkeypatch.setattr(stream, 'flush_selected', lambda: flushed.append(len(processed)))
+    site.server.start()
+    stream.running = True
+    try:
+        site.read_camera(stream)
+    finally:
+        site.server.stop()
+    assert processed == [1, 2] and flushed == [2]
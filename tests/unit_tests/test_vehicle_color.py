@@ -3,6 +3,10 @@
 import pytest
 import json
 import sys
+import numpy as np
+import torch
+from PIL import Image
+from torchvision import transforms
 
 try:
     with open('test_config.json') as f:
@@ -12,7 +16,29 @@ except :
 
 
 sys.path.append(main_config['project_directory'])
-from vehicle_color import predict_car_color, identify_vehicle_color 
+import vehicle_color
+from vehicle_color import predict_car_color, identify_vehicle_color, identify_vehicle_colors, preprocess_color_image
+from vehicle_models import ModelRegistry
+
+
+class FakeColorModel:
+    """color model recording the batches it receives and always predicting 'Red'."""
+
+    def __init__(self):
+        self.batches = []
+
+    def __call__(self, batch):
+        self.batches.append(tuple(batch.shape))
+        logits = torch.zeros(batch.shape[0], len(vehicle_color.colors))
+        logits[:, vehicle_color.colors.index('Red')] = 5.0
+        return logits
+
+
+@pytest.fixture
+def color_model(monkeypatch):
+    model = FakeColorModel()
+    monkeypatch.setattr(vehicle_color.vehicle_models, 'registry', ModelRegistry({'color_model': ''}, loaders={'color_model': lambda path: model}))
+    return model
 
 
 def test_predict_car_color():
@@ -25,3 +51,38 @@ def test_predict_car_color():
     # Test case 2: Test with a non-existing image path
     with pytest.raises(FileNotFoundError):
         predict_car_color("non_existing_image.jpg")
+
+
+def test_preprocess_matches_torchvision():
+    """Test that the tensor-native preprocessing gives the same input as the PIL transform it replaces."""
+    reference = transforms.Compose([
+        transforms.Resize(256),
+        transforms.CenterCrop(224),
+        transforms.ToTensor(),
+        transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
+    ])
+    # a smooth gradient, so the difference between the interpolations stays small
+    x, y = np.meshgrid(np.linspace(0, 255, 640), np.linspace(0, 255, 360))
+    image = np.stack([x, y, (x + y) / 2], axis=2).astype(np.uint8)
+    expected = reference(Image.fromarray(image[:, :, ::-1]))
+    tensor = preprocess_color_image(image)
+    assert tensor.shape == (3, 224, 224)
+    assert torch.mean(torch.abs(tensor - expected)) < 0.02
+
+
+def test_identify_vehicle_colors_batches_crops(color_model):
+    """Test that several vehicles go through the model in one batch and small boxes are skipped."""
+    frame = np.zeros((480, 640, 3), dtype=np.uint8)
+    boxes = [[0, 0, 200, 150], [300, 200, 600, 400], [10, 10, 15, 15]]
+    assert identify_vehicle_colors(frame, boxes, 200, 1) == ['Red', 'Red', None]
+    assert color_model.batches == [(2, 3, 224, 224)]
+
+
+def test_identify_vehicle_color_uses_vehicle_box(color_model, monkeypatch):
+    """Test that the color model sees the vehicle's box rather than the whole frame."""
+    seen = []
+    monkeypatch.setattr(vehicle_color, 'predict_car_colors_probabilities', lambda images: seen.extend(images) or np.ones((len(images), 9)))
+    frame = np.zeros((480, 640, 3), dtype=np.uint8)
+    identify_vehicle_color(frame, [], 200, 1, vehicle_box=[100, 50, 300, 200])
+    assert seen[0].shape == (150, 200, 3)
+    assert identify_vehicle_color(frame, [], 200, 1) is None
@@ -0,0 +1,47 @@
+"""! @brief Unit test for vehicle_config module"""
+import json
+import os
+import subprocess
+import sys
+import pytest
+
+try:
+    with open('test_config.json') as f:
+        main_config = json.load(f)
+except :
+    raise FileNotFoundError("The file 'test_config.json' was not found.")
+
+
+sys.path.append(main_config['project_directory'])
+import vehicle_config
+from vehicle_config import config_path, load_config
+
+
+def test_config_is_found_outside_the_working_directory(tmp_path, monkeypatch):
+    """Test that the configuration files are found from any working directory, the environment variable first."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.delenv(vehicle_config.CONFIG_DIR_ENV, raising=False)
+    assert config_path('main_config.json') == os.path.join(vehicle_config.PROJECT_DIR, 'main_config.json')
+    (tmp_path / 'main_config.json').write_text('{"roi": [1, 2, 3, 4]}')
+    assert load_config()['roi'] == [1, 2, 3, 4]
+    other = tmp_path / 'site'
+    other.mkdir()
+    (other / 'main_config.json').write_text('{"roi": []}')
+    monkeypatch.setenv(vehicle_config.CONFIG_DIR_ENV, str(other))
+    assert load_config()['roi'] == []
+    with pytest.raises(FileNotFoundError):
+        config_path('missing_config.json')
+
+
+def test_modules_share_one_config():
+    """Test that every module reads the same parsed main_config.json."""
+    import vehicle_frames
+    import vehicle_stream
+    assert vehicle_frames.vehicle_det_config is vehicle_stream.vehicle_det_config is vehicle_config.vehicle_det_config
+
+
+def test_heavy_libraries_are_imported_lazily():
+    """Test that importing the pipeline imports neither torch nor ultralytics nor easyocr."""
+    code = "import sys, main; print(sorted({'torch', 'ultralytics', 'easyocr'} & set(sys.modules)))"
+    output = subprocess.run([sys.executable, '-c', code], cwd=vehicle_config.PROJECT_DIR, capture_output=True, text=True, check=True)
+    assert output.stdout.strip() == '[]'
@@ -0,0 +1,182 @@
+"""! @brief Unit test for vehicle_event_store module"""
+import json
+import sys
+
+try:
+    with open('test_config.json') as f:
+        main_config = json.load(f)
+except :
+    raise FileNotFoundError("The file 'test_config.json' was not found.")
+
+
+sys.path.append(main_config['project_directory'])
+import vehicle_stream
+from vehicle_event_store import EventStore
+from vehicle_stream import VehicleStream
+
+
+class FakeClock:
+    """clock whose time is set by the test."""
+    def __init__(self, now=1000.0):
+        self.now = now
+    def __call__(self):
+        return self.now
+
+
+def open_store(tmp_path, clock, **options):
+    return EventStore(str(tmp_path / 'passages.db'), clock=clock, compact_interval_s=0, **options)
+
+
+def test_seen_within_per_camera(tmp_path):
+    """Test that a recorded passage is seen within its window, on its camera or on any camera."""
+    clock = FakeClock()
+    store = open_store(tmp_path, clock, index_window_s=60)
+    try:
+        store.record(['car', 'TU 123', 'peugeot', 'Tunisia', 'white'], camera='gate')
+        clock.now += 30
+        assert store.seen_within('tu123', 60, camera='gate')
+        assert store.seen_within('TU123', 60)
+        assert not store.seen_within('TU123', 60, camera='exit')
+        assert not store.seen_within('TU123', 10, camera='gate')
+        assert not store.seen_within('XY999', 60)
+    finally:
+        store.close()
+
+
+def test_passages_survive_a_restart(tmp_path):
+    """Test that a reopened store knows the recent passages, and looks the older ones up in the database."""
+    clock = FakeClock()
+    store = open_store(tmp_path, clock, index_window_s=60)
+    store.record(['car', 'TU123', 'peugeot', 'Tunisia', 'white'], camera='gate')
+    clock.now += 20
+    store.record(['car', 'AB456', 'renault', 'France', 'red'], camera='gate')
+    store.close()
+    clock.now += 50
+    store = open_store(tmp_path, clock, index_window_s=60)
+    try:
+        assert store.seen_within('AB456', 60, camera='gate')
+        # older than the in-memory index, so answered by the database
+        assert store.seen_within('TU123', 3600, camera='gate')
+        assert not store.seen_within('TU123', 60, camera='gate')
+    finally:
+        store.close()
+
+
+def test_query_filters_the_written_passages(tmp_path):
+    """Test the range queries by time, plate and brand, oldest first."""
+    clock = FakeClock()
+    store = open_store(tmp_path, clock, batch_size=2)
+    try:
+        for offset, plate, brand in ((0, 'TU123', 'peugeot'), (10, 'AB456', 'renault'), (20, 'TU123', 'peugeot')):
+            store.record(['car', plate, brand, 'Tunisia', 'white'], camera='gate', timestamp=clock.now + offset)
+        assert store.flush(timeout=5)
+        assert [passage['timestamp'] for passage in store.query()] == [1000.0, 1010.0, 1020.0]
+        assert [passage['timestamp'] for passage in store.query(plate='tu-123')] == [1000.0, 1020.0]
+        assert [passage['registration'] for passage in store.query(brand='renault')] == ['AB456']
+        assert len(store.query(start=1005, end=1020)) == 1
+        assert len(store.query(limit=2)) == 2
+        assert store.stats()['event_store_written'] == 3 and store.stats()['event_store_batches'] >= 2
+    finally:
+        store.close()
+
+
+def test_compact_deletes_the_old_passages(tmp_path):
+    """Test that compaction keeps only the passages within the retention."""
+    clock = FakeClock()
+    store = open_store(tmp_path, clock, retention_s=100)
+    try:
+        store.record(['car', 'TU123', 'peugeot', 'Tunisia', 'white'], camera='gate', timestamp=800)
+        store.record(['car', 'AB456', 'renault', 'France', 'red'], camera='gate', timestamp=950)
+        store.flush(timeout=5)
+        assert store.compact() == 1
+        assert [passage['registration'] for passage in store.query()] == ['AB456']
+    finally:
+        store.close()
+
+
+def test_full_queue_drops_instead_of_blocking(tmp_path):
+    """Test that record() never waits on the writer: a full queue drops the passage."""
+    store = open_store(tmp_path, FakeClock(), queue_size=1)
+    store._queue.put('blocking item')
+    try:
+        assert not store.record(['car', 'TU123', 'peugeot', 'Tunisia', 'white'], camera='gate')
+        assert store.stats()['event_store_dropped'] == 1
+    finally:
+        store._queue.get_nowait()
+        store.close()
+
+
+def test_stream_suppresses_repeat_plates(tmp_path, monkeypatch):
+    """Test that a plate published on a camera is a duplicate there until the repeat window after its last sighting is over."""
+    clock = FakeClock()
+    store = open_store(tmp_path, clock, index_window_s=300)
+    monkeypatch.setattr(vehicle_stream.vehicle_event_store, 'shared_event_store', lambda: store)
+    published = []
+    stream = VehicleStream('gate', publish=published.append, dedup_seconds=0)
+    stream.repeat_seconds = 300
+    try:
+        vehicle = ['car', 'TU123', 'peugeot', 'Tunisia', 'white']
+        assert stream.handle_features(vehicle)
+        stream.dedup.last_seen.clear()
+        clock.now += 100
+        assert not stream.handle_features(vehicle)
+        clock.now += 250
+        assert not stream.handle_features(vehicle)
+        clock.now += 301
+        assert stream.handle_features(vehicle)
+        assert len(published) == 2 and stream.stats.duplicates == 2
+        store.flush(timeout=5)
+        assert len(store.query(plate='TU123', camera='gate')) == 2
+    finally:
+        stream.close()
+        store.close()
+
+
+class RecordingPublisher:
+    """publisher keeping the messages it is given."""
+    def __init__(self):
+        self.messages = []
+    def publish_features(self, features_list, uid=None):
+        self.messages.append(json.loads(vehicle_stream.vehicle_mqtt.build_features_message(features_list, uid)))
+    def stats(self):
+        return {}
+
+
+def test_stored_passage_has_the_uid_of_its_message(tmp_path, monkeypatch):
+    """Test that the passage recorded in the store carries the uid of the MQTT message published for it."""
+    store = open_store(tmp_path, FakeClock())
+    monkeypatch.setattr(vehicle_stream.vehicle_event_store, 'shared_event_store', lambda: store)
+    publisher = RecordingPublisher()
+    stream = VehicleStream('gate', dedup_seconds=0, publisher=publisher)
+    try:
+        assert stream.handle_features(['car', 'TU123', 'peugeot', 'Tunisia', 'white'])
+        store.flush(timeout=5)
+        message = publisher.messages[0]
+        assert store.query(plate='TU123')[0]['uid'] == message['uidpassage'] == message['classificators'][0]['uid']
+    finally:
+        stream.close()
+        store.close()
+
+
+def test_lingering_plate_is_not_published_again(tmp_path, monkeypatch):
+    """Test that every duplicate refreshes the last sighting, so a car seen longer than the repeat window is published once."""
+    clock = FakeClock()
+    store = open_store(tmp_path, clock, index_window_s=300)
+    monkeypatch.setattr(vehicle_stream.vehicle_event_store, 'shared_event_store', lambda: store)
+    published = []
+    stream = VehicleStream('gate', publish=published.append, dedup_seconds=0)
+    stream.repeat_seconds = 300
+    try:
+        vehicle = ['car', 'TU123', 'peugeot', 'Tunisia', 'white']
+        for _ in range(5):
+            stream.handle_features(vehicle)
+            stream.dedup.last_seen.clear()
+            clock.now += 200
+        assert len(published) == 1 and stream.stats.duplicates == 4
+        store.flush(timeout=5)
+        assert len(store.query(plate='TU123')) == 1
+        clock.now += 301
+        assert stream.handle_features(vehicle)
+    finally:
+        stream.close()
+        store.close()
@@ -0,0 +1,74 @@
+"""! @brief Unit test for vehicle_features module"""
+import json
+import sys
+import numpy as np
+
+try:
+    with open('test_config.json') as f:
+        main_config = json.load(f)
+except :
+    raise FileNotFoundError("The file 'test_config.json' was not found.")
+
+
+sys.path.append(main_config['project_directory'])
+from vehicle_features import crop_box, select_features, filter_process_objects
+
+
+def test_crop_box_is_a_view():
+    """Test that the crop shares the frame's buffer."""
+    frame = np.zeros((100, 200, 3), dtype=np.uint8)
+    crop = crop_box(frame, [50, 20, 90, 40], gain=1, pad=0)
+    assert crop.shape == (20, 40, 3)
+    crop[:] = 255
+    assert frame[20:40, 50:90].min() == 255
+    assert frame.sum() == crop.sum()
+
+
+def test_crop_box_is_enlarged_and_clipped():
+    """Test the save_crop-like enlargement and the clipping to the frame."""
+    frame = np.zeros((100, 200, 3), dtype=np.uint8)
+    crop = crop_box(frame, [50, 20, 90, 40])
+    assert crop.shape == (31, 51, 3)
+    crop = crop_box(frame, [-10, -10, 250, 150])
+    assert crop.shape == (100, 200, 3)
+
+
+class Boxes:
+    """stands for ultralytics' Boxes."""
+    def __init__(self, cls, conf):
+        self.cls = np.array(cls, dtype=np.float32)
+        self.conf = np.array(conf, dtype=np.float32)
+    def cpu(self):
+        return self
+    def numpy(self):
+        return self
+
+
+class Result:
+    """stands for one ultralytics Results object."""
+    def __init__(self, cls, conf):
+        self.boxes = Boxes(cls, conf)
+
+
+def test_select_features():
+    """Test the selection of the type, the plate and the brand."""
+    assert select_features([0, 2, 14], [0.9, 0.8, 0.7]) == ['car', 'LP', 'Kia']
+    # the car/truck tie-break keeps the more confident type
+    assert select_features([0, 1, 2, 14], [0.4, 0.8, 0.8, 0.7]) == ['truck', 'LP', 'Kia']
+    # the most confident brand wins, among the classes 3 to 35 only
+    assert select_features([0, 2, 14, 35, 9], [0.9, 0.8, 0.5, 0.9, 0.6]) == ['car', 'LP', 'Ibiza']
+    assert select_features([0, 2, 14, 37, 9], [0.9, 0.8, 0.5, 0.9, 0.6]) == ['car', 'LP', 'BMW']
+    assert select_features([0, 2, 36], [0.9, 0.8, 0.9]) is None
+    # each feature must pass its threshold
+    assert select_features([0, 2, 14], [0.9, 0.45, 0.7]) is None
+    assert select_features([0, 2, 14], [0.9, 0.8, 0.4]) is None
+    assert select_features([0, 2, 14], [0.2, 0.8, 0.7]) is None
+    assert select_features([2, 14, 15], [0.8, 0.7, 0.6]) is None
+    assert select_features([], []) is None
+
+
+def test_filter_process_objects_over_several_results():
+    """Test that detections from every result are considered together."""
+    assert filter_process_objects([Result([0, 2], [0.9, 0.8]), Result([14], [0.7])]) == ['car', 'LP', 'Kia']
+    assert filter_process_objects([Result([0, 2, 14, 3, 5, 2], [0.9, 0.6, 0.7, 0.1, 0.2, 0.9])]) == ['car', 'LP', 'Kia']
+    assert filter_process_objects([]) is None
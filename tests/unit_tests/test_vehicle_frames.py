@@ -0,0 +1,118 @@
+"""! @brief Unit test for vehicle_frames module"""
+import json
+import sys
+import numpy as np
+
+try:
+    with open('test_config.json') as f:
+        main_config = json.load(f)
+except :
+    raise FileNotFoundError("The file 'test_config.json' was not found.")
+
+
+sys.path.append(main_config['project_directory'])
+from vehicle_frames import RegionOfInterest, FrameSampler, read_frame
+from vehicle_initialize_detection import object_detection_loop
+
+
+class Cap:
+    """video source counting the frames grabbed and decoded."""
+
+    def __init__(self, frames=100):
+        self.frames = frames
+        self.position = 0
+        self.grabs = 0
+        self.reads = 0
+
+    def grab(self):
+        if self.position >= self.frames:
+            return False
+        self.position += 1
+        self.grabs += 1
+        return True
+
+    def read(self):
+        if self.position >= self.frames:
+            return False, None
+        self.position += 1
+        self.reads += 1
+        return True, np.full((480, 640, 3), self.position % 256, dtype=np.uint8)
+
+
+class Boxes:
+    def __init__(self, count):
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+
+class Result:
+    def __init__(self, count):
+        self.boxes = Boxes(count)
+
+
+class Model:
+    def __init__(self, count=0):
+        self.count = count
+        self.shapes = []
+
+    def predict(self, frame, **options):
+        self.shapes.append(frame.shape)
+        return [Result(self.count)]
+
+
+def test_rectangle_roi_is_a_view():
+    """Test that a single rectangle crops the frame without copying it."""
+    frame = np.zeros((480, 640, 3), dtype=np.uint8)
+    crop = RegionOfInterest([[100, 200, 500, 480]]).apply(frame)
+    assert crop.shape == (280, 400, 3)
+    assert crop.base is frame
+
+
+def test_relative_polygon_roi_is_masked():
+    """Test that a polygon in fractions of the frame crops to its bounds and blacks out the rest."""
+    frame = np.full((100, 200, 3), 255, dtype=np.uint8)
+    crop = RegionOfInterest([[[0.5, 0.0], [1.0, 0.0], [1.0, 1.0]]]).apply(frame)
+    assert crop.shape == (100, 100, 3)
+    assert crop[5, 95].tolist() == [255, 255, 255]
+    assert crop[95, 5].tolist() == [0, 0, 0]
+
+
+def test_sampler_grows_stride_when_idle():
+    """Test that one frame in stride is decoded, and one in idle_stride once nothing is detected."""
+    sampler = FrameSampler(stride=2, idle_stride=5, idle_after=3)
+    decisions = [sampler.should_decode() for _ in range(6)]
+    assert decisions == [True, False, True, False, True, False]
+    for _ in range(3):
+        sampler.observe(False)
+    assert sampler.current_stride() == 5
+    decisions = [sampler.should_decode() for _ in range(10)]
+    assert decisions.count(True) == 2
+    sampler.observe(True)
+    assert sampler.current_stride() == 2
+
+
+def test_skipped_frames_are_grabbed_not_decoded():
+    """Test that the frames the sampler skips are only grabbed and still counted."""
+    cap = Cap()
+    sampler = FrameSampler(stride=4)
+    numbers = []
+    frame_number = 0
+    for _ in range(5):
+        frame, consumed = read_frame(cap, sampler)
+        frame_number += consumed
+        numbers.append(frame_number)
+    assert numbers == [1, 5, 9, 13, 17]
+    assert (cap.reads, cap.grabs) == (5, 12)
+
+
+def test_object_detection_loop_with_sampler():
+    """Test that the model sees the region of interest and the frame numbers follow the source."""
+    cap, model = Cap(), Model()
+    sampler = FrameSampler(roi=RegionOfInterest([[0, 240, 640, 480]]), stride=3)
+    frame, results, frame_number = object_detection_loop(model, cap, 0, None, sampler)
+    frame, results, frame_number = object_detection_loop(model, cap, frame_number, None, sampler)
+    assert frame_number == 4
+    assert model.shapes == [(240, 640, 3), (240, 640, 3)]
+    assert sampler.frames_without_detection == 2
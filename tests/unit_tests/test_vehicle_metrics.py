@@ -0,0 +1,120 @@
+"""! @brief Unit test for vehicle_metrics module"""
+import json
+import sys
+import time
+import urllib.error
+import urllib.request
+import pytest
+
+try:
+    with open('test_config.json') as f:
+        main_config = json.load(f)
+except :
+    raise FileNotFoundError("The file 'test_config.json' was not found.")
+
+
+sys.path.append(main_config['project_directory'])
+from vehicle_metrics import Metrics, Histogram, StartupTimer
+
+
+def test_disabled_metrics_leave_the_functions_untouched():
+    """Test that disabled metrics neither wrap the functions nor allocate a timer per block."""
+    metrics = Metrics(enabled=False)
+
+    def stage_function():
+        return 1
+    assert metrics.timed('stage')(stage_function) is stage_function
+    assert metrics.stage('a') is metrics.stage('b')
+    metrics.register_collector('stream', lambda: {'frames': 1})
+    assert metrics.histograms == {} and metrics.collect() == []
+
+
+def test_timed_and_stage_record_every_call():
+    """Test that the decorator and the context manager add one observation per call, even when it raises."""
+    metrics = Metrics(enabled=True)
+
+    @metrics.timed('recognize_license_plate')
+    def recognize(fail=False):
+        """reads a plate."""
+        if fail:
+            raise ValueError
+        return 'TU123'
+    assert recognize() == 'TU123' and recognize.__doc__ == "reads a plate."
+    with pytest.raises(ValueError):
+        recognize(fail=True)
+    with metrics.stage('decode'):
+        time.sleep(0.002)
+    assert metrics.histograms['recognize_license_plate'].count == 2
+    assert metrics.histograms['decode'].sum >= 0.002
+
+
+def test_histogram_quantile():
+    """Test that the quantiles are interpolated within the bucket that holds them."""
+    histogram = Histogram(buckets=(0.01, 0.1, 1.0))
+    assert histogram.quantile(0.5) is None
+    for seconds in [0.005] * 50 + [0.05] * 45 + [0.5] * 5:
+        histogram.observe(seconds)
+    assert 0 < histogram.quantile(0.5) <= 0.01
+    assert 0.01 < histogram.quantile(0.95) <= 0.1
+    assert 0.1 < histogram.quantile(0.99) <= 1.0
+
+
+def test_exposition_format():
+    """Test the cumulative buckets, the gauges of the collectors and the label escaping."""
+    metrics = Metrics(enabled=True)
+    metrics.observe('inference:color_model', 0.003)
+    metrics.observe('inference:color_model', 30.0)
+    metrics.register_collector('pipeline', lambda: {'frames_dropped': 4, 'frame_queue_depth': 2, 'policy': 'block'},
+                               source='rtsp://gate"1')
+    metrics.register_collector('broken', lambda: 1 / 0)
+    text = metrics.exposition()
+    assert 'vehicle_stage_seconds_bucket{stage="inference:color_model",le="0.0025"} 0' in text
+    assert 'vehicle_stage_seconds_bucket{stage="inference:color_model",le="0.005"} 1' in text
+    assert 'vehicle_stage_seconds_bucket{stage="inference:color_model",le="+Inf"} 2' in text
+    assert 'vehicle_stage_seconds_count{stage="inference:color_model"} 2' in text
+    assert '# TYPE vehicle_frames_dropped gauge' in text
+    assert 'vehicle_frames_dropped{component="pipeline",source="rtsp://gate\\"1"} 4.0' in text
+    assert 'policy' not in text
+    metrics.unregister_collector('pipeline', source='rtsp://gate"1')
+    assert 'frames_dropped' not in metrics.exposition()
+
+
+def test_metrics_endpoint():
+    """Test that /metrics is served over HTTP and every other path is a 404."""
+    metrics = Metrics(enabled=True)
+    metrics.observe('decode', 0.001)
+    server = metrics.serve(0)
+    try:
+        url = f'http://127.0.0.1:{server.server_port}'
+        with urllib.request.urlopen(url + '/metrics', timeout=5) as response:
+            assert response.status == 200
+            assert 'vehicle_stage_seconds_count{stage="decode"} 1' in response.read().decode()
+        with pytest.raises(urllib.error.HTTPError):
+            urllib.request.urlopen(url + '/', timeout=5)
+    finally:
+        metrics.stop()
+
+
+def test_periodic_log_line():
+    """Test that the summary line is logged periodically until the metrics are stopped."""
+    metrics = Metrics(enabled=True)
+    metrics.observe('filter_process_objects', 0.0001)
+    lines = []
+    metrics.log_every(0.01, log=lines.append)
+    time.sleep(0.1)
+    metrics.stop()
+    assert lines and lines[0].startswith('metrics: filter_process_objects n=1 p50=')
+
+
+def test_startup_timer_marks_each_phase_once():
+    """Test that each phase keeps its first time and that the first frame logs the startup line."""
+    lines = []
+    startup = StartupTimer(log=lines.append)
+    startup.mark('imports')
+    first = startup.phases['imports']
+    startup.mark('imports')
+    startup.mark('first_frame')
+    startup.mark('first_frame')
+    assert startup.phases['imports'] == first and 0 < first <= startup.phases['first_frame']
+    assert len(lines) == 1 and lines[0].startswith('startup: imports ')
+    assert set(startup.stats()) == {'startup_imports_s', 'startup_first_frame_s'}
@@ -0,0 +1,116 @@
+"""! @brief Unit test for vehicle_models module"""
+import threading
+import time
+import json
+import sys
+
+try:
+    with open('test_config.json') as f:
+        main_config = json.load(f)
+except :
+    raise FileNotFoundError("The file 'test_config.json' was not found.")
+
+
+sys.path.append(main_config['project_directory'])
+import vehicle_metrics
+import vehicle_stream
+from vehicle_models import ModelRegistry, OCR_KEY
+
+config = {
+    'color_model': 'models/final_model_85.t',
+    'generic_nationality_model': 'models/nationality_generic.pt',
+    'europe_nationality_model': 'models/europe_nationality_lp.pt',
+    'general_features_model': 'models/best.pt',
+}
+
+
+def make_registry(calls):
+    """creates a registry whose loaders only record what they were asked to load."""
+    def fake_loader(path):
+        time.sleep(0.01)
+        calls.append(path)
+        return object()
+    loaders = {key: fake_loader for key in list(config) + [OCR_KEY]}
+    return ModelRegistry(config, loaders=loaders)
+
+
+def test_get_loads_once():
+    """Test that a model is loaded on first use only."""
+    calls = []
+    registry = make_registry(calls)
+    first = registry.get('color_model')
+    second = registry.get('color_model')
+    assert first is second
+    assert calls == ['models/final_model_85.t']
+    assert registry.is_loaded('color_model')
+    assert not registry.is_loaded('general_features_model')
+
+
+def test_get_is_thread_safe():
+    """Test that concurrent first uses still load the model once."""
+    calls = []
+    registry = make_registry(calls)
+    models = []
+    threads = [threading.Thread(target=lambda: models.append(registry.get('general_features_model'))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+    assert all(model is models[0] for model in models)
+
+
+def test_shared_path_shares_model():
+    """Test that two keys pointing at the same weights share one instance."""
+    calls = []
+    shared_config = dict(config, europe_nationality_model=config['generic_nationality_model'])
+    registry = ModelRegistry(shared_config, loaders={key: (lambda path: calls.append(path) or object()) for key in config})
+    assert registry.get('generic_nationality_model') is registry.get('europe_nationality_model')
+    assert len(calls) == 1
+
+
+def test_preload_and_report():
+    """Test that load and inference times are reported separately."""
+    calls = []
+    registry = make_registry(calls)
+    registry.preload()
+    assert len(calls) == 5
+    assert calls[-1] == ['en']
+    with registry.inference('color_model'):
+        pass
+    with registry.inference('color_model'):
+        pass
+    report = registry.report()
+    assert report['color_model']['calls'] == 2
+    assert report['color_model']['load_s'] > 0
+    assert report['general_features_model']['calls'] == 0
+    assert report['general_features_model']['inference_mean_s'] is None
+
+
+def test_warm_up_runs_every_model_once():
+    """Test that the warm-up runs each model on a blank input without counting it as an inference."""
+    registry = make_registry([])
+    warmed = []
+    registry.warmers = {key: (lambda model, key=key: warmed.append(key)) for key in registry.loaders}
+    registry.warm_up(['color_model', OCR_KEY])
+    assert warmed == ['color_model', OCR_KEY]
+    report = registry.report()
+    assert report['color_model']['warm_up_s'] >= 0 and report['color_model']['calls'] == 0
+
+
+def test_first_frame_is_marked_by_a_frame_not_by_an_inference(monkeypatch):
+    """Test that a general features inference outside the frame loops (e.g. a warm-up) does not mark the first frame."""
+    startup = vehicle_metrics.StartupTimer(log=lambda line: None)
+    monkeypatch.setattr(vehicle_metrics, 'startup', startup)
+    registry = make_registry([])
+    with registry.inference('general_features_model'):
+        pass
+    assert 'first_frame' not in startup.phases
+    stream = vehicle_stream.VehicleStream('video', publish=lambda features_list: None, stats_interval_frames=0)
+    stream.tracker, stream.quality = None, None
+    monkeypatch.setattr(vehicle_stream, 'identify_features', lambda *arguments: None)
+    try:
+        stream.process_frame(None, [], 1, None)
+    finally:
+        stream.close()
+    assert 'first_frame' in startup.phases
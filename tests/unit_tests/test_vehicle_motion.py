@@ -0,0 +1,99 @@
+"""! @brief Unit test for vehicle_motion module"""
+import json
+import sys
+import numpy as np
+
+try:
+    with open('test_config.json') as f:
+        main_config = json.load(f)
+except :
+    raise FileNotFoundError("The file 'test_config.json' was not found.")
+
+
+sys.path.append(main_config['project_directory'])
+from vehicle_motion import MotionGate
+from vehicle_initialize_detection import object_detection_loop
+
+
+class FakeClock:
+    """clock whose time is set by the test."""
+    def __init__(self):
+        self.now = 0.0
+    def __call__(self):
+        return self.now
+
+
+def empty_frame():
+    """returns a frame of the empty gate."""
+    return np.full((240, 320, 3), 60, dtype=np.uint8)
+
+
+def frame_with_vehicle():
+    """returns a frame with a bright block standing for a vehicle."""
+    frame = empty_frame()
+    frame[60:200, 80:260] = 220
+    return frame
+
+
+def warm_up(gate, frames=50):
+    """lets the background subtractor learn the empty gate."""
+    for _ in range(frames):
+        gate.should_detect(empty_frame())
+
+
+def test_idle_frames_are_skipped():
+    """Test that a static scene stops running the model once the hold window is over."""
+    clock = FakeClock()
+    gate = MotionGate(hold_frames=3, cooldown_s=0, clock=clock)
+    warm_up(gate)
+    assert not gate.should_detect(empty_frame())
+    stats = gate.stats()
+    assert stats['gate_skipped'] > 0
+    assert stats['gate_skipped_ratio'] > 0.5
+
+
+def test_motion_opens_the_gate_and_hold_window():
+    """Test that motion opens the gate and it stays open for hold_frames frames."""
+    clock = FakeClock()
+    gate = MotionGate(hold_frames=3, cooldown_s=0, clock=clock)
+    warm_up(gate)
+    assert gate.should_detect(frame_with_vehicle())
+    decisions = [gate.should_detect(empty_frame()) for _ in range(6)]
+    # the vehicle leaving is motion too, then the hold window runs out
+    assert decisions[:3] == [True, True, True]
+    assert decisions[-1] is False
+
+
+def test_cooldown_keeps_the_gate_open():
+    """Test that the gate stays open cooldown_s seconds after the last motion."""
+    clock = FakeClock()
+    gate = MotionGate(hold_frames=0, cooldown_s=5, clock=clock)
+    warm_up(gate)
+    gate.should_detect(frame_with_vehicle())
+    # the vehicle stops at the barrier and becomes part of the background
+    for _ in range(30):
+        gate.should_detect(frame_with_vehicle())
+    clock.now += 4
+    assert gate.should_detect(frame_with_vehicle())
+    clock.now += 2
+    assert not gate.should_detect(frame_with_vehicle())
+
+
+def test_object_detection_loop_skips_the_model():
+    """Test that gated frames get empty results without calling the model."""
+    class Cap:
+        def read(self):
+            return True, empty_frame()
+
+    class Model:
+        calls = 0
+        def predict(self, frame):
+            Model.calls += 1
+            return ['result']
+
+    gate = MotionGate(hold_frames=0, cooldown_s=0)
+    warm_up(gate)
+    frame, results, frame_number = object_detection_loop(Model(), Cap(), 7, gate)
+    assert results == []
+    assert frame_number == 8
+    assert Model.calls == 0
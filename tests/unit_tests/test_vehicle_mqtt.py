@@ -3,6 +3,10 @@ import unittest
 from unittest.mock import MagicMock, patch
 import json
 import sys
+import time
+import socket
+import shutil
+import tempfile
 
 try:
     with open('test_config.json') as f:
@@ -12,7 +16,8 @@ except :
 
 
 sys.path.append(main_config['project_directory'])
-from vehicle_mqtt import connect_mqtt, features_to_json, run
+from vehicle_mqtt import connect_mqtt, features_to_json, run, MQTTPublisher, MessageSpool
+from vehicle_mqtt_broker import StandInBroker
 
 class Test_vehicle_mqtt(unittest.TestCase):
     """Test case class for your module."""
@@ -71,3 +76,82 @@ class Test_vehicle_mqtt(unittest.TestCase):
             run(features_list)
             self.mocked_client.loop_start.assert_called_once()
 
+
+
+class Test_MQTTPublisher(unittest.TestCase):
+    """Test case class for the persistent publisher, against the stand-in broker."""
+
+    def setUp(self):
+        self.spool_dir = tempfile.mkdtemp()
+        self.broker = None
+
+    def tearDown(self):
+        if self.broker is not None:
+            self.broker.stop()
+        shutil.rmtree(self.spool_dir, ignore_errors=True)
+
+    def make_publisher(self, port, **kwargs):
+        return MQTTPublisher('127.0.0.1', port, 'features_message', spool_dir=self.spool_dir,
+                             reconnect_delays_s=(0.1, 0.2), **kwargs)
+
+    def test_publishes_over_one_connection(self):
+        """Test that every message reuses the same connection."""
+        self.broker = StandInBroker().start()
+        publisher = self.make_publisher(self.broker.port).start()
+        for plate in ['TU123', 'TU124', 'TU125']:
+            publisher.publish_features(['car', plate, 'Kia', 'Tunisia', 'white'])
+        self.assertTrue(self.broker.wait_for_messages(3))
+        publisher.stop()
+        self.assertEqual(self.broker.connections, 1)
+        self.assertEqual([json.loads(payload)['registration'] for _, payload, _ in self.broker.messages], ['TU123', 'TU124', 'TU125'])
+        self.assertEqual({qos for _, _, qos in self.broker.messages}, {1})
+        self.assertEqual(publisher.stats()['published'], 3)
+
+    def test_buffers_during_outage(self):
+        """Test that messages published while the broker is down are spooled then flushed in order."""
+        with socket.socket() as reserved:
+            reserved.bind(('127.0.0.1', 0))
+            port = reserved.getsockname()[1]
+        publisher = self.make_publisher(port).start()
+        for plate in ['TU1', 'TU2']:
+            publisher.publish_features(['car', plate, 'Kia', 'Tunisia', 'white'])
+        time.sleep(0.3)
+        self.assertEqual(publisher.stats()['spool_size'], 2)
+        self.broker = StandInBroker(port=port).start()
+        self.assertTrue(self.broker.wait_for_messages(2))
+        publisher.publish_features(['car', 'TU3', 'Kia', 'Tunisia', 'white'])
+        self.assertTrue(self.broker.wait_for_messages(3))
+        publisher.stop()
+        self.assertEqual([json.loads(payload)['registration'] for _, payload, _ in self.broker.messages], ['TU1', 'TU2', 'TU3'])
+        self.assertEqual(publisher.stats()['spool_size'], 0)
+
+    def test_spool_evicts_oldest_and_survives_restart(self):
+        """Test that the spool is bounded and is read back by a new spool on the same directory."""
+        spool = MessageSpool(self.spool_dir, max_messages=2)
+        for payload in ['a', 'b', 'c']:
+            spool.append(payload)
+        self.assertEqual(spool.evicted, 1)
+        reopened = MessageSpool(self.spool_dir, max_messages=2)
+        self.assertEqual([payload for _, payload in reopened.peek(10)], ['b', 'c'])
+        reopened.append('d')
+        self.assertEqual([payload for _, payload in reopened.peek(10)], ['c', 'd'])
+
+    def test_publishers_of_two_sources_keep_their_own_spool(self):
+        """Test that two cameras spooling during the same outage neither overwrite nor delete each other's messages."""
+        with socket.socket() as reserved:
+            reserved.bind(('127.0.0.1', 0))
+            port = reserved.getsockname()[1]
+        publishers = [self.make_publisher(port, source=source, spool_max_messages=2).start() for source in ('cam1', 'cam2')]
+        for index in range(3):
+            for camera, publisher in enumerate(publishers):
+                publisher.publish_features(['car', f'C{camera}P{index}', 'Kia', 'Tunisia', 'white'])
+        time.sleep(0.3)
+        self.assertEqual([publisher.stats()['spool_size'] for publisher in publishers], [2, 2])
+        self.assertNotEqual(publishers[0].spool.directory, publishers[1].spool.directory)
+        self.broker = StandInBroker(port=port).start()
+        self.assertTrue(self.broker.wait_for_messages(4))
+        for publisher in publishers:
+            self.assertTrue(publisher._worker.is_alive())
+            publisher.stop()
+        self.assertEqual(sorted(json.loads(payload)['registration'] for _, payload, _ in self.broker.messages),
+                         ['C0P1', 'C0P2', 'C1P1', 'C1P2'])
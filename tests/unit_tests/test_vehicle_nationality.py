@@ -0,0 +1,118 @@
+"""! @brief Unit test for vehicle_nationality module"""
+import json
+import sys
+import numpy as np
+
+try:
+    with open('test_config.json') as f:
+        main_config = json.load(f)
+except :
+    raise FileNotFoundError("The file 'test_config.json' was not found.")
+
+
+sys.path.append(main_config['project_directory'])
+from vehicle_nationality import NationalityCache, NationalityCascade
+from vehicle_models import ModelRegistry
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class Boxes:
+    def __init__(self, detections):
+        self.cls = np.array([class_id for class_id, _ in detections], dtype=float)
+        self.conf = np.array([conf for _, conf in detections], dtype=float)
+
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return self
+
+
+class Result:
+    def __init__(self, detections):
+        self.boxes = Boxes(detections)
+
+
+class FakeYolo:
+    """nationality model returning the same detections for every crop and counting its calls."""
+
+    def __init__(self, detections):
+        self.detections = detections
+        self.calls = 0
+
+    def predict(self, image):
+        self.calls += 1
+        return [Result(self.detections)]
+
+
+def make_cascade(generic_detections, europe_detections, **options):
+    generic, europe = FakeYolo(generic_detections), FakeYolo(europe_detections)
+    registry = ModelRegistry({'generic_nationality_model': 'generic.pt', 'europe_nationality_model': 'europe.pt'},
+                             loaders={'generic_nationality_model': lambda path: generic, 'europe_nationality_model': lambda path: europe})
+    return NationalityCascade(registry=registry, **options), generic, europe
+
+
+crop = np.zeros((20, 60, 3), dtype=np.uint8)
+
+
+def test_non_european_plate_skips_europe_model():
+    """Test that the Europe model is not run when the generic model confidently picks another nationality."""
+    cascade, generic, europe = make_cascade([(3, 0.9), (0, 0.2)], [(2, 0.8)], cache=NationalityCache(), europe_margin=0.15)
+    assert cascade.classify(crop) == 'tunisia'
+    assert (generic.calls, europe.calls) == (1, 0)
+
+
+def test_european_plate_runs_europe_model_once():
+    """Test that a confident European plate gets its country from the Europe model."""
+    cascade, generic, europe = make_cascade([(0, 0.9), (3, 0.2)], [(1, 0.4), (2, 0.8)], cache=NationalityCache(), europe_margin=0.3)
+    assert cascade.classify(crop) == 'France'
+    assert (generic.calls, europe.calls) == (1, 1)
+
+
+def test_narrow_europe_win_runs_europe_model():
+    """Test that an uncertain 'europe' win falls through to the Europe model rather than returning the runner-up."""
+    cascade, _, europe = make_cascade([(0, 0.5), (6, 0.45)], [(2, 0.8)], cache=NationalityCache(), europe_margin=0.15)
+    assert cascade.classify(crop) == 'France'
+    assert europe.calls == 1
+
+
+def test_narrow_win_over_europe_asks_europe_model():
+    """Test that a nationality barely beating 'europe' is checked by the Europe model, which wins only if more confident."""
+    cascade, _, europe = make_cascade([(6, 0.5), (0, 0.45)], [(2, 0.8)], cache=NationalityCache(), europe_margin=0.15)
+    assert cascade.classify(crop) == 'France'
+    cascade, _, europe = make_cascade([(6, 0.5), (0, 0.45)], [(2, 0.3)], cache=NationalityCache(), europe_margin=0.15)
+    assert cascade.classify(crop) == 'libya'
+    assert europe.calls == 1
+
+
+def test_returning_plate_costs_no_inference():
+    """Test that a plate seen before is answered by the cache until its entry expires."""
+    clock = FakeClock()
+    cascade, generic, europe = make_cascade([(0, 0.9)], [(5, 0.7)], cache=NationalityCache(ttl_s=60, clock=clock))
+    for _ in range(3):
+        assert cascade.predict(crop, 'AB123CD') == 'Germany'
+    assert (generic.calls, europe.calls) == (1, 1)
+    stats = cascade.stats()
+    assert (stats['nationality_cache_hits'], stats['nationality_cache_misses']) == (2, 1)
+    clock.now = 61
+    cascade.predict(crop, 'AB123CD')
+    assert generic.calls == 2
+
+
+def test_cache_evicts_least_recently_used():
+    """Test that the cache stays bounded and keeps the plates looked up recently."""
+    cache = NationalityCache(max_size=2)
+    cache.put('A', 'tunisia')
+    cache.put('B', 'libya')
+    assert cache.get('A') == 'tunisia'
+    cache.put('C', 'egypt')
+    assert cache.get('B') is None
+    assert cache.get('A') == 'tunisia' and cache.get('C') == 'egypt'
+    assert len(cache) == 2
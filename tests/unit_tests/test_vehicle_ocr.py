@@ -0,0 +1,91 @@
+"""! @brief Unit test for vehicle_ocr module"""
+import json
+import sys
+import numpy as np
+
+try:
+    with open('test_config.json') as f:
+        main_config = json.load(f)
+except :
+    raise FileNotFoundError("The file 'test_config.json' was not found.")
+
+
+sys.path.append(main_config['project_directory'])
+from vehicle_ocr import PlateOCR, stack_crops, PLATE_ALLOWLIST
+from vehicle_models import ModelRegistry, OCR_KEY
+
+
+class FakeReader:
+    """EasyOCR reader answering the plate whose number is the crop's gray level."""
+
+    def __init__(self):
+        self.recognize_calls = []
+        self.readtext_calls = 0
+
+    def recognize(self, image, horizontal_list=None, free_list=None, allowlist=None, batch_size=1, reformat=True):
+        self.recognize_calls.append((image.shape, len(horizontal_list), allowlist))
+        results = []
+        for x_min, x_max, y_min, y_max in horizontal_list:
+            level = int(image[y_min, x_min])
+            if level:
+                results.append(([[x_min, y_min], [x_max, y_min], [x_max, y_max], [x_min, y_max]], f'tu {level}', 0.9))
+        return results
+
+    def readtext(self, image, allowlist=None):
+        self.readtext_calls += 1
+        return [([[30, 0], [60, 0], [60, 20], [30, 20]], '123', 0.8), ([[0, 0], [25, 0], [25, 20], [0, 20]], 'tu', 0.6)]
+
+
+def make_ocr(reader, **options):
+    registry = ModelRegistry({}, loaders={OCR_KEY: lambda languages: reader})
+    return PlateOCR(registry=registry, **options)
+
+
+def test_stack_crops():
+    """Test that crops of different sizes are stacked with one box each."""
+    stacked, boxes = stack_crops([np.ones((20, 60), dtype=np.uint8), np.ones((30, 90), dtype=np.uint8)])
+    assert stacked.shape == (54, 90)
+    assert boxes == [[0, 60, 0, 20], [0, 90, 24, 54]]
+
+
+def test_read_plates_in_one_recognition_call():
+    """Test that a batch skips the text detector and maps every reading back to its crop."""
+    reader = FakeReader()
+    ocr = make_ocr(reader, skip_detection=True, batch_size=8)
+    crops = [np.full((20, 60, 3), level, dtype=np.uint8) for level in (11, 0, 13)]
+    readings = ocr.read_plates(crops)
+    assert readings == [('TU11', 0.9), ('', 0.0), ('TU13', 0.9)]
+    assert reader.recognize_calls == [((68, 60), 3, PLATE_ALLOWLIST)]
+    assert reader.readtext_calls == 0
+    stats = ocr.stats()
+    assert stats['ocr_plates'] == 3 and stats['ocr_batches'] == 1
+    assert stats['ocr_ms_per_plate'] > 0
+
+
+def test_batch_size_splits_calls():
+    """Test that the crops are read in batches of batch_size."""
+    reader = FakeReader()
+    ocr = make_ocr(reader, batch_size=2)
+    ocr.read_plates([np.full((20, 60), 5, dtype=np.uint8)] * 5)
+    assert [calls for _, calls, _ in reader.recognize_calls] == [2, 2, 1]
+
+
+def test_detection_path_joins_boxes_left_to_right():
+    """Test that the text detector path is still available and sorts the boxes by x."""
+    reader = FakeReader()
+    ocr = make_ocr(reader, skip_detection=False)
+    text, score = ocr.read_plate(np.zeros((20, 60, 3), dtype=np.uint8))
+    assert text == 'TU123'
+    assert abs(score - (0.6 * 2 + 0.8 * 3) / 5) < 1e-9
+    assert reader.readtext_calls == 1
+
+
+def test_empty_crop_does_not_fail_its_batch():
+    """Test that an empty crop reads as nothing while the other crops of its batch are still read."""
+    reader = FakeReader()
+    ocr = make_ocr(reader, skip_detection=True, batch_size=8)
+    crops = [np.full((20, 60, 3), 11, dtype=np.uint8), np.zeros((0, 5, 3), dtype=np.uint8), np.full((20, 60, 3), 13, dtype=np.uint8)]
+    assert ocr.read_plates(crops) == [('TU11', 0.9), ('', 0.0), ('TU13', 0.9)]
+    assert [calls for _, calls, _ in reader.recognize_calls] == [2]
+    assert ocr.stats()['ocr_plates'] == 2
+    assert ocr.read_plates([np.zeros((0, 5, 3), dtype=np.uint8)]) == [('', 0.0)]
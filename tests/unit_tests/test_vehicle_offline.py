@@ -0,0 +1,104 @@
+"""! @brief Unit test for vehicle_offline module"""
+import os
+import csv
+import json
+import sys
+
+try:
+    with open('test_config.json') as f:
+        main_config = json.load(f)
+except :
+    raise FileNotFoundError("The file 'test_config.json' was not found.")
+
+
+sys.path.append(main_config['project_directory'])
+import cv2
+import numpy as np
+import vehicle_offline
+from vehicle_offline import collect_inputs, run_batch, ResultWriter, process_file
+from vehicle_quality import QualitySelector
+
+
+def fake_process(path):
+    """worker finding one vehicle per file, named after the file."""
+    return path, [['car', os.path.basename(path), 'Kia', 'tunisia', 'Red']], None
+
+
+def make_files(directory, names):
+    paths = []
+    for name in names:
+        path = os.path.join(directory, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        open(path, 'w').close()
+        paths.append(path)
+    return paths
+
+
+def read_jsonl(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_collect_inputs(tmp_path):
+    """Test that directories, globs and manifests expand to the media files, without duplicates."""
+    a, b, c, _ = make_files(str(tmp_path), ['clips/a.mp4', 'clips/b.png', 'other/c.avi', 'clips/notes.md'])
+    manifest = tmp_path / 'manifest.txt'
+    manifest.write_text("# audit\nother/c.avi\nclips/a.mp4\n")
+    assert collect_inputs([str(tmp_path / 'clips')]) == [a, b]
+    assert collect_inputs([str(tmp_path / '**' / '*.avi')]) == [c]
+    assert collect_inputs([str(manifest), str(tmp_path / 'clips')]) == [c, a, b]
+
+
+def test_batch_writes_every_vehicle(tmp_path):
+    """Test that the vehicles of every file are written and checkpointed."""
+    files = make_files(str(tmp_path), ['a.mp4', 'b.mp4', 'c.jpg'])
+    output = str(tmp_path / 'results.jsonl')
+    stats = run_batch([str(tmp_path)], output, workers=1, process=fake_process)
+    assert stats['processed'] == 3 and stats['vehicles'] == 3
+    assert [row['registration'] for row in read_jsonl(output)] == ['a.mp4', 'b.mp4', 'c.jpg']
+    with open(output + '.checkpoint') as f:
+        assert f.read().split() == files
+
+
+def test_batch_resumes_after_crash(tmp_path):
+    """Test that a resumed run skips the finished files and drops the rows of the unfinished one."""
+    a, b = make_files(str(tmp_path), ['a.mp4', 'b.mp4'])
+    output = str(tmp_path / 'results.jsonl')
+    writer = ResultWriter(output)
+    writer.write(a, [['car', 'a.mp4', 'Kia', 'tunisia', 'Red']])
+    # the process died after writing the rows of b but before its checkpoint
+    writer._file.write(json.dumps({'source': b, 'vehicle': 0, 'registration': 'partial'}) + '\n')
+    writer.close()
+    processed = []
+    stats = run_batch([str(tmp_path)], output, workers=1, process=lambda path: processed.append(path) or fake_process(path))
+    assert processed == [b]
+    assert stats['skipped'] == 1
+    assert [row['registration'] for row in read_jsonl(output)] == ['a.mp4', 'b.mp4']
+
+
+def test_batch_csv_across_processes(tmp_path):
+    """Test the process pool and the CSV output."""
+    make_files(str(tmp_path), ['a.mp4', 'b.mp4', 'c.mp4', 'd.mp4'])
+    output = str(tmp_path / 'results.csv')
+    stats = run_batch([str(tmp_path / '*.mp4')], output, workers=2, process=fake_process)
+    assert stats['workers'] == 2
+    with open(output, newline='') as f:
+        rows = list(csv.DictReader(f))
+    assert sorted(row['registration'] for row in rows) == ['a.mp4', 'b.mp4', 'c.mp4', 'd.mp4']
+    assert rows[0]['country'] == 'tunisia'
+
+
+class FakeModel:
+    def predict(self, frame, **options):
+        return ['results']
+
+
+def test_image_is_enriched_with_quality_selection(tmp_path, monkeypatch):
+    """Test that an image input is enriched at once even when the quality selection is enabled."""
+    path = str(tmp_path / 'gate.png')
+    cv2.imwrite(path, np.zeros((8, 8, 3), dtype=np.uint8))
+    monkeypatch.setattr(vehicle_offline.vehicle_stream.vehicle_quality, 'create_quality_selector', lambda: QualitySelector(window_frames=5))
+    monkeypatch.setattr(vehicle_offline.vehicle_models.registry, 'get', lambda key: FakeModel())
+    monkeypatch.setattr(vehicle_offline.vehicle_stream, 'identify_features',
+                        lambda frame, results, frame_number, bg_subtractor: ['car', 'TU123', 'Kia', 'tunisia', 'Red'])
+    assert process_file(path) == (path, [['car', 'TU123', 'Kia', 'tunisia', 'Red']], None)
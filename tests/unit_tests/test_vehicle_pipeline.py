@@ -0,0 +1,311 @@
+"""! @brief Unit test for vehicle_pipeline module"""
+import json
+import sys
+import threading
+import time
+import pytest
+
+try:
+    with open('test_config.json') as f:
+        main_config = json.load(f)
+except :
+    raise FileNotFoundError("The file 'test_config.json' was not found.")
+
+
+sys.path.append(main_config['project_directory'])
+import vehicle_pipeline
+from vehicle_pipeline import BoundedQueue, VehiclePipeline
+
+
+def drain(queue):
+    """returns every item left in a closed queue."""
+    queue.close()
+    items = []
+    while True:
+        item = queue.get()
+        if item is None:
+            return items
+        items.append(item)
+
+
+def test_unknown_policy():
+    """Test that an unknown policy is rejected."""
+    with pytest.raises(ValueError):
+        BoundedQueue(2, 'drop_newest')
+
+
+def test_drop_oldest():
+    """Test that the newest items are kept."""
+    queue = BoundedQueue(2, 'drop_oldest')
+    for item in range(5):
+        assert queue.put(item)
+    assert queue.dropped == 3
+    assert drain(queue) == [3, 4]
+
+
+def test_skip_n():
+    """Test that a full queue discards the next N items in a row."""
+    queue = BoundedQueue(2, 'skip_n', skip_n=3)
+    accepted = [queue.put(item) for item in range(3)]
+    assert queue.get() == 0
+    accepted += [queue.put(item) for item in range(3, 6)]
+    assert accepted == [True, True, False, False, False, True]
+    assert queue.dropped == 3
+    assert drain(queue) == [1, 5]
+
+
+def test_block_waits_for_the_consumer():
+    """Test that the 'block' policy loses nothing."""
+    queue = BoundedQueue(1, 'block')
+    received = []
+    consumer = threading.Thread(target=lambda: [received.append(queue.get()) for _ in range(3)])
+    consumer.start()
+    for item in range(3):
+        assert queue.put(item)
+    consumer.join(timeout=5)
+    assert received == [0, 1, 2]
+    assert queue.dropped == 0
+
+
+def test_get_timeout():
+    """Test that get returns None when nothing arrives in time."""
+    queue = BoundedQueue(1)
+    start = time.monotonic()
+    assert queue.get(timeout=0.05) is None
+    assert time.monotonic() - start >= 0.05
+
+
+def test_slow_enrichment_does_not_stall_detection(monkeypatch):
+    """Test that detection keeps running while a plate read is slow."""
+    frames = list(range(1, 21))
+
+    class Cap:
+        def read(self):
+            if frames:
+                return True, frames.pop(0)
+            return False, None
+        def release(self):
+            pass
+
+    class Model:
+        def predict(self, frame):
+            return frame
+
+    class Registry:
+        def get(self, key):
+            return Model()
+        def inference(self, key):
+            return threading.Lock()
+
+    release_enrichment = threading.Event()
+
+    def slow_enrich(final_features, frame, results, frame_number, contours):
+        release_enrichment.wait(5)
+        return ['car', f'PLATE{frame_number}', 'Kia', 'tunisia', 'Red']
+
+    monkeypatch.setattr(vehicle_pipeline.vehicle_models, 'registry', Registry())
+    monkeypatch.setattr(vehicle_pipeline.cv2, 'VideoCapture', lambda source: Cap())
+    monkeypatch.setattr(vehicle_pipeline.vehicle_features, 'filter_process_objects', lambda results: ['car', 'LP', 'Kia'])
+    monkeypatch.setattr(vehicle_pipeline.vehicle_stream, 'foreground_contours', lambda bg, frame: [])
+    monkeypatch.setattr(vehicle_pipeline.vehicle_stream, 'enrich_features', slow_enrich)
+    vehicles = []
+    pipeline = VehiclePipeline('video', vehicles.append, enrichment_workers=1, frame_queue_size=4, frame_policy='block',
+                               enrichment_queue_size=2, enrichment_policy='drop_oldest')
+    pipeline.motion_gate = None
+    pipeline.start()
+    deadline = time.monotonic() + 5
+    while pipeline.frames_detected < 20 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert pipeline.frames_detected == 20
+    release_enrichment.set()
+    pipeline.join()
+    stats = pipeline.stats()
+    assert stats['frames_captured'] == 20
+    assert stats['enrichment_dropped'] > 0
+    assert vehicles[-1][1] == 'PLATE20'
+    assert stats['vehicles'] == len(vehicles) == 20 - stats['enrichment_dropped']
+
+
+def test_enrich_shared_frame_releases_the_slot(monkeypatch):
+    """Test that an enrichment process sees the frame and the boxes of its slot, and frees the slot even on failure."""
+    import numpy as np
+    from vehicle_shm import FrameRing
+    seen = []
+
+    def enrich(final_features, frame, results, frame_number, contours):
+        boxes = results[0].boxes.cpu().numpy()
+        seen.append((int(frame[0, 0, 0]), results[0].orig_img is frame, len(boxes), frame_number))
+        if frame_number == 2:
+            raise RuntimeError("model failure")
+        return final_features + ['tunisia', 'Red']
+
+    monkeypatch.setattr(vehicle_pipeline.vehicle_stream, 'enrich_features', enrich)
+    ring = FrameRing(1, (8, 8, 3))
+    detections = (np.zeros((2, 4), dtype=np.float32), np.array([0, 2]), np.array([0.9, 0.8]))
+    try:
+        slot = ring.write(np.full((8, 8, 3), 9, dtype=np.uint8), 1)
+        features = vehicle_pipeline.enrich_shared_frame(ring, (slot, ['car', 'LP', 'Kia'], detections, 1, []))
+        assert features == ['car', 'LP', 'Kia', 'tunisia', 'Red']
+        slot = ring.write(np.full((8, 8, 3), 9, dtype=np.uint8), 2)
+        with pytest.raises(RuntimeError):
+            vehicle_pipeline.enrich_shared_frame(ring, (slot, ['car', 'LP', 'Kia'], detections, 2, []))
+        assert seen == [(9, True, 2, 1), (9, True, 2, 2)]
+        assert ring.stats()['ring_slots_in_use'] == 0
+    finally:
+        ring.close()
+
+
+def failing_enrich_task(ring, task):
+    """enrichment of the processes of the tests: fails on frame 2, kills its process on frame 4 of a 'die' run."""
+    import os
+    slot, final_features, detections, frame_number, contours = task
+    frame, _ = ring.read(slot)
+    if frame_number == 4 and frame[0, 0, 0] == 255:
+        # a hard death (e.g. out of memory): the slot is never released
+        os._exit(3)
+    ring.release(slot)
+    if frame_number == 2:
+        raise RuntimeError("model failure")
+    return final_features[:1] + [f'PLATE{frame_number}'] + final_features[2:] + ['tunisia', 'Red']
+
+
+def run_process_pipeline(monkeypatch, level, policy):
+    """runs a pipeline with one enrichment process over 6 frames of the given gray level."""
+    import numpy as np
+    frames = [np.full((8, 8, 3), level, dtype=np.uint8) for _ in range(6)]
+
+    class Cap:
+        def read(self):
+            if frames:
+                return True, frames.pop(0)
+            return False, None
+        def get(self, prop):
+            return 8
+        def release(self):
+            pass
+
+    class Model:
+        def predict(self, frame, **options):
+            return frame
+
+    class Registry:
+        def get(self, key):
+            return Model()
+        def inference(self, key):
+            return threading.Lock()
+
+    monkeypatch.setattr(vehicle_pipeline.vehicle_models, 'registry', Registry())
+    monkeypatch.setattr(vehicle_pipeline.cv2, 'VideoCapture', lambda source: Cap())
+    monkeypatch.setattr(vehicle_pipeline.vehicle_features, 'filter_process_objects', lambda results: ['car', 'LP', 'Kia'])
+    monkeypatch.setattr(vehicle_pipeline.vehicle_stream, 'foreground_contours', lambda bg, frame: [])
+    monkeypatch.setattr(vehicle_pipeline.vehicle_tracker, 'extract_detections',
+                        lambda results: (np.zeros((1, 4), dtype=np.float32), np.array([2]), np.array([0.9])))
+    vehicles = []
+    pipeline = VehiclePipeline('video', vehicles.append, frame_queue_size=8, frame_policy='block',
+                               enrichment_queue_size=2, enrichment_policy=policy, enrichment_processes=1)
+    pipeline.motion_gate = pipeline.sampler = pipeline.quality = None
+    pipeline.enrich_task = failing_enrich_task
+    return pipeline.run(), vehicles
+
+
+def test_process_enrichment_survives_a_failing_task(monkeypatch):
+    """Test that an exception in an enrichment process is counted and the next frames are still enriched."""
+    stats, vehicles = run_process_pipeline(monkeypatch, 9, 'block')
+    assert sorted(plate for _, plate, *_ in vehicles) == ['PLATE1', 'PLATE3', 'PLATE4', 'PLATE5', 'PLATE6']
+    assert stats['enrichment_errors'] == 1 and stats['enrichment_processes_died'] == 0
+    assert stats['ring_slots_in_use'] == 0
+
+
+def test_dead_enrichment_process_does_not_hang_the_pipeline(monkeypatch):
+    """Test that the pipeline ends, with its slots freed, when its only enrichment process is killed."""
+    stats, vehicles = run_process_pipeline(monkeypatch, 255, 'block')
+    assert stats['enrichment_processes_died'] == 1
+    # the vehicles a killed process had not flushed to the queue yet are lost with it
+    assert set(plate for _, plate, *_ in vehicles) <= {'PLATE1', 'PLATE3'}
+    assert stats['ring_slots_in_use'] == 0
+
+
+def test_enrichment_thread_survives_a_failing_frame(monkeypatch):
+    """Test that an exception in enrich_features or on_vehicle is counted and the worker keeps consuming the queue."""
+    frames = list(range(1, 7))
+
+    class Cap:
+        def read(self):
+            if frames:
+                return True, frames.pop(0)
+            return False, None
+        def release(self):
+            pass
+
+    class Model:
+        def predict(self, frame, **options):
+            return frame
+
+    class Registry:
+        def get(self, key):
+            return Model()
+        def inference(self, key):
+            return threading.Lock()
+
+    def enrich(final_features, frame, results, frame_number, contours):
+        if frame_number == 2:
+            raise RuntimeError("model failure")
+        return ['car', f'PLATE{frame_number}', 'Kia', 'tunisia', 'Red']
+
+    vehicles = []
+
+    def on_vehicle(features_list):
+        if features_list[1] == 'PLATE4':
+            raise ConnectionError("publish failure")
+        vehicles.append(features_list)
+
+    monkeypatch.setattr(vehicle_pipeline.vehicle_models, 'registry', Registry())
+    monkeypatch.setattr(vehicle_pipeline.cv2, 'VideoCapture', lambda source: Cap())
+    monkeypatch.setattr(vehicle_pipeline.vehicle_features, 'filter_process_objects', lambda results: ['car', 'LP', 'Kia'])
+    monkeypatch.setattr(vehicle_pipeline.vehicle_stream, 'foreground_contours', lambda bg, frame: [])
+    monkeypatch.setattr(vehicle_pipeline.vehicle_stream, 'enrich_features', enrich)
+    pipeline = VehiclePipeline('video', on_vehicle, enrichment_workers=1, frame_queue_size=2, frame_policy='block',
+                               enrichment_queue_size=1, enrichment_policy='block', enrichment_processes=0)
+    pipeline.motion_gate = pipeline.sampler = pipeline.quality = None
+    stats = pipeline.run()
+    assert [plate for _, plate, *_ in vehicles] == ['PLATE1', 'PLATE3', 'PLATE5', 'PLATE6']
+    assert stats['enrichment_errors'] == 2
+
+
+def test_detection_survives_a_failing_predict(monkeypatch):
+    """Test that a frame whose predict raises is counted and skipped, and the 'block' capture still reaches the end."""
+    frames = list(range(1, 11))
+
+    class Cap:
+        def read(self):
+            if frames:
+                return True, frames.pop(0)
+            return False, None
+        def release(self):
+            pass
+
+    class Model:
+        def predict(self, frame, **options):
+            if frame == 3:
+                raise ValueError("frame larger than the slot")
+            return frame
+
+    class Registry:
+        def get(self, key):
+            return Model()
+        def inference(self, key):
+            return threading.Lock()
+
+    monkeypatch.setattr(vehicle_pipeline.vehicle_models, 'registry', Registry())
+    monkeypatch.setattr(vehicle_pipeline.cv2, 'VideoCapture', lambda source: Cap())
+    monkeypatch.setattr(vehicle_pipeline.vehicle_features, 'filter_process_objects', lambda results: ['car', 'LP', 'Kia'])
+    monkeypatch.setattr(vehicle_pipeline.vehicle_stream, 'foreground_contours', lambda bg, frame: [])
+    monkeypatch.setattr(vehicle_pipeline.vehicle_stream, 'enrich_features',
+                        lambda final_features, frame, results, frame_number, contours: ['car', f'PLATE{frame_number}', 'Kia', 'tunisia', 'Red'])
+    vehicles = []
+    pipeline = VehiclePipeline('video', vehicles.append, enrichment_workers=1, frame_queue_size=1, frame_policy='block',
+                               enrichment_queue_size=1, enrichment_policy='block', enrichment_processes=0)
+    pipeline.motion_gate = pipeline.sampler = pipeline.quality = None
+    stats = pipeline.run()
+    assert sorted(int(plate[5:]) for _, plate, *_ in vehicles) == [1, 2, 4, 5, 6, 7, 8, 9, 10]
+    assert stats['detection_errors'] == 1 and stats['frames_captured'] == 10
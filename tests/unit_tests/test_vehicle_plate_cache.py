@@ -0,0 +1,122 @@
+"""! @brief Unit test for vehicle_plate_cache module"""
+import json
+import sys
+import cv2
+import numpy as np
+
+try:
+    with open('test_config.json') as f:
+        main_config = json.load(f)
+except :
+    raise FileNotFoundError("The file 'test_config.json' was not found.")
+
+
+sys.path.append(main_config['project_directory'])
+from vehicle_plate_cache import PlateCache, dhash, hamming
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def plate(text, noise=0.0, scale=1.0):
+    """draws a synthetic plate crop."""
+    image = np.full((60, 200, 3), 235, dtype=np.uint8)
+    cv2.rectangle(image, (2, 2), (197, 57), (0, 0, 0), 2)
+    cv2.putText(image, text, (12, 42), cv2.FONT_HERSHEY_SIMPLEX, 1.2, (20, 20, 20), 3)
+    if noise:
+        image = np.clip(image + np.random.default_rng(0).normal(0, noise, image.shape), 0, 255).astype(np.uint8)
+    if scale != 1.0:
+        image = cv2.resize(image, None, fx=scale, fy=scale)
+    return image
+
+
+def test_dhash_is_stable_on_near_duplicates():
+    """Test that noise and rescaling barely change the hash while another plate changes it a lot."""
+    reference = dhash(plate('TU 1234'))
+    assert hamming(reference, dhash(plate('TU 1234', noise=8))) <= 4
+    assert hamming(reference, dhash(plate('TU 1234', scale=1.1))) <= 4
+    assert hamming(reference, dhash(plate('AB 9876'))) > 12
+
+
+def test_near_duplicate_crop_hits():
+    """Test that a near-identical crop returns the cached result and a different plate misses."""
+    cache = PlateCache()
+    crop_hash, cached = cache.lookup(plate('TU 1234'), ('gate', 1))
+    assert cached is None
+    cache.store(crop_hash, ('TU1234', 'tunisia'))
+    assert cache.lookup(plate('TU 1234', noise=8), ('gate', 1))[1] == ('TU1234', 'tunisia')
+    assert cache.lookup(plate('AB 9876'), ('gate', 1))[1] is None
+    stats = cache.stats()
+    assert (stats['plate_cache_hits'], stats['plate_cache_misses']) == (1, 2)
+
+
+def test_entries_expire_and_size_is_bounded():
+    """Test the time-based eviction and the size bound."""
+    clock = FakeClock()
+    cache = PlateCache(max_size=2, ttl_s=5, clock=clock)
+    for index, text in enumerate(['TU 1234', 'AB 9876', 'XY 0000']):
+        clock.now = index
+        cache.store(cache.lookup(plate(text), ('gate', index))[0], text)
+    assert len(cache) == 2
+    assert cache.lookup(plate('TU 1234'), ('gate', 0))[1] is None
+    assert cache.lookup(plate('XY 0000'), ('gate', 2))[1] == 'XY 0000'
+    clock.now = 10
+    assert cache.lookup(plate('XY 0000'), ('gate', 2))[1] is None
+    assert len(cache) == 0
+
+
+def test_plates_one_character_apart_miss():
+    """Test that two plates differing by one character, whose hashes can match, never share a cached result."""
+    cache = PlateCache()
+    for track_id, text in enumerate(['123 TU 4567', '123 TU 4568']):
+        crop_hash, cached = cache.lookup(plate(text), ('gate', track_id))
+        assert cached is None
+        cache.store(crop_hash, (text, 'tunisia'))
+    assert hamming(dhash(plate('123 TU 4567')), dhash(plate('123 TU 4568'))) <= cache.max_distance
+    assert cache.lookup(plate('123 TU 4567'), None) == (None, None)
+    assert cache.stats()['plate_cache_hits'] == 0
+
+
+def test_recognize_plate_crop_uses_the_cache(monkeypatch):
+    """Test that the plate stages run once for the near-identical crops of a passage."""
+    import vehicle_license
+    calls = []
+    monkeypatch.setattr(vehicle_license, 'plate_cache', PlateCache())
+    monkeypatch.setattr(vehicle_license, 'read_license_plate', lambda crop: calls.append('ocr') or 'TU1234')
+    monkeypatch.setattr(vehicle_license, 'predict_generic_nationality', lambda crop, plate=None: calls.append('nationality') or 'tunisia')
+    for noise in (0, 5, 8):
+        assert vehicle_license.recognize_plate_crop(plate('TU 1234', noise=noise), 1, scope=('gate', 1)) == ('TU1234', 'tunisia')
+    assert calls == ['ocr', 'nationality']
+    vehicle_license.recognize_plate_crop(plate('TU 1234'), 2, scope=('gate', 2))
+    assert calls == ['ocr', 'nationality'] * 2
+
+
+def test_better_crop_of_a_cached_track_reaches_ocr(monkeypatch):
+    """Test that a track enriched again for a better crop is read by the OCR, not answered by the cache."""
+    import vehicle_license
+    import vehicle_stream
+    from vehicle_tracker import Track
+    readings = iter(['TU123', 'TU1234'])
+    calls = []
+    monkeypatch.setattr(vehicle_license, 'plate_cache', PlateCache())
+    monkeypatch.setattr(vehicle_license, 'read_license_plates_with_score',
+                        lambda crops: [calls.append('ocr') or (next(readings), 0.9) for _ in crops])
+    monkeypatch.setattr(vehicle_license, 'predict_generic_nationality', lambda crop, plate=None: 'tunisia')
+    monkeypatch.setattr(vehicle_stream.vehicle_color, 'identify_vehicle_colors', lambda frame, boxes, *arguments, **options: ['Red'] * len(boxes))
+    stream = vehicle_stream.VehicleStream('gate', publish=lambda features_list: None, stats_interval_frames=0)
+    track = Track(1, [0, 0, 200, 60], 0, 0.9)
+    track.brand_scores = {14: 0.7}
+    frame = plate('TU 1234')
+    try:
+        boxes = [([0, 0, 200, 60], [0, 0, 200, 60])]
+        [(_, first)] = stream.enrich_tracks([track], frame, 1, boxes)
+        track.mark_enriched(first, quality=1.0)
+        [(_, second)] = stream.enrich_tracks([track], frame, 2, boxes)
+    finally:
+        stream.close()
+    assert (first[1], second[1]) == ('TU123', 'TU1234') and calls == ['ocr', 'ocr']
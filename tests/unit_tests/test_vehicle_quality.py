@@ -0,0 +1,109 @@
+"""! @brief Unit test for vehicle_quality module"""
+import json
+import sys
+import cv2
+import numpy as np
+
+try:
+    with open('test_config.json') as f:
+        main_config = json.load(f)
+except :
+    raise FileNotFoundError("The file 'test_config.json' was not found.")
+
+
+sys.path.append(main_config['project_directory'])
+import vehicle_stream
+from vehicle_quality import FrameQualityScorer, QualitySelector
+from vehicle_tracker import VehicleTracker
+
+PLATE_BOX = [200, 200, 440, 255]
+
+
+def plate_frame():
+    """frame holding a readable plate in PLATE_BOX."""
+    frame = np.full((480, 640, 3), 90, dtype=np.uint8)
+    cv2.rectangle(frame, (200, 200), (440, 255), (235, 235, 235), -1)
+    cv2.putText(frame, "123 TU 4567", (210, 242), cv2.FONT_HERSHEY_SIMPLEX, 1.0, (20, 20, 20), 2)
+    return frame
+
+
+class LevelScorer:
+    """scorer reading the quality of a frame from its first pixel."""
+    def score(self, frame, lp_box, lp_conf=1.0):
+        return frame[0, 0, 0] / 255
+
+
+def test_scorer_ranks_sharp_plates_first():
+    """Test that blur, darkness and a tiny box lower the score of a plate."""
+    scorer = FrameQualityScorer()
+    frame = plate_frame()
+    sharp = scorer.score(frame, PLATE_BOX)
+    blurred = scorer.score(cv2.GaussianBlur(frame, (21, 21), 8), PLATE_BOX)
+    dark = scorer.score((frame * 0.1).astype(np.uint8), PLATE_BOX)
+    assert sharp > blurred > dark
+    assert scorer.factors(cv2.GaussianBlur(frame, (21, 21), 8), PLATE_BOX)['area'] == 1.0
+    assert scorer.score(frame, [200, 200, 230, 210]) == 0.0
+    assert scorer.score(frame, None) == 0.0
+
+
+def test_selector_releases_the_best_frames_of_a_window():
+    """Test that only the top_k candidates of a window are released, best first, when the window closes."""
+    selector = QualitySelector(LevelScorer(), top_k=2, window_frames=4, min_score=0.2)
+    released = []
+    for frame_number, score in zip(range(1, 5), (0.5, 0.9, 0.1, 0.7)):
+        released += selector.offer('car', frame_number, score, frame_number)
+    assert released == [('car', [2, 4])]
+    assert selector.stats() == {'quality_candidates': 4, 'quality_rejected': 1, 'quality_selected': 2}
+
+
+def test_selector_closes_the_window_of_a_vehicle_that_left():
+    """Test that a vehicle not offered for window_frames frames gets its window released, and flush releases the rest."""
+    selector = QualitySelector(LevelScorer(), top_k=1, window_frames=5)
+    assert selector.offer(1, 1, 0.6, 'first') == []
+    assert selector.offer(2, 3, 0.8, 'second') == []
+    assert selector.expire(5) == []
+    assert selector.expire(6) == [(1, ['first'])]
+    assert selector.flush() == [(2, ['second'])]
+
+
+def test_stream_enriches_the_best_frame_of_a_track(monkeypatch):
+    """Test that with the quality selector the tracker path reads the plate of the best frame of the window only."""
+    enrichments = []
+    monkeypatch.setattr(vehicle_stream.vehicle_license, 'recognize_plate_crops',
+                        lambda crops, frame_number, **options: enrichments.append(frame_number) or [('ABC123', 'tunisia')] * len(crops))
+    monkeypatch.setattr(vehicle_stream.vehicle_color, 'identify_vehicle_colors', lambda frame, boxes, *arguments, **options: ['Red'] * len(boxes))
+    monkeypatch.setattr(vehicle_stream.vehicle_tracker, 'extract_detections', lambda results: results)
+    published = []
+    stream = vehicle_stream.VehicleStream('video', publish=published.append, stats_interval_frames=0)
+    stream.tracker = VehicleTracker()
+    stream.voting = False
+    stream.quality = QualitySelector(LevelScorer(), top_k=1, window_frames=5)
+    car = [(0, 100, 200, 250, 0, 0.9), (80, 200, 120, 220, 2, 0.8), (90, 150, 110, 170, 14, 0.7)]
+    boxes = (np.array(car, dtype=np.float32)[:, :4], np.array([0, 2, 14]), np.array([0.9, 0.8, 0.7]))
+    for frame_number, level in zip(range(1, 11), (100, 120, 250, 110, 90, 240, 240, 240, 240, 240)):
+        stream.process_frame(np.full((480, 640, 3), level, dtype=np.uint8), boxes, frame_number, None)
+    assert enrichments == [3]
+    assert published == [['car', 'ABC123', 'Kia', 'tunisia', 'Red']]
+    assert stream.stats_dict()['quality_selected'] == 1
+
+
+def test_stream_tries_the_next_best_frame_when_the_plate_is_unreadable(monkeypatch):
+    """Test that without the tracker the selected frames are enriched best first until one identifies the vehicle."""
+    enriched = []
+
+    def fake_enrich(final_features, frame, results, frame_number, contours):
+        enriched.append(frame_number)
+        return None if frame_number == 2 else final_features + ['tunisia', 'Red']
+
+    monkeypatch.setattr(vehicle_stream, 'foreground_contours', lambda bg, frame: [])
+    monkeypatch.setattr(vehicle_stream, 'enrich_features', fake_enrich)
+    monkeypatch.setattr(vehicle_stream.vehicle_features, 'filter_process_objects', lambda results: ['car', 'LP', 'Kia'])
+    monkeypatch.setattr(vehicle_stream.vehicle_quality, 'best_plate_box', lambda results: (PLATE_BOX, 0.9))
+    published = []
+    stream = vehicle_stream.VehicleStream('video', publish=published.append, stats_interval_frames=0)
+    stream.tracker = None
+    stream.quality = QualitySelector(LevelScorer(), top_k=3, window_frames=4)
+    for frame_number, level in zip(range(1, 5), (100, 250, 200, 150)):
+        stream.process_frame(np.full((8, 8, 3), level, dtype=np.uint8), None, frame_number, None)
+    assert enriched == [2, 3]
+    assert published == [['car', 'LP', 'Kia', 'tunisia', 'Red']]
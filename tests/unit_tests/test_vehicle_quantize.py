@@ -0,0 +1,102 @@
+"""! @brief Unit test for vehicle_quantize module"""
+import json
+import sys
+import cv2
+import numpy as np
+import pytest
+import torch
+
+try:
+    with open('test_config.json') as f:
+        main_config = json.load(f)
+except :
+    raise FileNotFoundError("The file 'test_config.json' was not found.")
+
+
+sys.path.append(main_config['project_directory'])
+import vehicle_quantize
+from vehicle_quantize import CalibrationReader, model_input, sample_images, quantize_model, measure, compare
+from vehicle_backends import load_exported
+
+
+def make_classifier():
+    """small CNN with the input and the 9 outputs of the color model."""
+    torch.manual_seed(0)
+    model = torch.nn.Sequential(torch.nn.Conv2d(3, 8, 3, stride=2), torch.nn.ReLU(), torch.nn.Conv2d(8, 16, 3, stride=2),
+                                torch.nn.ReLU(), torch.nn.AdaptiveAvgPool2d(1), torch.nn.Flatten(), torch.nn.Linear(16, 9))
+    return model.eval()
+
+
+def random_images(count, shape=(120, 160, 3)):
+    rng = np.random.default_rng(0)
+    return [rng.integers(0, 255, shape, dtype=np.uint8) for _ in range(count)]
+
+
+def test_calibration_reader_rewinds():
+    """Test that the reader feeds every input once per pass."""
+    reader = CalibrationReader('images', [np.zeros(1), np.ones(1)])
+    assert [batch['images'][0] for batch in iter(reader.get_next, None)] == [0, 1]
+    reader.rewind()
+    assert reader.get_next()['images'][0] == 0
+
+
+def test_model_input_shapes():
+    """Test that the color model gets its normalized 224 crop and the YOLO models a letterboxed square in [0, 1]."""
+    image = random_images(1, (300, 500, 3))[0]
+    assert model_input('color_model', image).shape == (1, 3, 224, 224)
+    letterboxed = model_input('generic_nationality_model', image)
+    assert letterboxed.shape == (1, 3, 640, 640) and letterboxed.dtype == np.float32
+    assert 0 <= letterboxed.min() and letterboxed.max() <= 1
+
+
+def test_sample_images_split_plates_and_vehicles(tmp_path, monkeypatch):
+    """Test that the nationality models calibrate on the plate crops and the color model on the vehicle crops."""
+    for name, level in (('LP_cropped1.jpg', 10), ('LP_cropped2_0.jpg', 10), ('_1_0.jpg', 200)):
+        cv2.imwrite(str(tmp_path / name), np.full((20, 60, 3), level, dtype=np.uint8))
+    monkeypatch.setitem(vehicle_quantize.vehicle_det_config, 'quantization_crops_dir', str(tmp_path))
+    plates = sample_images('europe_nationality_model')
+    vehicles = sample_images('color_model')
+    assert len(plates) == 2 and all(plate.mean() < 50 for plate in plates)
+    assert len(vehicles) == 1 and vehicles[0].mean() > 150
+    assert len(sample_images('europe_nationality_model', limit=1)) == 1
+
+
+def test_missing_calibration_folder(monkeypatch):
+    """Test that calibrating without any image folder is reported."""
+    monkeypatch.setitem(vehicle_quantize.vehicle_det_config, 'quantization_calibration_dir', '')
+    monkeypatch.setitem(vehicle_quantize.vehicle_det_config, 'quantization_crops_dir', '')
+    monkeypatch.setitem(vehicle_quantize.vehicle_det_config, 'debug_crops_dir', '')
+    with pytest.raises(FileNotFoundError):
+        sample_images('general_features_model')
+
+
+@pytest.mark.parametrize('mode', ['static', 'dynamic'])
+def test_quantized_classifier_agrees_with_torch(tmp_path, mode):
+    """Test that the INT8 color model keeps the predictions of the float model and is smaller."""
+    pytest.importorskip('onnx')
+    pytest.importorskip('onnxruntime')
+    model = make_classifier()
+    pickled = str(tmp_path / 'color.t')
+    torch.save(model, pickled)
+    images = random_images(16)
+    target = quantize_model('color_model', pickled, mode, images)
+    assert target == str(tmp_path / 'color.int8.onnx')
+    quantized = load_exported('color_model', pickled, 'onnx_int8')
+    batch = torch.cat([torch.from_numpy(model_input('color_model', image)) for image in images])
+    with torch.no_grad():
+        reference = torch.softmax(model(batch), dim=1)
+    probabilities = torch.softmax(quantized(batch), dim=1)
+    assert (probabilities - reference).abs().max() < 0.05
+
+
+def test_measure_and_compare(tmp_path):
+    """Test that a variant is measured and compared on latency, size and memory."""
+    pickled = str(tmp_path / 'color.t')
+    torch.save(make_classifier(), pickled)
+    measures = measure('color_model', pickled, 'torch', random_images(2), runs=5)
+    assert measures['backend'] == 'torch' and measures['top1'] is None
+    assert measures['latency_p50_ms'] > 0 and measures['size_mb'] > 0
+    faster = dict(measures, latency_p50_ms=measures['latency_p50_ms'] / 2, size_mb=measures['size_mb'] / 4, top1=0.5)
+    delta = compare(dict(measures, top1=0.6), faster)
+    assert delta['speedup'] == pytest.approx(2) and delta['size_ratio'] == pytest.approx(0.25)
+    assert delta['top1'] == pytest.approx(-0.1)
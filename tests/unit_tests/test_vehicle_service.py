@@ -0,0 +1,124 @@
+"""! @brief Unit test for vehicle_service module"""
+import json
+import sys
+import threading
+import http.client
+import cv2
+import numpy as np
+
+try:
+    with open('test_config.json') as f:
+        main_config = json.load(f)
+except :
+    raise FileNotFoundError("The file 'test_config.json' was not found.")
+
+
+sys.path.append(main_config['project_directory'])
+import vehicle_service
+from vehicle_service import RecognitionService
+
+
+class BatchModel:
+    """model recording the size of every batch it receives."""
+    def __init__(self, gate=None):
+        self.batch_sizes = []
+        self.gate = gate
+    def predict(self, frames, **options):
+        if self.gate is not None:
+            self.gate.wait(timeout=5)
+        self.batch_sizes.append(len(frames))
+        return [f'results-{int(frame.mean())}' for frame in frames]
+
+
+def encoded(level):
+    return cv2.imencode('.png', np.full((32, 32, 3), level, dtype=np.uint8))[1].tobytes()
+
+
+def fake_recognize(frame, results, frame_number):
+    """vehicle found on the bright snapshots only."""
+    if results[0] == 'results-0':
+        return None
+    return ['car', 'TU123', 'peugeot', 'Tunisia', results[0]]
+
+
+def post(port, body, path='/recognize'):
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+    connection.request('POST', path, body=body)
+    response = connection.getresponse()
+    answer = response.status, json.loads(response.read())
+    connection.close()
+    return answer
+
+
+def start_service(monkeypatch, model, **options):
+    monkeypatch.setattr(vehicle_service, 'recognize_snapshot', fake_recognize)
+    return RecognitionService(host='127.0.0.1', port=0, model=model, **options).start(warm_up=False)
+
+
+def test_recognize_answers_the_mqtt_message(monkeypatch):
+    """Test that a snapshot is answered with the json message of vehicle_mqtt and the errors with their status."""
+    service = start_service(monkeypatch, BatchModel(), max_wait_s=0)
+    try:
+        status, message = post(service.port, encoded(200))
+        assert status == 200 and message['classificators'][0]['color'] == 'results-200'
+        assert message['classificators'][0]['registration'] == 'TU123'
+        assert post(service.port, encoded(0))[0] == 422
+        assert post(service.port, b'not an image')[0] == 400
+        assert post(service.port, b'', path='/unknown')[0] == 404
+        assert service.stats()['requests'] == 3 and service.stats()['vehicles'] == 1
+    finally:
+        service.stop()
+
+
+def test_concurrent_requests_share_batches(monkeypatch):
+    """Test that the snapshots of concurrent requests reach the model in one predict call."""
+    gate = threading.Event()
+    model = BatchModel(gate)
+    service = start_service(monkeypatch, model, max_batch_size=4, max_wait_s=1)
+    answers = []
+    clients = [threading.Thread(target=lambda level=level: answers.append(post(service.port, encoded(level))))
+               for level in (50, 100, 150, 200)]
+    try:
+        for client in clients:
+            client.start()
+        gate.set()
+        for client in clients:
+            client.join()
+    finally:
+        service.stop()
+    assert model.batch_sizes == [4]
+    assert sorted(message['classificators'][0]['color'] for _, message in answers) == \
+        ['results-100', 'results-150', 'results-200', 'results-50']
+
+
+def test_requests_beyond_the_queue_are_rejected(monkeypatch):
+    """Test that a request arriving while queue_size requests are in flight is answered 503 at once."""
+    gate = threading.Event()
+    service = start_service(monkeypatch, BatchModel(gate), queue_size=1, max_wait_s=0)
+    first = threading.Thread(target=post, args=(service.port, encoded(200)))
+    try:
+        first.start()
+        while service.in_flight < 1:
+            pass
+        status, message = post(service.port, encoded(200))
+        gate.set()
+        first.join()
+    finally:
+        service.stop()
+    assert status == 503 and 'error' in message
+    assert service.stats()['rejected'] == 1
+
+
+def test_warm_up_runs_every_model(monkeypatch):
+    """Test that the warm-up runs every model of the registry and the batches' model, without counting a request nor a batch."""
+    warmed = []
+    monkeypatch.setattr(vehicle_service.vehicle_models, 'start_models', lambda warm_up=False: warmed.append(warm_up))
+    model = BatchModel()
+    service = start_service(monkeypatch, model)
+    try:
+        service.warm_up()
+        assert warmed == [True]
+        assert model.batch_sizes == [1]
+        assert service.batcher.stats()['batches'] == 0 and service.stats()['requests'] == 0
+    finally:
+        service.stop()
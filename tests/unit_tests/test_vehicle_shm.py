@@ -0,0 +1,94 @@
+"""! @brief Unit test for vehicle_shm module"""
+import json
+import multiprocessing
+import sys
+import numpy as np
+import pytest
+
+try:
+    with open('test_config.json') as f:
+        main_config = json.load(f)
+except :
+    raise FileNotFoundError("The file 'test_config.json' was not found.")
+
+
+sys.path.append(main_config['project_directory'])
+from vehicle_shm import FrameRing
+
+
+def frame(level, shape=(48, 64, 3)):
+    return np.full(shape, level, dtype=np.uint8)
+
+
+def read_in_child(ring, slot, answers):
+    """reads a slot from another process, then releases it."""
+    view, meta = ring.read(slot)
+    answers.put((int(view.sum()), view.shape, meta['frame_number'], meta['camera_id']))
+    del view
+    ring.release(slot)
+    ring.close()
+
+
+def test_write_and_read_without_copy():
+    """Test that a consumer gets a read-only view of the slot and the frame's metadata."""
+    ring = FrameRing(2, (48, 64, 3))
+    try:
+        slot = ring.write(frame(7, (30, 40, 3)), 12, camera_id=3, timestamp=100.0)
+        view, meta = ring.read(slot)
+        assert view.shape == (30, 40, 3) and (view == 7).all()
+        assert np.shares_memory(view, ring._frames)
+        assert meta == {'frame_number': 12, 'camera_id': 3, 'timestamp': 100.0}
+        with pytest.raises(ValueError):
+            view[0, 0, 0] = 1
+        del view
+        with pytest.raises(ValueError):
+            ring.write(frame(0, (100, 64, 3)), 13)
+    finally:
+        ring.close()
+
+
+def test_slots_are_reference_counted():
+    """Test that a slot is only reused once every consumer released it, and that a full ring drops the frame."""
+    ring = FrameRing(2, (48, 64, 3))
+    try:
+        first = ring.write(frame(1), 1)
+        ring.retain(first)
+        second = ring.write(frame(2), 2)
+        assert ring.write(frame(3), 3) is None
+        assert ring.stats() == {'ring_slots': 2, 'ring_slots_in_use': 2, 'ring_dropped': 1}
+        ring.release(first)
+        assert ring.write(frame(3), 3) is None
+        ring.release(first)
+        assert ring.write(frame(3), 3) == first
+        ring.release(second)
+        assert ring.stats()['ring_slots_in_use'] == 1
+    finally:
+        ring.close()
+
+
+def test_release_of_a_free_slot():
+    """Test that releasing a slot more times than it was held is an error."""
+    ring = FrameRing(1, (8, 8, 3))
+    try:
+        slot = ring.write(frame(1, (8, 8, 3)), 1)
+        ring.release(slot)
+        with pytest.raises(ValueError):
+            ring.release(slot)
+    finally:
+        ring.close()
+
+
+def test_frames_cross_processes():
+    """Test that a child process attaches to the ring, reads the frame and frees its slot."""
+    context = multiprocessing.get_context('spawn')
+    ring = FrameRing(1, (48, 64, 3), lock=context.Lock())
+    answers = context.Queue()
+    try:
+        slot = ring.write(frame(5), 42, camera_id=1)
+        child = context.Process(target=read_in_child, args=(ring, slot, answers))
+        child.start()
+        assert answers.get(timeout=30) == (5 * 48 * 64 * 3, (48, 64, 3), 42, 1)
+        child.join(30)
+        assert ring.stats()['ring_slots_in_use'] == 0
+    finally:
+        ring.close()
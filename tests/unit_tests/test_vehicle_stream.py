@@ -0,0 +1,95 @@
+"""! @brief Unit test for vehicle_stream module"""
+import json
+import sys
+
+try:
+    with open('test_config.json') as f:
+        main_config = json.load(f)
+except :
+    raise FileNotFoundError("The file 'test_config.json' was not found.")
+
+
+sys.path.append(main_config['project_directory'])
+import vehicle_stream
+from vehicle_stream import PassageDeduplicator, VehicleStream
+from vehicle_license import normalize_plate
+
+
+class FakeClock:
+    """clock whose time is set by the test."""
+    def __init__(self):
+        self.now = 0.0
+    def __call__(self):
+        return self.now
+
+
+def test_normalize_plate():
+    """Test that separators and case do not change the plate key."""
+    assert normalize_plate("tu 123-456") == "TU123456"
+
+
+def test_deduplicator_one_event_per_passage():
+    """Test that a lingering vehicle is one passage and a later return is a new one."""
+    clock = FakeClock()
+    dedup = PassageDeduplicator(10, clock=clock)
+    assert dedup.is_new_passage("ABC123")
+    for _ in range(5):
+        clock.now += 5
+        assert not dedup.is_new_passage("abc 123")
+    assert dedup.is_new_passage("XYZ999")
+    clock.now += 11
+    assert dedup.is_new_passage("ABC123")
+    assert "XYZ999" not in dedup.last_seen
+
+
+def test_run_publishes_once_per_vehicle(monkeypatch):
+    """Test that the stream reuses the models and publishes one event per passage."""
+    initializations = []
+    frames = iter(range(1, 8))
+
+    def fake_initialize(source):
+        initializations.append(source)
+        class Cap:
+            def release(self):
+                pass
+        return 'model', Cap(), 'bg'
+
+    def fake_detection(model, cap, frame_number, motion_gate=None, sampler=None):
+        try:
+            number = next(frames)
+        except StopIteration:
+            raise Exception("Error: Frame could not be read.")
+        return 'frame', number, number
+
+    def fake_identify(frame, results, frame_number, bg_subtractor):
+        if results < 3:
+            return None
+        plate = 'AAA111' if results < 6 else 'BBB222'
+        return ['car', plate, 'Kia', 'tunisia', 'Red']
+
+    monkeypatch.setattr(vehicle_stream.vehicle_initialize_detection, 'initialize_components', fake_initialize)
+    monkeypatch.setattr(vehicle_stream.vehicle_initialize_detection, 'object_detection_loop', fake_detection)
+    monkeypatch.setattr(vehicle_stream, 'identify_features', fake_identify)
+    published = []
+    stream = VehicleStream(__file__, publish=published.append, dedup_seconds=60, stats_interval_frames=0)
+    stream.tracker = None
+    stats = stream.run()
+    assert initializations == [__file__]
+    assert [features[1] for features in published] == ['AAA111', 'BBB222']
+    assert stats['frames'] == 7
+    assert stats['vehicles'] == 2
+    assert stats['duplicates'] == 3
+    assert stats['frames_per_s'] > 0
+
+
+def test_stats_keys_do_not_depend_on_the_plates_read(monkeypatch):
+    """Test that the OCR and nationality stats are reported, as zeros, before any plate was read."""
+    from vehicle_ocr import PlateOCR
+    monkeypatch.setattr(vehicle_stream.vehicle_ocr, 'plate_ocr', PlateOCR())
+    stream = VehicleStream('video', publish=lambda features_list: None, stats_interval_frames=0)
+    try:
+        stats = stream.stats_dict()
+    finally:
+        stream.close()
+    assert stats['ocr_plates'] == 0 and stats['ocr_p95_ms'] == 0.0
+    assert 'nationality_generic_runs' in stats and 'nationality_cache_hit_rate' in stats
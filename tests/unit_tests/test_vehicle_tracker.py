@@ -0,0 +1,113 @@
+"""! @brief Unit test for vehicle_tracker module"""
+import json
+import sys
+import numpy as np
+
+try:
+    with open('test_config.json') as f:
+        main_config = json.load(f)
+except :
+    raise FileNotFoundError("The file 'test_config.json' was not found.")
+
+
+sys.path.append(main_config['project_directory'])
+import vehicle_stream
+from vehicle_tracker import VehicleTracker, iou_matrix, greedy_match
+
+
+def detections(*boxes):
+    """builds the (xyxy, cls, conf) arrays from (x1, y1, x2, y2, cls, conf) tuples."""
+    array = np.array(boxes, dtype=np.float32).reshape(-1, 6)
+    return array[:, :4], array[:, 4].astype(int), array[:, 5].astype(float)
+
+
+def vehicle_with_plate(offset, plate_size=20, plate_conf=0.8):
+    """returns a car box, its plate and its Kia logo, shifted to the right by offset."""
+    return [(offset, 100, offset + 200, 250, 0, 0.9),
+            (offset + 80, 200, offset + 80 + 2 * plate_size, 200 + plate_size, 2, plate_conf),
+            (offset + 90, 150, offset + 110, 170, 14, 0.7)]
+
+
+def test_iou_and_greedy_match():
+    """Test the IoU matrix and the one-to-one greedy matching."""
+    boxes = np.array([[0, 0, 10, 10], [20, 20, 30, 30]], dtype=np.float32)
+    ious = iou_matrix(boxes, boxes[::-1])
+    assert np.allclose(ious, [[0, 1], [1, 0]])
+    assert sorted(greedy_match(ious, 0.5)) == [(0, 1), (1, 0)]
+
+
+def test_identity_is_kept_across_frames():
+    """Test that a moving vehicle keeps its track id and two vehicles do not collapse."""
+    tracker = VehicleTracker()
+    first = tracker.update(*detections(*vehicle_with_plate(0), *vehicle_with_plate(400)))
+    ids = {track.track_id for track in first}
+    assert len(ids) == 2
+    second = tracker.update(*detections(*vehicle_with_plate(20), *vehicle_with_plate(420)))
+    assert {track.track_id for track in second} == ids
+    left = min(second, key=lambda track: track.box[0])
+    assert left.lp_box[0] == 100
+    assert left.detected_features() == ['car', 'LP', 'Kia']
+
+
+def test_lost_tracks_are_dropped():
+    """Test that a track disappears after max_missed frames without detection."""
+    tracker = VehicleTracker(max_missed=2)
+    tracker.update(*detections(*vehicle_with_plate(0)))
+    for _ in range(3):
+        tracker.update(*detections())
+    assert tracker.tracks == []
+
+
+def test_enrichment_once_per_track_unless_better_crop():
+    """Test that a track is enriched once, and again only for a clearly better plate crop."""
+    tracker = VehicleTracker()
+    track, = tracker.update(*detections(*vehicle_with_plate(0)))
+    assert track.is_complete() and track.needs_enrichment()
+    track.mark_enriched(['car', 'ABC123', 'Kia', 'tunisia', 'Red'])
+    track, = tracker.update(*detections(*vehicle_with_plate(5)))
+    assert not track.needs_enrichment()
+    track, = tracker.update(*detections(*vehicle_with_plate(10, plate_size=30)))
+    assert track.needs_enrichment()
+
+
+def test_stream_enriches_each_track_once(monkeypatch):
+    """Test that the stream runs OCR, nationality and color once for a slow-moving vehicle."""
+    enrichments = []
+    monkeypatch.setattr(vehicle_stream, 'foreground_contours', lambda bg, frame: [])
+    monkeypatch.setattr(vehicle_stream.vehicle_license, 'recognize_plate_crops',
+                        lambda crops, frame_number, **options: enrichments.append(frame_number) or [('ABC123', 'tunisia')] * len(crops))
+    monkeypatch.setattr(vehicle_stream.vehicle_color, 'identify_vehicle_colors', lambda frame, boxes, *arguments, **options: ['Red'] * len(boxes))
+    monkeypatch.setattr(vehicle_stream.vehicle_tracker, 'extract_detections', lambda results: results)
+    published = []
+    stream = vehicle_stream.VehicleStream('video', publish=published.append, stats_interval_frames=0)
+    stream.tracker = VehicleTracker()
+    stream.voting = False
+    frame = np.zeros((480, 640, 3), dtype=np.uint8)
+    for frame_number in range(1, 31):
+        stream.process_frame(frame, detections(*vehicle_with_plate(frame_number)), frame_number, None)
+    assert enrichments == [1]
+    assert published == [['car', 'ABC123', 'Kia', 'tunisia', 'Red']]
+    assert stream.stats_dict()['enrichments'] == 1
+
+
+def test_better_plate_crop_publishes_a_correction(monkeypatch):
+    """Test that a re-enrichment changing the plate is published under the uid of the passage, and one changing nothing is not."""
+    readings = iter(['ABC12', 'ABC123', 'ABC123'])
+    monkeypatch.setattr(vehicle_stream.vehicle_license, 'recognize_plate_crops',
+                        lambda crops, frame_number, **options: [(next(readings), 'tunisia') for _ in crops])
+    monkeypatch.setattr(vehicle_stream.vehicle_color, 'identify_vehicle_colors', lambda frame, boxes, *arguments, **options: ['Red'] * len(boxes))
+    monkeypatch.setattr(vehicle_stream.vehicle_tracker, 'extract_detections', lambda results: results)
+    published = []
+    stream = vehicle_stream.VehicleStream('video', stats_interval_frames=0)
+    stream.publisher = type('Publisher', (), {'publish_features': lambda self, features_list, uid=None: published.append((features_list, uid)),
+                                              'stats': lambda self: {}})()
+    stream.tracker = VehicleTracker()
+    stream.voting = False
+    stream.event_store = None
+    frame = np.zeros((480, 640, 3), dtype=np.uint8)
+    for frame_number, plate_size in enumerate((20, 20, 30, 30, 45), start=1):
+        stream.process_frame(frame, detections(*vehicle_with_plate(frame_number, plate_size=plate_size)), frame_number, None)
+    assert [features_list[1] for features_list, _ in published] == ['ABC12', 'ABC123']
+    assert published[0][1] == published[1][1]
+    assert stream.stats_dict()['corrections'] == 1
+    assert stream.stats_dict()['enrichments'] == 3
@@ -0,0 +1,96 @@
+"""! @brief Unit test for vehicle_voting module"""
+import json
+import sys
+import numpy as np
+
+try:
+    with open('test_config.json') as f:
+        main_config = json.load(f)
+except :
+    raise FileNotFoundError("The file 'test_config.json' was not found.")
+
+
+sys.path.append(main_config['project_directory'])
+import vehicle_stream
+from vehicle_voting import vote_plate, VehicleAccumulator
+from vehicle_tracker import VehicleTracker
+
+RED = [0.05, 0, 0, 0, 0, 0.9, 0.05, 0, 0]
+
+
+def test_vote_plate_character_level():
+    """Test that each position keeps the character with the highest summed score."""
+    plate, confidence = vote_plate([('AB0123', 0.9), ('A80123', 0.4), ('AB0I23', 0.5), ('AB01', 0.2)])
+    assert plate == 'AB0123'
+    assert 0 < confidence < 1
+    assert vote_plate([]) == ('', 0.0)
+
+
+def test_accumulator_converges_and_emits():
+    """Test that the result is emitted once min_frames confident frames were collected."""
+    accumulator = VehicleAccumulator(min_frames=3, max_frames=10, plate_confidence=0.6, color_confidence=0.5)
+    accumulator.add_frame(0, 0.8, 14, 0.6, 'TU1', 0.2, None, RED)
+    assert not accumulator.converged()
+    accumulator.add_frame(0, 0.9, 14, 0.7, 'TU1234', 0.9, 'tunisia', RED)
+    accumulator.add_frame(1, 0.4, 14, 0.7, 'TV1284', 0.8, 'tunisia', RED)
+    assert not accumulator.converged()
+    accumulator.add_frame(0, 0.9, 14, 0.7, 'TU1234', 0.9, 'tunisia', RED)
+    assert accumulator.converged()
+    assert accumulator.result() == ['car', 'TU1234', 'Kia', 'tunisia', 'Red']
+
+
+def test_accumulator_stops_at_max_frames():
+    """Test that an unconfident vehicle is still emitted after max_frames."""
+    accumulator = VehicleAccumulator(min_frames=2, max_frames=4, plate_confidence=0.99, color_confidence=0.99)
+    for plate in ['AAA111', 'AAA112', 'AAA113', 'AAA114']:
+        accumulator.add_frame(0, 0.9, 14, 0.6, plate, 0.5, 'europe', RED)
+    assert accumulator.converged()
+    assert accumulator.result()[1].startswith('AAA11')
+
+
+def test_stream_stops_querying_after_convergence(monkeypatch):
+    """Test that the stream queries the models until the track converges, then never again."""
+    ocr_calls = []
+    monkeypatch.setattr(vehicle_stream, 'foreground_contours', lambda bg, frame: [])
+    monkeypatch.setattr(vehicle_stream.vehicle_license, 'read_license_plates_with_score',
+                        lambda crops: ocr_calls.append(1) or [('AB' if len(ocr_calls) == 1 else 'ABC123', 0.9)] * len(crops))
+    monkeypatch.setattr(vehicle_stream.vehicle_license, 'predict_generic_nationality', lambda crop, plate=None: 'tunisia')
+    monkeypatch.setattr(vehicle_stream.vehicle_color, 'identify_vehicle_colors', lambda frame, boxes, *arguments, **options: [np.array(RED)] * len(boxes))
+    monkeypatch.setattr(vehicle_stream.vehicle_tracker, 'extract_detections', lambda results: results)
+    monkeypatch.setattr(vehicle_stream.vehicle_voting, 'VehicleAccumulator',
+                        lambda: VehicleAccumulator(min_frames=3, max_frames=10, plate_confidence=0.6, color_confidence=0.5))
+    published = []
+    stream = vehicle_stream.VehicleStream('video', publish=published.append, stats_interval_frames=0)
+    stream.tracker = VehicleTracker()
+    stream.voting = True
+    frame = np.zeros((480, 640, 3), dtype=np.uint8)
+    for frame_number in range(1, 21):
+        boxes = np.array([[frame_number, 100, frame_number + 200, 250], [frame_number + 80, 200, frame_number + 120, 220],
+                          [frame_number + 90, 150, frame_number + 110, 170]], dtype=np.float32)
+        stream.process_frame(frame, (boxes, np.array([0, 2, 14]), np.array([0.9, 0.8, 0.7])), frame_number, None)
+    assert published == [['car', 'ABC123', 'Kia', 'tunisia', 'Red']]
+    # the short first reading is outvoted, the track converges on its third frame
+    assert len(ocr_calls) == 3
+
+
+def test_stream_abandons_a_track_whose_plate_is_never_read(monkeypatch):
+    """Test that a track without a readable plate stops being queried after max_frames and is not published."""
+    ocr_calls = []
+    monkeypatch.setattr(vehicle_stream.vehicle_license, 'read_license_plates_with_score',
+                        lambda crops: ocr_calls.append(1) or [('AB', 0.9)] * len(crops))
+    monkeypatch.setattr(vehicle_stream.vehicle_license, 'predict_generic_nationality', lambda crop, plate=None: 'tunisia')
+    monkeypatch.setattr(vehicle_stream.vehicle_color, 'identify_vehicle_colors', lambda frame, boxes, *arguments, **options: [np.array(RED)] * len(boxes))
+    monkeypatch.setattr(vehicle_stream.vehicle_tracker, 'extract_detections', lambda results: results)
+    monkeypatch.setattr(vehicle_stream.vehicle_voting, 'VehicleAccumulator',
+                        lambda: VehicleAccumulator(min_frames=3, max_frames=5, plate_confidence=0.6, color_confidence=0.5))
+    published = []
+    stream = vehicle_stream.VehicleStream('video', publish=published.append, stats_interval_frames=0)
+    stream.tracker = VehicleTracker()
+    stream.voting = True
+    frame = np.zeros((480, 640, 3), dtype=np.uint8)
+    for frame_number in range(1, 21):
+        boxes = np.array([[frame_number, 100, frame_number + 200, 250], [frame_number + 80, 200, frame_number + 120, 220],
+                          [frame_number + 90, 150, frame_number + 110, 170]], dtype=np.float32)
+        stream.process_frame(frame, (boxes, np.array([0, 2, 14]), np.array([0.9, 0.8, 0.7])), frame_number, None)
+    assert published == []
+    assert len(ocr_calls) == 5
@@ -0,0 +1,171 @@
+"""! @brief module responsible for exporting the models to ONNX, TorchScript or OpenVINO IR and loading the exported models."""
+import os
+import numpy as np
+import vehicle_models
+from vehicle_config import vehicle_det_config
+
+#! backends a model can run on ('torch' is the original .pt / pickled module, 'onnx_int8' the quantized ONNX of vehicle_quantize)
+BACKENDS = ['torch', 'onnx', 'torchscript', 'openvino', 'onnx_int8']
+#! side of the square input of the color model
+COLOR_INPUT_SIZE = 224
+
+
+def exported_path(path, backend):
+    """! returns where the export of a model is written, next to its weights (the ultralytics naming).
+
+    @param path path to the .pt weights or the pickled color model.
+    @param backend one of BACKENDS.
+
+    @return '<stem>.onnx', '<stem>.torchscript', '<stem>.int8.onnx' or the '<stem>_openvino_model' directory.
+    """
+    stem = os.path.splitext(path)[0]
+    if backend == 'torch':
+        return path
+    if backend == 'onnx_int8':
+        return stem + '.int8.onnx'
+    if backend == 'openvino':
+        return stem + '_openvino_model'
+    return stem + '.' + backend
+
+
+def _openvino_xml(directory):
+    """! @return the .xml graph of an OpenVINO IR directory."""
+    return os.path.join(directory, os.path.basename(directory)[:-len('_openvino_model')] + '.xml')
+
+
+class OnnxClassifier:
+    """! runs an ONNX classifier with ONNX Runtime behind the interface of the torch module (tensor in, logits out)."""
+
+    def __init__(self, path, threads=0):
+        """! @param path path to the .onnx model.
+        @param threads intra-op threads of the session (0 lets ONNX Runtime use every physical core).
+        """
+        import onnxruntime
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        # one model runs at a time per stage, the parallelism is inside the operators
+        options.execution_mode = onnxruntime.ExecutionMode.ORT_SEQUENTIAL
+        options.inter_op_num_threads = 1
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, batch):
+        import torch
+        logits = self.session.run(None, {self.input_name: batch.numpy()})[0]
+        return torch.from_numpy(logits)
+
+
+class OpenVinoClassifier:
+    """! runs an OpenVINO IR classifier behind the interface of the torch module (tensor in, logits out)."""
+
+    def __init__(self, path, threads=0):
+        """! @param path path to the .xml graph.
+        @param threads inference threads (0 lets OpenVINO decide).
+        """
+        import openvino
+        config = {'INFERENCE_NUM_THREADS': threads} if threads else {}
+        self.compiled = openvino.Core().compile_model(path, 'CPU', config)
+
+    def __call__(self, batch):
+        import torch
+        return torch.from_numpy(np.asarray(self.compiled(batch.numpy())[0]))
+
+
+def export_classifier(model, target, backend):
+    """! exports the color model with a dynamic batch dimension.
+
+    @param model the torch module, in eval mode.
+    @param target exported_path of the model.
+    @param backend 'onnx', 'torchscript' or 'openvino'.
+
+    @return the path of the export.
+    """
+    import torch
+    example = torch.zeros(1, 3, COLOR_INPUT_SIZE, COLOR_INPUT_SIZE)
+    if backend == 'torchscript':
+        with torch.no_grad():
+            torch.jit.trace(model, example).save(target)
+        return target
+    onnx_target = target if backend == 'onnx' else target + '.onnx'
+    # the TorchScript based exporter needs no onnxscript and handles any traceable module
+    torch.onnx.export(model, example, onnx_target, input_names=['images'], output_names=['logits'],
+                      dynamic_axes={'images': {0: 'batch'}, 'logits': {0: 'batch'}}, opset_version=17, dynamo=False)
+    if backend == 'onnx':
+        return target
+    import openvino
+    os.makedirs(target, exist_ok=True)
+    openvino.save_model(openvino.convert_model(onnx_target), _openvino_xml(target))
+    os.remove(onnx_target)
+    return target
+
+
+def export_model(key, path, backend):
+    """! exports one of the models of main_config.json next to its weights.
+
+    The YOLO models go through the ultralytics exporter, with dynamic input shapes for ONNX and
+    OpenVINO so batched and resized ('inference_size') frames keep working.
+
+    @param key one of vehicle_models.MODEL_KEYS.
+    @param path path to the weights.
+    @param backend 'onnx', 'torchscript', 'openvino' or 'onnx_int8' (quantized with the 'quantization_*' keys).
+
+    @return the path of the export.
+    """
+    if backend not in BACKENDS[1:]:
+        raise ValueError(f"Unknown backend '{backend}', expected one of {BACKENDS[1:]}.")
+    if backend == 'onnx_int8':
+        import vehicle_quantize
+        return vehicle_quantize.quantize_model(key, path)
+    target = exported_path(path, backend)
+    if key == 'color_model':
+        return export_classifier(vehicle_models.load_color_model(path), target, backend)
+    options = {'imgsz': vehicle_det_config['inference_size']} if vehicle_det_config.get('inference_size') else {}
+    exported = vehicle_models.load_yolo(path).export(format=backend, dynamic=backend != 'torchscript', **options)
+    return str(exported)
+
+
+def export_models(backend, keys=None):
+    """! exports the models of main_config.json.
+
+    @param backend 'onnx', 'torchscript', 'openvino' or 'onnx_int8'.
+    @param keys optional list of config keys (every one of vehicle_models.MODEL_KEYS by default).
+
+    @return dict {key: path of the export}.
+    """
+    return {key: export_model(key, vehicle_det_config[key], backend) for key in keys or vehicle_models.MODEL_KEYS}
+
+
+def load_exported(key, path, backend):
+    """! loads the export of a model, exporting it first if 'export_missing_models' is set.
+
+    @param key one of vehicle_models.MODEL_KEYS.
+    @param path path to the original weights.
+    @param backend 'onnx', 'torchscript', 'openvino' or 'onnx_int8'.
+
+    'backend_threads' only reaches the color model's session: ultralytics creates the ONNX Runtime
+    and OpenVINO sessions of the YOLO stages itself, with their default number of threads.
+
+    @return a YOLO model for the YOLO stages, a callable (tensor in, logits out) for the color model.
+    """
+    if backend not in BACKENDS[1:]:
+        raise ValueError(f"Unknown backend '{backend}' for '{key}', expected one of {BACKENDS}.")
+    target = exported_path(path, backend)
+    if not os.path.exists(target):
+        if not vehicle_det_config.get('export_missing_models', False):
+            raise FileNotFoundError(f"'{target}' was not found, export it with 'python3 main.py --export {backend}'.")
+        export_model(key, path, backend)
+    if key != 'color_model':
+        # ultralytics runs .onnx, .torchscript and OpenVINO directories with the same predict and Results
+        from ultralytics import YOLO
+        return YOLO(target, task='detect')
+    threads = vehicle_det_config.get('backend_threads', 0)
+    if backend in ('onnx', 'onnx_int8'):
+        return OnnxClassifier(target, threads)
+    if backend == 'openvino':
+        return OpenVinoClassifier(_openvino_xml(target), threads)
+    import torch
+    model = torch.jit.load(target, map_location='cpu')
+    model.eval()
+    return model
@@ -0,0 +1,194 @@
+"""! @brief module responsible for batching the general features model over several frames and cameras."""
+import time
+import queue
+import threading
+from concurrent.futures import Future
+import cv2
+import vehicle_models
+import vehicle_stream
+import vehicle_mqtt
+import vehicle_frames
+import vehicle_metrics
+from vehicle_config import vehicle_det_config
+
+
+class BatchInferenceServer:
+    """! gathers frames submitted by several streams into batches and runs one predict call per batch.
+
+    A batch is sent to the model as soon as it holds max_batch_size frames or its oldest frame has
+    waited max_wait_s, and every frame's result is routed back to the stream that submitted it.
+    """
+
+    def __init__(self, model, max_batch_size=None, max_wait_s=None, model_key='general_features_model'):
+        """! @param model the YOLO model (anything whose predict accepts a list of frames).
+        @param max_batch_size maximum number of frames per predict call.
+        @param max_wait_s maximum time a frame waits for the batch to fill.
+        @param model_key registry key used to time and serialize the inference calls.
+        """
+        self.model = model
+        self.max_batch_size = max_batch_size or vehicle_det_config.get('batch_max_size', 8)
+        self.max_wait_s = max_wait_s if max_wait_s is not None else vehicle_det_config.get('batch_max_wait_ms', 20) / 1000
+        self.model_key = model_key
+        self.batches = 0
+        self.frames = 0
+        self.inference_s = 0.0
+        self._requests = queue.Queue()
+        self._thread = None
+        self._running = False
+        vehicle_metrics.register_collector('batching', self.stats)
+
+    def submit(self, frame):
+        """! queues a frame for the next batch.
+
+        @param frame image array.
+
+        @return a Future whose result is the model's Results object for this frame.
+        """
+        future = Future()
+        self._requests.put((frame, future))
+        return future
+
+    def _next_batch(self):
+        """! waits for a first frame then collects more until the batch is full or the wait is over."""
+        try:
+            first = self._requests.get(timeout=0.1)
+        except queue.Empty:
+            return []
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait_s
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._requests.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _serve(self):
+        """! server thread: runs the batches and routes the results back."""
+        while self._running or not self._requests.empty():
+            batch = self._next_batch()
+            if not batch:
+                continue
+            frames = [frame for frame, _ in batch]
+            start = time.perf_counter()
+            try:
+                with vehicle_models.registry.inference(self.model_key):
+                    results = self.model.predict(frames, **vehicle_frames.predict_options())
+            except Exception as error:
+                for _, future in batch:
+                    future.set_exception(error)
+                continue
+            self.inference_s += time.perf_counter() - start
+            self.batches += 1
+            self.frames += len(frames)
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+
+    def start(self):
+        """! starts the server thread."""
+        self._running = True
+        self._thread = threading.Thread(target=self._serve, name='batch-inference', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """! serves the frames already submitted then stops the server thread."""
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+
+    def stats(self):
+        """! @return number of batches and frames, frames waiting for a batch, mean batch size and inference time per frame."""
+        return {
+            'batches': self.batches,
+            'frames': self.frames,
+            'queue_depth': self._requests.qsize(),
+            'mean_batch_size': self.frames / self.batches if self.batches else 0,
+            'inference_ms_per_frame': 1000 * self.inference_s / self.frames if self.frames else None,
+        }
+
+
+class SiteServer:
+    """! serves every gate camera of a site from one process with one batched general features model.
+
+    Each camera gets a reader thread with its own background subtractor and passage deduplication;
+    the readers share the batch inference server.
+    """
+
+    def __init__(self, sources, model=None, publish=None, max_batch_size=None, max_wait_s=None):
+        """! @param sources list of video paths, camera indexes or RTSP urls.
+        @param model the general features model (loaded from the registry by default).
+        @param publish callable(features_list) shared by the cameras; defaults to one persistent MQTT client shared by the cameras.
+        @param max_batch_size maximum number of frames per predict call.
+        @param max_wait_s maximum time a frame waits for the batch to fill.
+        """
+        self.sources = sources
+        model = model if model is not None else vehicle_models.registry.get('general_features_model')
+        self.server = BatchInferenceServer(model, max_batch_size, max_wait_s)
+        # one connection and one spool for the site, rather than one per camera
+        self.publisher = vehicle_mqtt.MQTTPublisher() if publish is None else None
+        self.streams = [vehicle_stream.VehicleStream(source, publish=publish, stats_interval_frames=0, publisher=self.publisher)
+                        for source in sources]
+
+    def read_camera(self, stream):
+        """! reader thread of one camera: submits its frames and enriches the vehicles found."""
+        cap = cv2.VideoCapture(stream.source)
+        bg_subtractor = cv2.createBackgroundSubtractorMOG2()
+        motion_gate = stream.motion_gate
+        sampler = stream.sampler
+        frame_number = 0
+        try:
+            while stream.running:
+                frame, consumed = vehicle_frames.read_frame(cap, sampler)
+                frame_number += consumed
+                if frame is None:
+                    break
+                if motion_gate is not None and not motion_gate.should_detect(frame):
+                    results = []
+                else:
+                    # one frame in flight per camera: the batch fills up with the other cameras' frames
+                    results = [self.server.submit(frame).result()]
+                if sampler is not None:
+                    sampler.observe(vehicle_frames.has_detections(results))
+                stream.process_frame(frame, results, frame_number, bg_subtractor)
+            if stream.quality is not None:
+                stream.flush_selected()
+        finally:
+            cap.release()
+            stream.close()
+
+    def run(self):
+        """! runs until every camera's stream ends.
+
+        @return the batching statistics and the statistics of each camera.
+        """
+        self.server.start()
+        if self.publisher is not None:
+            self.publisher.start()
+        threads = []
+        for stream in self.streams:
+            stream.running = True
+            threads.append(threading.Thread(target=self.read_camera, args=(stream,), daemon=True))
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads:
+                thread.join()
+        except KeyboardInterrupt:
+            self.stop()
+            for thread in threads:
+                thread.join()
+        self.server.stop()
+        stats = {'batching': self.server.stats(),
+                 'cameras': {str(stream.source): stream.stats_dict() for stream in self.streams}}
+        if self.publisher is not None:
+            stats['mqtt'] = self.publisher.stats()
+            self.publisher.stop()
+        return stats
+
+    def stop(self):
+        """! asks every camera to stop after its current frame."""
+        for stream in self.streams:
+            stream.stop()
@@ -1,71 +1,170 @@
 """! @brief module responsible for identifying the vehicles color."""
 
-import torch
-from torchvision import transforms
-from PIL import Image
-import json
+import numpy as np
 import cv2
 import os
+import vehicle_models
+import vehicle_features
+import vehicle_metrics
+from vehicle_config import vehicle_det_config
 
+# the frame is only saved when a debug directory is configured
+debug_crops_dir = vehicle_det_config.get('debug_crops_dir', '')
 
-try:
-    with open('main_config.json') as f:
-        vehicle_det_config = json.load(f)
-except :
-    raise FileNotFoundError("The file 'main_config.json' was not found.")
+# list of the colors that the color model predicts
+colors = ['Black', 'Blue', 'Brown', 'Green', 'Orange', 'Red', 'Silver', 'White', 'Yellow']
+# preprocessing of the color model: the shorter side is resized to RESIZE, then the center INPUT_SIZE square is normalized
+RESIZE = 256
+INPUT_SIZE = 224
+MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32).reshape(3, 1, 1)
+STD = np.array([0.229, 0.224, 0.225], dtype=np.float32).reshape(3, 1, 1)
 
 # Functions
-def predict_car_color(image_to_cap):
-    """predicts the vehicle color.
+def load_color_image(image_to_cap):
+    """reads the vehicle image if a path was given.
 
-    @param image_to_cap  path to the vehicle image.
+    @param image_to_cap  the vehicle image (BGR array) or the path to it.
 
-    @return color
+    @return the BGR image array.
+    """
+    if not isinstance(image_to_cap, str):
+        return image_to_cap
+    image = cv2.imread(image_to_cap)
+    if image is None:
+        raise FileNotFoundError(f"The image '{image_to_cap}' could not be read.")
+    return image
+
+def preprocess_color_image(image):
+    """prepares a BGR image for the color model without going through PIL.
+
+    Same steps as torchvision's Resize(256), CenterCrop(224), ToTensor and Normalize: only the
+    center square is converted to float, so the cost no longer grows with the size of the crop.
+
+    @param image  BGR image array (uint8).
+
+    @return normalized RGB float tensor of shape (3, 224, 224).
+    """
+    height, width = image.shape[:2]
+    scale = RESIZE / min(height, width)
+    size = (max(round(width * scale), INPUT_SIZE), max(round(height * scale), INPUT_SIZE))
+    # INTER_AREA averages the pixels when shrinking, like the antialiased resize of torchvision
+    image = cv2.resize(image, size, interpolation=cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR)
+    top, left = (size[1] - INPUT_SIZE) // 2, (size[0] - INPUT_SIZE) // 2
+    image = image[top:top + INPUT_SIZE, left:left + INPUT_SIZE, ::-1]
+    import torch
+    array = image.transpose(2, 0, 1).astype(np.float32)
+    array /= 255
+    array -= MEAN
+    array /= STD
+    return torch.from_numpy(array)
+
+@vehicle_metrics.timed('predict_car_colors_probabilities')
+def predict_car_colors_probabilities(images):
+    """predicts the probability of each color for several vehicles in one forward pass.
+
+    @param images  list of vehicle images (BGR arrays) or paths to them.
+
+    @return numpy array of shape (len(images), len(colors)) holding the softmax over 'colors'.
     """
-    final_model = torch.load(vehicle_det_config['color_model'], map_location="cpu")
-    # list of the colors that the color model predicts
-    colors = ['Black', 'Blue', 'Brown', 'Green', 'Orange', 'Red', 'Silver', 'White', 'Yellow']
-    # Define transformations for the input image
-    transform = transforms.Compose([
-        transforms.Resize(256),
-        transforms.CenterCrop(224),
-        transforms.ToTensor(),
-        transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
-    ])
-
-    # Load and preprocess the input image
-    image = Image.open(image_to_cap).convert('RGB')
-    image = transform(image).unsqueeze(0)
+    if len(images) == 0:
+        return np.zeros((0, len(colors)), dtype=np.float32)
+    import torch
+    # the model is loaded once and shared through the registry
+    final_model = vehicle_models.registry.get('color_model')
+    batch = torch.stack([preprocess_color_image(load_color_image(image)) for image in images])
 
     #! Perform prediction
-    with torch.no_grad():
-        preds = final_model(image)
+    with torch.no_grad(), vehicle_models.registry.inference('color_model'):
+        preds = final_model(batch)
         probabilities = torch.nn.functional.softmax(preds, dim=1)
-        top_probability, top_class = probabilities.topk(1, dim=1)
+    return probabilities.numpy()
+
+def predict_car_color_probabilities(image_to_cap):
+    """predicts the probability of each color for the vehicle.
+
+    @param image_to_cap  the vehicle image (BGR array) or the path to it.
+
+    @return numpy array of the softmax over 'colors'.
+    """
+    return predict_car_colors_probabilities([image_to_cap])[0]
+
+def predict_car_colors(images):
+    """predicts the color of several vehicles in one forward pass.
+
+    @param images  list of vehicle images (BGR arrays) or paths to them.
+
+    @return list of colors.
+    """
+    return [colors[int(probabilities.argmax())] for probabilities in predict_car_colors_probabilities(images)]
+
+def predict_car_color(image_to_cap):
+    """predicts the vehicle color.
+
+    @param image_to_cap  the vehicle image (BGR array) or the path to it.
+
+    @return color
+    """
+    probabilities = predict_car_color_probabilities(image_to_cap)
 
     #! Get the predicted class name 
-    car_color = colors[top_class.item()]
+    car_color = colors[int(probabilities.argmax())]
     if len(car_color) != 0:
         return car_color 
     else:
         return "silver"
 
-def identify_vehicle_color(frame, contours, area_threshold, frame_number):
+def crop_vehicle(frame, vehicle_box):
+    """crops the vehicle's box out of the frame, without the margin added to the plate crops.
+
+    @param frame image array that represents the captured frame.
+    @param vehicle_box the vehicle's box [x1, y1, x2, y2].
+
+    @return a view of the frame covering the vehicle.
+    """
+    return vehicle_features.crop_box(frame, vehicle_box, gain=1.0, pad=0)
+
+@vehicle_metrics.timed('identify_vehicle_colors')
+def identify_vehicle_colors(frame, vehicle_boxes, area_threshold, frame_number, probabilities=False):
+    """Identify the colors of several vehicles of a frame with one call to the color model.
+
+    @param frame image array that represents the captured frame.
+    @param vehicle_boxes the boxes [x1, y1, x2, y2] of the vehicles.
+    @param area_threshold vehicles whose crop is not larger than this area get None.
+    @param frame_number The sequential number or index of the current frame being processed.
+    @param probabilities return the probability of each color instead of the most likely one.
+
+    @return a list holding, for each box, the vehicle's color (or the softmax over 'colors') or None.
+    """
+    crops = [crop_vehicle(frame, box) for box in vehicle_boxes]
+    kept = [index for index, crop in enumerate(crops) if crop.shape[0] * crop.shape[1] > area_threshold]
+    if debug_crops_dir:
+        for index in kept:
+            cv2.imwrite(os.path.join(debug_crops_dir, f"_{frame_number}_{index}.jpg"), crops[index])
+    predictions = predict_car_colors_probabilities([crops[index] for index in kept])
+    identified = [None] * len(crops)
+    for index, prediction in zip(kept, predictions):
+        identified[index] = prediction if probabilities else colors[int(prediction.argmax())]
+    return identified
+
+@vehicle_metrics.timed('identify_vehicle_color')
+def identify_vehicle_color(frame, contours, area_threshold, frame_number, probabilities=False, vehicle_box=None):
     """Identify the color of the current vehicle.
 
+    The color model only sees the vehicle: the box of the vehicle when it is known, otherwise the
+    bounding box of the largest foreground contour.
+
     @param frame image array that represents the captured frame.
     @param contours A list of contours detected in the frame using OpenCV's contour detection algorithms.
     @param area_threshold The threshold value used to filter out contours based on their area.
     @param frame_number The sequential number or index of the current frame being processed.
+    @param probabilities return the probability of each color instead of the most likely one.
+    @param vehicle_box the box [x1, y1, x2, y2] of the vehicle detected by the general features model, if any.
 
-    @return color the vehicle's color. 
+    @return color the vehicle's color (or the softmax over 'colors'). 
     """
-    if len(contours) > 0:
-        largest_contour = max(contours, key=cv2.contourArea)
-        x, y, w, h = cv2.boundingRect(largest_contour)
-        if w * h > area_threshold:  
-            screenshot_filename = f"/home/pc/vehicle_detector/_{frame_number}.jpg"
-            cv2.imwrite(screenshot_filename, frame)                                           
-            color = predict_car_color(screenshot_filename)
-            os.remove(screenshot_filename)
-            return color
\ No newline at end of file
+    if vehicle_box is None:
+        if len(contours) == 0:
+            return None
+        x, y, w, h = cv2.boundingRect(max(contours, key=cv2.contourArea))
+        vehicle_box = [x, y, x + w, y + h]
+    return identify_vehicle_colors(frame, [vehicle_box], area_threshold, frame_number, probabilities)[0]
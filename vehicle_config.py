@@ -0,0 +1,35 @@
+"""! @brief module responsible for finding and parsing the configuration files once for every module."""
+import os
+import json
+
+#! environment variable pointing to the directory of the configuration files
+CONFIG_DIR_ENV = 'VEHICLE_DETECTOR_CONFIG_DIR'
+#! directory of the project, where the configuration files are looked for when they are not in the working directory
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def config_path(name):
+    """! finds a configuration file in $VEHICLE_DETECTOR_CONFIG_DIR, then in the working directory, then in the project's directory.
+
+    @param name the file name, e.g. 'main_config.json'.
+
+    @return the path of the first one found.
+    """
+    for directory in (os.environ.get(CONFIG_DIR_ENV, ''), os.getcwd(), PROJECT_DIR):
+        path = os.path.join(directory, name)
+        if directory and os.path.isfile(path):
+            return path
+    raise FileNotFoundError(f"The file '{name}' was not found.")
+
+
+def load_config(name='main_config.json'):
+    """! parses a configuration file found by config_path.
+
+    @return the parsed json.
+    """
+    with open(config_path(name)) as f:
+        return json.load(f)
+
+
+#! main_config.json, parsed once and shared by every module (a key set in one module is seen by all of them)
+vehicle_det_config = load_config()
@@ -0,0 +1,330 @@
+"""! @brief module responsible for the local store of the published passages, queried to suppress repeat plates."""
+import time
+import atexit
+import queue
+import sqlite3
+import threading
+import uuid
+import vehicle_license
+from vehicle_config import vehicle_det_config
+
+#! columns of a passage, in the order of the rows inserted
+COLUMNS = ('uid', 'plate', 'registration', 'camera', 'timestamp', 'class', 'brand', 'nationality', 'color')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS passages (
+    id INTEGER PRIMARY KEY,
+    uid TEXT NOT NULL,
+    plate TEXT NOT NULL,
+    registration TEXT,
+    camera TEXT NOT NULL,
+    timestamp REAL NOT NULL,
+    class TEXT,
+    brand TEXT,
+    nationality TEXT,
+    color TEXT
+);
+CREATE INDEX IF NOT EXISTS passages_plate ON passages (plate, camera, timestamp);
+CREATE INDEX IF NOT EXISTS passages_timestamp ON passages (timestamp);
+CREATE INDEX IF NOT EXISTS passages_brand ON passages (brand, timestamp);
+"""
+
+#! queued to stop the writer thread
+_STOP = object()
+
+
+class EventStore:
+    """! SQLite database (in WAL mode) of the published passages, keyed by normalized plate and camera.
+
+    record() only queues the passage: a writer thread inserts the queued passages in bulk, one
+    transaction per batch, so the pipeline never waits on the disk. The last sighting of every
+    plate within index_window_s is also kept in memory, which answers seen_within() without a query
+    for the windows the stream uses; longer windows, or plates older than the index, are looked up
+    in the database. The passages older than retention_s are deleted every compact_interval_s.
+    """
+
+    def __init__(self, path, index_window_s=300, retention_s=30 * 86400, batch_size=500, flush_interval_s=0.2,
+                 queue_size=10000, compact_interval_s=3600, clock=time.time):
+        """! @param path the database file (':memory:' is private to each connection, so use a file).
+        @param index_window_s how long the last sighting of a plate is kept in memory.
+        @param retention_s age after which the passages are deleted (0 keeps them forever).
+        @param batch_size maximum number of passages inserted per transaction.
+        @param flush_interval_s longest time a passage waits in the queue before it is written.
+        @param queue_size passages waiting to be written beyond which new ones are dropped.
+        @param compact_interval_s seconds between two compactions (0 disables them).
+        @param clock function returning the current time in seconds since the epoch.
+        """
+        self.path = path
+        self.index_window_s = index_window_s
+        self.retention_s = retention_s
+        self.batch_size = batch_size
+        self.flush_interval_s = flush_interval_s
+        self.compact_interval_s = compact_interval_s
+        self.clock = clock
+        self.recorded = 0
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+        self.compacted = 0
+        self.last_batch_ms = 0.0
+        self._queue = queue.Queue(maxsize=queue_size)
+        # (plate, camera) -> last sighting, and plate -> last sighting on any camera
+        self._last_seen = {}
+        self._last_seen_any = {}
+        self._index_lock = threading.Lock()
+        # queries and compactions from the callers' threads share one connection
+        self._connection = self._connect()
+        self._connection_lock = threading.Lock()
+        with self._connection:
+            self._connection.executescript(SCHEMA)
+        self._load_index()
+        self._writer = threading.Thread(target=self._write, name='event-store', daemon=True)
+        self._writer.start()
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        # readers do not block the writer and a commit only syncs at the checkpoints
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        return connection
+
+    def _load_index(self):
+        """! fills the in-memory index with the passages of the last index_window_s, e.g. after a restart."""
+        rows = self._connection.execute('SELECT plate, camera, MAX(timestamp) FROM passages WHERE timestamp >= ? '
+                                        'GROUP BY plate, camera', (self.clock() - self.index_window_s,)).fetchall()
+        for plate, camera, timestamp in rows:
+            self._remember(plate, camera, timestamp)
+
+    def _remember(self, plate, camera, timestamp):
+        if timestamp > self._last_seen.get((plate, camera), float('-inf')):
+            self._last_seen[(plate, camera)] = timestamp
+        if timestamp > self._last_seen_any.get(plate, float('-inf')):
+            self._last_seen_any[plate] = timestamp
+
+    def _prune_index(self):
+        """! forgets the sightings older than the index window, so memory stays bounded on an unbounded stream."""
+        oldest = self.clock() - self.index_window_s
+        with self._index_lock:
+            for index in (self._last_seen, self._last_seen_any):
+                for key in [key for key, seen_at in index.items() if seen_at < oldest]:
+                    del index[key]
+
+    def record(self, features_list, camera, timestamp=None, uid=None):
+        """! queues a published passage; it is written by the next batch.
+
+        @param features_list ['car'/'truck', 'LP', 'brand', 'nationality', 'color'].
+        @param camera the camera (or stream) the vehicle passed in front of.
+        @param timestamp time of the passage (now by default).
+        @param uid identifier of the passage (a new uuid4 by default).
+
+        @return False if the queue was full and the passage was dropped.
+        """
+        timestamp = self.clock() if timestamp is None else timestamp
+        plate = vehicle_license.normalize_plate(features_list[1])
+        camera = str(camera)
+        with self._index_lock:
+            self._remember(plate, camera, timestamp)
+        vehicle_class, registration, brand, nationality, color = features_list
+        row = (uid or str(uuid.uuid4()), plate, registration, camera, timestamp, vehicle_class, brand, nationality, color)
+        self.recorded += 1
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            self.dropped += 1
+            return False
+        return True
+
+    def refresh(self, plate, camera, timestamp=None):
+        """! records a sighting of a plate that was not published (a duplicate): seen_within() counts from it, no row is written.
+
+        @param plate the plate content.
+        @param camera the camera the plate was seen by.
+        @param timestamp time of the sighting (now by default).
+        """
+        timestamp = self.clock() if timestamp is None else timestamp
+        with self._index_lock:
+            self._remember(vehicle_license.normalize_plate(plate), str(camera), timestamp)
+
+    def seen_within(self, plate, seconds, camera=None, now=None):
+        """! tells whether a plate passed in the last seconds.
+
+        @param plate the plate content (normalized like the recorded ones).
+        @param seconds length of the window.
+        @param camera only count the passages of this camera (any camera by default).
+        @param now end of the window (now by default).
+
+        @return True if a passage of the plate was recorded within the window.
+        """
+        now = self.clock() if now is None else now
+        plate = vehicle_license.normalize_plate(plate)
+        with self._index_lock:
+            if camera is None:
+                last = self._last_seen_any.get(plate)
+            else:
+                last = self._last_seen.get((plate, str(camera)))
+        if last is not None:
+            return now - last <= seconds
+        if seconds <= self.index_window_s:
+            # the index holds every passage of its window
+            return False
+        sql = 'SELECT 1 FROM passages WHERE plate = ? AND timestamp >= ?'
+        params = [plate, now - seconds]
+        if camera is not None:
+            sql += ' AND camera = ?'
+            params.append(str(camera))
+        with self._connection_lock:
+            return self._connection.execute(sql + ' LIMIT 1', params).fetchone() is not None
+
+    def query(self, start=None, end=None, plate=None, brand=None, camera=None, limit=None):
+        """! reads the written passages matching every given filter, oldest first.
+
+        @param start, end time range [start, end) of the passages.
+        @param plate the plate content.
+        @param brand the brand of the vehicles.
+        @param camera the camera of the passages.
+        @param limit maximum number of passages returned.
+
+        @return list of dicts with the COLUMNS of the passages.
+        """
+        clauses = []
+        params = []
+        for clause, value in (('plate = ?', plate and vehicle_license.normalize_plate(plate)), ('brand = ?', brand),
+                              ('camera = ?', camera and str(camera)), ('timestamp >= ?', start), ('timestamp < ?', end)):
+            if value is not None:
+                clauses.append(clause)
+                params.append(value)
+        sql = f'SELECT {", ".join(COLUMNS)} FROM passages'
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        sql += ' ORDER BY timestamp'
+        if limit is not None:
+            sql += ' LIMIT ?'
+            params.append(limit)
+        with self._connection_lock:
+            rows = self._connection.execute(sql, params).fetchall()
+        return [dict(zip(COLUMNS, row)) for row in rows]
+
+    def compact(self, retention_s=None):
+        """! deletes the passages older than the retention and gives the space of the WAL back.
+
+        @param retention_s age of the oldest passage kept (the store's retention_s by default).
+
+        @return number of passages deleted.
+        """
+        retention_s = self.retention_s if retention_s is None else retention_s
+        if not retention_s:
+            return 0
+        with self._connection_lock:
+            with self._connection:
+                deleted = self._connection.execute('DELETE FROM passages WHERE timestamp < ?',
+                                                   (self.clock() - retention_s,)).rowcount
+            self._connection.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        self.compacted += deleted
+        return deleted
+
+    def flush(self, timeout=None):
+        """! waits until the passages recorded so far are written.
+
+        @return False if the timeout expired first.
+        """
+        written = threading.Event()
+        self._queue.put(written)
+        return written.wait(timeout)
+
+    def _insert(self, connection, rows):
+        start = time.perf_counter()
+        with connection:
+            connection.executemany(f'INSERT INTO passages ({", ".join(COLUMNS)}) VALUES ({", ".join("?" * len(COLUMNS))})', rows)
+        self.last_batch_ms = (time.perf_counter() - start) * 1000
+        self.written += len(rows)
+        self.batches += 1
+
+    def _write(self):
+        """! writer thread: inserts the queued passages in batches until the store is closed."""
+        connection = self._connect()
+        next_compaction = time.monotonic() + self.compact_interval_s
+        next_prune = time.monotonic() + self.index_window_s
+        running = True
+        try:
+            while running:
+                rows = []
+                flushed = []
+                try:
+                    item = self._queue.get(timeout=self.flush_interval_s)
+                except queue.Empty:
+                    item = None
+                while item is not None:
+                    if item is _STOP:
+                        running = False
+                    elif isinstance(item, threading.Event):
+                        flushed.append(item)
+                    else:
+                        rows.append(item)
+                    if len(rows) >= self.batch_size or not running:
+                        break
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        item = None
+                if rows:
+                    self._insert(connection, rows)
+                for event in flushed:
+                    event.set()
+                if self.compact_interval_s and time.monotonic() >= next_compaction:
+                    next_compaction = time.monotonic() + self.compact_interval_s
+                    self.compact()
+                if time.monotonic() >= next_prune:
+                    next_prune = time.monotonic() + self.index_window_s
+                    self._prune_index()
+        finally:
+            connection.close()
+
+    def stats(self):
+        """! @return passages recorded, written, waiting, dropped and compacted, batches written and the duration of the last one."""
+        return {
+            'event_store_recorded': self.recorded,
+            'event_store_written': self.written,
+            'event_store_queued': self._queue.qsize(),
+            'event_store_dropped': self.dropped,
+            'event_store_compacted': self.compacted,
+            'event_store_batches': self.batches,
+            'event_store_last_batch_ms': self.last_batch_ms,
+        }
+
+    def close(self):
+        """! writes the queued passages and closes the database."""
+        self._queue.put(_STOP)
+        self._writer.join()
+        self._connection.close()
+
+
+def create_event_store():
+    """! creates the event store configured in main_config.json.
+
+    @return an EventStore, or None if 'event_store_enabled' is false.
+    """
+    if not vehicle_det_config.get('event_store_enabled', False):
+        return None
+    return EventStore(vehicle_det_config.get('event_store_path', 'passages.db'),
+                      index_window_s=vehicle_det_config.get('event_store_repeat_seconds', 300),
+                      retention_s=vehicle_det_config.get('event_store_retention_days', 30) * 86400,
+                      batch_size=vehicle_det_config.get('event_store_batch_size', 500),
+                      flush_interval_s=vehicle_det_config.get('event_store_flush_interval_ms', 200) / 1000,
+                      queue_size=vehicle_det_config.get('event_store_queue_size', 10000),
+                      compact_interval_s=vehicle_det_config.get('event_store_compact_interval_s', 3600))
+
+
+_shared_store = None
+_shared_lock = threading.Lock()
+
+
+def shared_event_store():
+    """! @return the event store shared by every stream of the process (created on first use), None if it is disabled."""
+    global _shared_store
+    with _shared_lock:
+        if _shared_store is None:
+            _shared_store = create_event_store()
+            if _shared_store is not None:
+                # the passages still queued are written when the process exits
+                atexit.register(_shared_store.close)
+        return _shared_store
@@ -1,8 +1,62 @@
 """! @brief module responsible for collecting all the vehicle's features into one list."""
 import numpy as np
+import vehicle_metrics
 
 class_names = ['car','truck','LP','Toyota','Volkswagen','Ford','Honda','Chevrolet','Nissan','BMW','Mercedes','Audi','Tesla','Hyundai','Kia','Mazda','Fiat','Jeep','Porsche','Volvo','Land Rover','Peugeot','Renault','Citroen','Isuzu','MAN','Iveco','Mitsubishi','Opel','Scoda','Mini','Ferrari','Lamborghini','Jaguar','Suzuki', 'Ibiza', 'Haval','GMC']
+#! last class id a brand is picked from ('Haval' and 'GMC' are never selected as the brand)
+LAST_BRAND_CLASS = 35
 
+def crop_box(frame, xyxy, gain=1.02, pad=10):
+    """Crops a detected box out of the frame without copying it.
+
+    The box is enlarged the same way ultralytics' save_crop does it, so crops match the ones previously written to disk.
+
+    @param frame image array (BGR) the box was detected on.
+    @param xyxy the box corners [x1, y1, x2, y2].
+    @param gain multiplicative enlargement of the box's width and height.
+    @param pad pixels added to the box's width and height.
+
+    @return a numpy view of the frame covering the box.
+    """
+    x1, y1, x2, y2 = [float(v) for v in xyxy[:4]]
+    center_x, center_y = (x1 + x2) / 2, (y1 + y2) / 2
+    half_w, half_h = ((x2 - x1) * gain + pad) / 2, ((y2 - y1) * gain + pad) / 2
+    height, width = frame.shape[:2]
+    left = int(min(max(center_x - half_w, 0), width))
+    top = int(min(max(center_y - half_h, 0), height))
+    right = int(min(max(center_x + half_w, 0), width))
+    bottom = int(min(max(center_y + half_h, 0), height))
+    return frame[top:bottom, left:right]
+
+def select_features(class_ids, confidences, min_conf=0.3, type_threshold=0.1, lp_threshold=0.5, brand_threshold=0.45):
+    """Selects the vehicle type, the plate and the brand out of a set of detections.
+
+    The type (car/truck) and the brand are the argmax of their group's confidences and the plate is
+    thresholded, all with masks over the detection arrays.
+
+    @param class_ids array of the detected class ids.
+    @param confidences array of their confidences.
+    @param min_conf detections below this confidence are ignored.
+    @param type_threshold, lp_threshold, brand_threshold confidence each feature must exceed.
+
+    @return detected objects stored in a list in the following order ['car'/'truck', 'LP', 'brand'], or None.
+    """
+    class_ids = np.asarray(class_ids).ravel()
+    confidences = np.asarray(confidences).ravel()
+    if class_ids.size < 3:
+        return None
+    # ignored detections get a negative confidence so they never win a group
+    scores = np.where(confidences > min_conf, confidences, -1.0)
+    # if the model is unable to decide whether it's a car or a truck, the one with the higher confidence is kept
+    type_scores = np.where(class_ids < 2, scores, -1.0)
+    lp_scores = np.where(class_ids == 2, scores, -1.0)
+    brand_scores = np.where((class_ids > 2) & (class_ids <= LAST_BRAND_CLASS), scores, -1.0)
+    best_type, best_brand = type_scores.argmax(), brand_scores.argmax()
+    if type_scores[best_type] > type_threshold and lp_scores.max() > lp_threshold and brand_scores[best_brand] > brand_threshold:
+        return [class_names[int(class_ids[best_type])], class_names[2], class_names[int(class_ids[best_brand])]]
+    return None
+
+@vehicle_metrics.timed('filter_process_objects')
 def filter_process_objects(results):
     """Filters and processes detected objects.
 
@@ -10,54 +64,29 @@ def filter_process_objects(results):
 
     @return detected objects stored in a list in the following order ['car'/'truck', 'LP', 'brand'].
     """
-    for result in results:
-        class_ids=[]
-        confidences=[]
-        for result in results:
-            boxes = result.boxes.cpu().numpy()
-            confidences.append(boxes.conf)
-            class_ids.append(boxes.cls)
-            class_ids_array = np.concatenate(class_ids)
-            confidences_array = np.concatenate(confidences)
-            desired_class_ids_array = class_ids_array.astype(int).tolist()
-            desired_conf_array = confidences_array.astype(float).tolist()
-            result_dict = {}
-            car_found = False
-            LP_found = False
-            Brand_found = False
-
-            for i in range(len(desired_class_ids_array)):
-                if desired_conf_array[i] > 0.3:
-                    result_dict[desired_class_ids_array[i]] = desired_conf_array[i]
-
-            result_dict = dict(sorted(result_dict.items()))
-
-            if len(result_dict)>3: 
-                class_ids_list = list(result_dict.keys())
-                if class_ids_list[0]=='0' and class_ids_list[1]=='1': # if the model is unable to decide whether it's a car or a truck, the one with the higher confidence is gonna be kept
-                    if result_dict['0']> result_dict['1']:
-                        del result_dict['1']
-                    else:
-                        del result_dict['0']
-                class_ids_list1 = list(result_dict.keys())
-                while len(result_dict)>3:  # choose the brand with the higher confidence
-                    if result_dict[class_ids_list1[-1]]>result_dict[class_ids_list1[-2]]:
-                        del result_dict[class_ids_list1[-2]]
-                    else:
-                        del result_dict[class_ids_list1[-1]]
-                    class_ids_list1 = list(result_dict.keys())
-
-            features = list(result_dict.keys())
-            final_features = []
-            if len(result_dict) > 2:
-                for j in result_dict.keys():
-                    if j in [0, 1] and result_dict[j] > 0.1:  
-                        car_found = True
-                    elif j == 2 and result_dict[j] > 0.5:
-                        LP_found = True
-                    elif 3 <= j <= 35 and result_dict[j] > 0.45:
-                        Brand_found = True
-                if car_found and LP_found and Brand_found: # if the vehicle and the brand and the lp are detected proceed to other tests
-                    for feature in features:
-                        final_features.append(class_names[feature])
-                    return final_features
\ No newline at end of file
+    boxes = [result.boxes.cpu().numpy() for result in results]
+    if len(boxes) == 1:
+        return select_features(boxes[0].cls, boxes[0].conf)
+    if not boxes:
+        return None
+    return select_features(np.concatenate([box.cls for box in boxes]), np.concatenate([box.conf for box in boxes]))
+
+@vehicle_metrics.timed('select_vehicle_box')
+def select_vehicle_box(results, min_conf=0.3):
+    """Selects the box of the most confident vehicle (car or truck), the one select_features reports.
+
+    @param results the results of the yolo general features model.
+    @param min_conf detections below this confidence are ignored.
+
+    @return the box [x1, y1, x2, y2] or None if no vehicle was detected.
+    """
+    boxes = [result.boxes.cpu().numpy() for result in results]
+    if not boxes:
+        return None
+    xyxy = np.concatenate([np.asarray(box.xyxy).reshape(-1, 4) for box in boxes])
+    class_ids = np.concatenate([np.asarray(box.cls).ravel() for box in boxes])
+    confidences = np.concatenate([np.asarray(box.conf).ravel() for box in boxes])
+    type_scores = np.where((class_ids < 2) & (confidences > min_conf), confidences, -1.0)
+    if type_scores.size == 0 or type_scores.max() < 0:
+        return None
+    return xyxy[type_scores.argmax()]
@@ -0,0 +1,185 @@
+"""! @brief module responsible for reducing the decode and inference work per frame: region of interest, inference resolution and frame stride."""
+import cv2
+import numpy as np
+import vehicle_metrics
+from vehicle_config import vehicle_det_config
+
+
+def predict_options():
+    """! @return the keyword arguments of the general features model's predict call ('imgsz' when 'inference_size' is set)."""
+    inference_size = vehicle_det_config.get('inference_size', 0)
+    return {'imgsz': inference_size} if inference_size else {}
+
+
+class RegionOfInterest:
+    """! the part of a fixed camera's view where vehicles pass.
+
+    Shapes are rectangles [x1, y1, x2, y2] or polygons [[x, y], ...], in pixels or, when every
+    coordinate is at most 1, in fractions of the frame. The frame is cropped to the bounding box of
+    the shapes and, when polygons are given, the pixels outside them are blacked out.
+    """
+
+    def __init__(self, shapes):
+        """! @param shapes list of rectangles and polygons."""
+        self.shapes = shapes
+        self._frame_shape = None
+        self._bounds = None
+        self._mask = None
+
+    def _polygons(self, width, height):
+        """! @return every shape as an int32 polygon in pixels."""
+        polygons = []
+        for shape in self.shapes:
+            if not isinstance(shape[0], (list, tuple)):
+                x1, y1, x2, y2 = shape
+                shape = [[x1, y1], [x2, y1], [x2, y2], [x1, y2]]
+            points = np.array(shape, dtype=np.float64)
+            if points.max() <= 1:
+                points *= [width, height]
+            polygons.append(np.round(points).astype(np.int32))
+        return polygons
+
+    def _prepare(self, frame_shape):
+        """! computes the crop bounds and the mask once per frame size."""
+        height, width = frame_shape[:2]
+        polygons = self._polygons(width, height)
+        points = np.concatenate(polygons)
+        x1, y1 = np.clip(points.min(axis=0), 0, [width, height])
+        x2, y2 = np.clip(points.max(axis=0), 0, [width, height])
+        self._bounds = (int(x1), int(y1), int(x2), int(y2))
+        self._mask = None
+        rectangles = all(not isinstance(shape[0], (list, tuple)) for shape in self.shapes)
+        if not (rectangles and len(self.shapes) == 1):
+            mask = np.zeros((int(y2 - y1), int(x2 - x1)), dtype=np.uint8)
+            cv2.fillPoly(mask, [polygon - [x1, y1] for polygon in polygons], 255)
+            self._mask = mask
+        self._frame_shape = frame_shape
+
+    def bounds(self, frame_shape):
+        """! @return the (x1, y1, x2, y2) crop of frames of this shape."""
+        if frame_shape != self._frame_shape:
+            self._prepare(frame_shape)
+        return self._bounds
+
+    def apply(self, frame):
+        """! crops the frame to the region of interest.
+
+        @param frame image array (BGR).
+
+        @return a view of the frame for a single rectangle, otherwise a masked copy of the crop.
+        """
+        x1, y1, x2, y2 = self.bounds(frame.shape)
+        crop = frame[y1:y2, x1:x2]
+        if self._mask is None:
+            return crop
+        return cv2.bitwise_and(crop, crop, mask=self._mask)
+
+
+class FrameSampler:
+    """! decides which frames are decoded and crops them before the general features model.
+
+    Only one frame in stride is decoded, the others are grabbed (read from the source without
+    decoding) so the capture keeps up with the camera. After idle_after decoded frames without any
+    detection the stride grows to idle_stride, and falls back to stride on the next detection.
+    """
+
+    def __init__(self, roi=None, stride=1, idle_stride=None, idle_after=25):
+        """! @param roi optional RegionOfInterest.
+        @param stride decode one frame in stride while vehicles are around.
+        @param idle_stride decode one frame in idle_stride while nothing is detected (stride by default).
+        @param idle_after decoded frames without detection before the idle stride applies.
+        """
+        self.roi = roi
+        self.stride = max(1, stride)
+        self.idle_stride = max(self.stride, idle_stride or self.stride)
+        self.idle_after = idle_after
+        self.frames_without_detection = 0
+        self.decoded = 0
+        self.grabbed = 0
+        self._since_decode = None
+
+    def current_stride(self):
+        """! @return the stride in use: idle_stride once the scene is idle, stride otherwise."""
+        return self.idle_stride if self.frames_without_detection >= self.idle_after else self.stride
+
+    def should_decode(self):
+        """! called for every frame of the source.
+
+        @return True if the frame must be decoded, False if it can just be grabbed.
+        """
+        if self._since_decode is None or self._since_decode + 1 >= self.current_stride():
+            self._since_decode = 0
+            self.decoded += 1
+            return True
+        self._since_decode += 1
+        self.grabbed += 1
+        return False
+
+    def crop(self, frame):
+        """! @return the part of the frame the model should see."""
+        return self.roi.apply(frame) if self.roi is not None else frame
+
+    def observe(self, detected):
+        """! records whether the model found anything on the last decoded frame.
+
+        @param detected True if the general features model returned at least one box.
+        """
+        if detected:
+            self.frames_without_detection = 0
+        else:
+            self.frames_without_detection += 1
+
+    def stats(self):
+        """! @return decoded and grabbed frames, the fraction of frames not decoded and the stride in use."""
+        frames = self.decoded + self.grabbed
+        return {
+            'frames_decoded': self.decoded,
+            'frames_grabbed': self.grabbed,
+            'grabbed_ratio': self.grabbed / frames if frames else 0.0,
+            'stride': self.current_stride(),
+        }
+
+
+def has_detections(results):
+    """! tells whether the general features model found at least one box."""
+    return any(len(result.boxes) for result in results)
+
+
+@vehicle_metrics.timed('decode')
+def read_frame(cap, sampler=None):
+    """! reads the next frame to process, grabbing without decoding the ones the sampler skips.
+
+    @param cap the cv2.VideoCapture.
+    @param sampler optional FrameSampler.
+
+    @return (frame or None when the source ended, number of frames consumed from the source).
+    """
+    consumed = 0
+    while sampler is not None and not sampler.should_decode():
+        if not cap.grab():
+            return None, consumed
+        consumed += 1
+    ret, frame = cap.read()
+    if not ret:
+        return None, consumed
+    return (sampler.crop(frame) if sampler is not None else frame), consumed + 1
+
+
+def create_frame_sampler(source=None):
+    """! creates the frame sampler configured in main_config.json.
+
+    'roi' is either a list of shapes applied to every source or a dict of such lists keyed by source.
+
+    @param source the video's path, camera index or RTSP url, to pick its region of interest.
+
+    @return a FrameSampler, or None if no region of interest and no stride are configured.
+    """
+    shapes = vehicle_det_config.get('roi', [])
+    if isinstance(shapes, dict):
+        shapes = shapes.get(str(source), [])
+    stride = vehicle_det_config.get('frame_stride', 1)
+    idle_stride = vehicle_det_config.get('idle_frame_stride', 1)
+    if not shapes and stride <= 1 and idle_stride <= 1:
+        return None
+    return FrameSampler(roi=RegionOfInterest(shapes) if shapes else None, stride=stride, idle_stride=idle_stride,
+                        idle_after=vehicle_det_config.get('idle_after_frames', 25))
@@ -1,17 +1,11 @@
 """! @brief module responsible for launching video/camera, and applying the general features model."""
-from ultralytics import YOLO
 import cv2
-import json
-
-
-try:
-    with open('main_config.json') as f:
-        vehicle_det_config = json.load(f)
-except :
-    raise FileNotFoundError("The file 'main_config.json' was not found.")
-
+import vehicle_models
+import vehicle_frames
+import vehicle_metrics
 
 
+@vehicle_metrics.timed('initialize_components')
 def initialize_components(path):
     """Initializes necessary components for object detection.
 
@@ -20,25 +14,33 @@ def initialize_components(path):
         - frame_number  
         - the results of the general features (car/truck, lp, and brand) model
     """
-    model = YOLO(vehicle_det_config['general_features_model'])
+    model = vehicle_models.registry.get('general_features_model')
     cap = cv2.VideoCapture(path) 
     #cap = cv2.VideoCapture(0)   
     bg_subtractor = cv2.createBackgroundSubtractorMOG2()  # Create background subtractor object
     return model, cap, bg_subtractor
 
-def object_detection_loop(model, cap, frame_number):
+@vehicle_metrics.timed('object_detection_loop')
+def object_detection_loop(model, cap, frame_number, motion_gate=None, sampler=None):
     """Perform object detection on video frames.
 
     @param the yolo model that identifies the general features (car/truck, lp, and brand) and cap.
+    @param motion_gate optional MotionGate; frames without motion skip the model and get empty results.
+    @param sampler optional FrameSampler; skipped frames are grabbed without being decoded and the frame is cropped to the region of interest.
 
-    @return the frame's content, frame_number ,and the results of the general features model
+    @return the frame's content (cropped to the region of interest), frame_number ,and the results of the general features model
     """
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            raise Exception("Error: Frame could not be read.")
-
-        frame_number += 1
-        results = model.predict(frame)
-        return frame, results, frame_number
-    
\ No newline at end of file
+    frame, consumed = vehicle_frames.read_frame(cap, sampler)
+    frame_number += consumed
+    if frame is None:
+        raise Exception("Error: Frame could not be read.")
+
+    if motion_gate is not None and not motion_gate.should_detect(frame):
+        if sampler is not None:
+            sampler.observe(False)
+        return frame, [], frame_number
+    with vehicle_models.registry.inference('general_features_model'):
+        results = model.predict(frame, **vehicle_frames.predict_options())
+    if sampler is not None:
+        sampler.observe(vehicle_frames.has_detections(results))
+    return frame, results, frame_number
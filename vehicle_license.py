@@ -1,96 +1,157 @@
 """! @brief module responsible for identifying license plate's content and nationality."""
 import os
 import cv2
-import easyocr
-from ultralytics import YOLO
-import json
+import vehicle_features
+import vehicle_ocr
+import vehicle_nationality
+import vehicle_plate_cache
+import vehicle_metrics
+from vehicle_config import vehicle_det_config
 
-try:
-    with open('main_config.json') as f:
-        vehicle_det_config = json.load(f)
-except :
-    raise FileNotFoundError("The file 'main_config.json' was not found.")
+# crops are only written to disk when a debug directory is configured
+debug_crops_dir = vehicle_det_config.get('debug_crops_dir', '')
+# near-identical plate crops of one passage are read once (None when 'plate_cache_enabled' is false)
+plate_cache = vehicle_plate_cache.create_plate_cache()
+
+def load_image(image_to_cap):
+    """! returns the image as a BGR array, reading it from disk only when a path is given.
+
+    @param image_to_cap path to the image, or the image array itself.
+
+    @return the image array.
+    """
+    if isinstance(image_to_cap, str):
+        image = cv2.imread(image_to_cap)
+        if image is None:
+            raise FileNotFoundError(f"The image '{image_to_cap}' could not be read.")
+        return image
+    return image_to_cap
+
+@vehicle_metrics.timed('read_license_plate_with_score')
+def read_license_plate_with_score(im):
+    """! reads the license plate content and how confident the OCR is about it (language is set to english).
+
+    @param im the license plate crop (BGR array) or the path to the license plate image.
+
+    @return license plate text and its score.
+    """
+    return vehicle_ocr.plate_ocr.read_plate(load_image(im))
+
+@vehicle_metrics.timed('read_license_plates_with_score')
+def read_license_plates_with_score(LP_crops):
+    """! reads several license plate crops in one batch.
+
+    @param LP_crops list of license plate crops (BGR arrays).
+
+    @return list of (license plate text, score), in the order of the crops.
+    """
+    return vehicle_ocr.plate_ocr.read_plates(LP_crops)
 
 def read_license_plate(im):
     """! reads the license plate content (language is set to english).
 
-    @param image_to_cap  path to the license plate image.
+    @param im the license plate crop (BGR array) or the path to the license plate image.
 
     @return license plate text.
     """
-    license_plate_crop=cv2.imread(im)
-    license_plate_crop_gray = cv2.cvtColor(license_plate_crop, cv2.COLOR_BGR2GRAY)
-    _, license_plate_crop_thresh = cv2.threshold(license_plate_crop_gray, 64, 255, cv2.THRESH_BINARY_INV)
-    
-    reader = easyocr.Reader(['en'], gpu=False)
-    detections = reader.readtext(license_plate_crop)
-    # Sort the OCR results by bounding box area and x-coordinate
-    sorted_results = sorted(detections, key=lambda x: x[0][0][0])
-    lp_text=''
-    for detection in sorted_results:
-        bbox, text, score = detection
-        lp_text+=text.upper()
-    return lp_text
-
-def predict_generic_nationality(image_to_cap):
+    return read_license_plate_with_score(im)[0]
+
+def normalize_plate(plate):
+    """! normalizes a plate string so that the same plate read twice gives the same key.
+
+    @param plate the OCR'd plate content.
+
+    @return the plate in upper case with spaces and separators removed.
+    """
+    return ''.join(character for character in plate.upper() if character.isalnum())
+
+@vehicle_metrics.timed('predict_generic_nationality')
+def predict_generic_nationality(image_to_cap, plate=None):
     """identifies the country out of the license plate.
 
-    @param image_to_cap path to the license plate image.
+    The Europe model only runs for European plates and a plate already seen is answered from the cache.
+
+    @param image_to_cap the license plate crop (BGR array) or the path to the license plate image.
+    @param plate the plate's content, if it was read, used as the cache key.
 
     @return the country name OR "america" as a default value.
     """
-    final_model = YOLO(vehicle_det_config['generic_nationality_model'])
-    nationality_list = ['europe','america','qatar','tunisia','egypt','UAE','libya']
+    image = load_image(image_to_cap)
+    plate_key = normalize_plate(plate) if plate else None
+    return vehicle_nationality.nationality_cascade.predict(image, plate_key)
 
-    final_europe_model = YOLO(vehicle_det_config['europe_nationality_model'])
-    europe_nationality_list = ['Poland','Italy','France','Spain','Belgium','Germany','Romania','Turkey']
+@vehicle_metrics.timed('recognize_plate_crop')
+def recognize_plate_crop(LP_crop, frame_number, scope=None):
+    """Reads a plate crop and predicts its nationality.
 
-    image = cv2.imread(image_to_cap)
-    results = final_model.predict(image)
-    class_ids=[]
-    confidences=[]
-    for result in results:
-                boxes = result.boxes.cpu().numpy()
-                confidences.append(boxes.conf)
-                class_ids.append(boxes.cls)
-    if len(boxes) != 0:
-        nationality = nationality_list[int(boxes.cls[0])]
-        if nationality == 'europe':
-             europe_results = final_europe_model.predict(image)
-             for result in europe_results:
-                boxes = result.boxes.cpu().numpy()
-             if len(boxes) != 0:   
-                return europe_nationality_list[int(boxes.cls[0])]   
-             else:
-                 return "france"
-        else:
-             return nationality    
-
-    else:
-        return "america"
+    A crop nearly identical to one of the same vehicle read recently is answered by the plate cache without OCR nor nationality inference.
+
+    @param LP_crop the license plate crop (BGR array).
+    @param frame_number the number of the frame the crop comes from.
+    @param scope the (camera, track id) of the vehicle, None bypasses the plate cache.
+
+    @return the LP's content and it's nationality.
+    """
+    crop_hash = None
+    if plate_cache is not None and scope is not None:
+        crop_hash, cached = plate_cache.lookup(LP_crop, scope)
+        if cached is not None:
+            return cached
+    if debug_crops_dir:
+        cv2.imwrite(os.path.join(debug_crops_dir, f"LP_cropped{frame_number}.jpg"), LP_crop)
+    LP = read_license_plate(LP_crop)
+    if len(LP) < 4:
+        raise Exception("Error: LP could not be read properly, try to move a bit")
+
+    general_nationality = predict_generic_nationality(LP_crop, LP)
+    if plate_cache is not None:
+        plate_cache.store(crop_hash, (LP, general_nationality))
+    return LP , general_nationality
+
+@vehicle_metrics.timed('recognize_plate_crops')
+def recognize_plate_crops(LP_crops, frame_number, scopes=None):
+    """Reads several plate crops in one OCR batch and predicts the nationality of the readable ones.
+
+    @param LP_crops list of license plate crops (BGR arrays).
+    @param frame_number the number of the frame the crops come from.
+    @param scopes the (camera, track id) of the vehicle of each crop, None bypasses the plate cache.
 
+    @return list holding, for each crop, the LP's content and it's nationality, or None if it could not be read properly.
+    """
+    recognized = [None] * len(LP_crops)
+    hashes = [None] * len(LP_crops)
+    missing = list(range(len(LP_crops)))
+    if plate_cache is not None and scopes is not None:
+        missing = []
+        for index, LP_crop in enumerate(LP_crops):
+            hashes[index], recognized[index] = plate_cache.lookup(LP_crop, scopes[index])
+            if recognized[index] is None:
+                missing.append(index)
+    if debug_crops_dir:
+        for index in missing:
+            cv2.imwrite(os.path.join(debug_crops_dir, f"LP_cropped{frame_number}_{index}.jpg"), LP_crops[index])
+    readings = read_license_plates_with_score([LP_crops[index] for index in missing]) if missing else []
+    for index, (LP, _) in zip(missing, readings):
+        if len(LP) < 4:
+            continue
+        recognized[index] = (LP, predict_generic_nationality(LP_crops[index], LP))
+        if plate_cache is not None:
+            plate_cache.store(hashes[index], recognized[index])
+    return recognized
+
+@vehicle_metrics.timed('recognize_license_plate')
 def recognize_license_plate(results, frame_number):
     """Recognizes license plate and predict nationality.
 
+    The plate is cropped in memory out of the frame the model ran on; it is only saved when 'debug_crops_dir' is set.
+
     @param the results of the general features model, frame_number.
 
     @return the LP's content and it's nationality. 
     """
     for result in results:
-        for i in range(len(result)):
-            if result[i].boxes.cpu().numpy().cls == [          2]:
-                LP=""
-                cropped_LP_file=""
-                cropped_LP_filename = f"/home/pc/vehicle_detector/LP_cropped{frame_number}"
-                cropped_LP_file = f"/home/pc/vehicle_detector/LP_cropped{frame_number}.jpg"
-                result[i].save_crop("/home/pc/vehicle_detector/", cropped_LP_filename)
-                LP = read_license_plate(cropped_LP_file)
-                if len(LP) < 4:
-                    os.remove(cropped_LP_file)
-                    raise Exception("Error: LP could not be read properly, try to move a bit")
-
-
-                if cropped_LP_file !="" and len(LP) > 3:
-                    general_nationality = predict_generic_nationality(cropped_LP_file)
-                    os.remove(cropped_LP_file)
-                    return LP , general_nationality
\ No newline at end of file
+        boxes = result.boxes.cpu().numpy()
+        for i in range(len(boxes)):
+            if int(boxes.cls[i]) == 2:
+                LP_crop = vehicle_features.crop_box(result.orig_img, boxes.xyxy[i])
+                return recognize_plate_crop(LP_crop, frame_number)
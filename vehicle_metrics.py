@@ -0,0 +1,316 @@
+"""! @brief module responsible for the per-stage timers, the startup timings, the Prometheus metrics endpoint and the periodic metrics log line."""
+import time
+import bisect
+import threading
+import functools
+import psutil
+from contextlib import nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from vehicle_config import vehicle_det_config
+
+#! upper bounds in seconds of the latency histogram buckets, from the MQTT publish to the first model load
+BUCKETS_S = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+#! prefix of every exported metric
+PREFIX = 'vehicle'
+#! phases of the startup, in the order a process reaches them
+STARTUP_PHASES = ['imports', 'models_loaded', 'warm_up', 'first_frame']
+_DISABLED = nullcontext()
+
+
+def escape(label_value):
+    """! @return the label value with its backslashes, quotes and newlines escaped for the exposition format."""
+    return str(label_value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Histogram:
+    """! cumulative latency histogram of one stage, in the Prometheus layout."""
+
+    def __init__(self, buckets=BUCKETS_S):
+        """! @param buckets sorted upper bounds in seconds (+Inf is implicit)."""
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += seconds
+            self.count += 1
+
+    def quantile(self, q):
+        """! estimates a quantile by linear interpolation within its bucket.
+
+        @return the estimate in seconds, None if nothing was observed.
+        """
+        with self._lock:
+            counts, count = list(self.counts), self.count
+        if not count:
+            return None
+        rank, seen = q * count, 0
+        for index, bucket_count in enumerate(counts):
+            if seen + bucket_count >= rank and bucket_count:
+                lower = self.buckets[index - 1] if index else 0.0
+                upper = self.buckets[index] if index < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return self.buckets[-1]
+
+
+class _Stage:
+    """! context manager timing one call of a stage into its histogram."""
+
+    __slots__ = ('histogram', 'start')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start)
+        return False
+
+
+class StartupTimer:
+    """! seconds from the start of the process (interpreter startup included) to each startup phase.
+
+    Reaching the first frame logs the startup line, so the cost of a cold restart shows in the logs.
+    """
+
+    def __init__(self, log=print):
+        """! @param log function the startup line is logged with."""
+        self.started_at = psutil.Process().create_time()
+        self.phases = {}
+        self.log = log
+        self._lock = threading.Lock()
+
+    def mark(self, phase):
+        """! records when a phase is reached; only the first call per phase counts.
+
+        @param phase one of STARTUP_PHASES.
+        """
+        if phase in self.phases:
+            return
+        with self._lock:
+            if phase in self.phases:
+                return
+            self.phases[phase] = time.time() - self.started_at
+        if phase == 'first_frame':
+            self.log("startup: " + self.summary())
+
+    def summary(self):
+        """! @return one line with the time of every phase reached."""
+        return ', '.join(f"{phase} {seconds:.2f}s" for phase, seconds in self.phases.items())
+
+    def stats(self):
+        """! @return {'startup_<phase>_s': seconds} for the phases reached."""
+        return {f'startup_{phase}_s': seconds for phase, seconds in self.phases.items()}
+
+
+class Metrics:
+    """! registry of the stage histograms and of the collectors exported on /metrics.
+
+    When disabled, timed() returns the function unchanged and stage() a shared no-op context manager,
+    so the instrumented code pays nothing. Collectors are callables returning a dict of numbers (the
+    stats() of the queues, caches and streams) read at every scrape, so queue depths, dropped frames
+    and cache hits are always current without being pushed.
+    """
+
+    def __init__(self, enabled=False):
+        """! @param enabled record the metrics."""
+        self.enabled = enabled
+        self.histograms = {}
+        self.collectors = {}
+        self._lock = threading.Lock()
+        self._server = None
+        self._logger = None
+        self._stop_logging = threading.Event()
+
+    def histogram(self, name):
+        """! @return the histogram of a stage, created on first use."""
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            with self._lock:
+                histogram = self.histograms.setdefault(name, Histogram())
+        return histogram
+
+    def stage(self, name):
+        """! @return a context manager timing the block as one call of the stage."""
+        if not self.enabled:
+            return _DISABLED
+        return _Stage(self.histogram(name))
+
+    def timed(self, name):
+        """! decorator timing every call of a function as the stage name."""
+        def decorate(function):
+            if not self.enabled:
+                return function
+            histogram = self.histogram(name)
+
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    histogram.observe(time.perf_counter() - start)
+            return wrapper
+        return decorate
+
+    def observe(self, name, seconds):
+        """! adds one duration measured elsewhere to the histogram of a stage."""
+        if self.enabled:
+            self.histogram(name).observe(seconds)
+
+    def register_collector(self, name, collect, **labels):
+        """! exports the numeric values of collect() as gauges '<PREFIX>_<key>', labelled component=name and the given labels.
+
+        @param name identifies the collector; registering the same name and labels again replaces it.
+        @param collect callable returning a dict {key: value}.
+        """
+        if self.enabled:
+            with self._lock:
+                self.collectors[(name, tuple(sorted(labels.items())))] = collect
+
+    def unregister_collector(self, name, **labels):
+        """! stops exporting the collector registered with this name and labels."""
+        with self._lock:
+            self.collectors.pop((name, tuple(sorted(labels.items()))), None)
+
+    def collect(self):
+        """! @return list of (key, labels dict, value) read from every collector."""
+        with self._lock:
+            collectors = list(self.collectors.items())
+        samples = []
+        for (name, labels), collect in collectors:
+            try:
+                values = collect()
+            except Exception:
+                # a collector of a stream being torn down must not break the scrape
+                continue
+            for key, value in values.items():
+                if isinstance(value, (int, float)):
+                    samples.append((key, dict(labels, component=name), float(value)))
+        return samples
+
+    def exposition(self):
+        """! @return every metric in the Prometheus text exposition format."""
+        lines = [f'# HELP {PREFIX}_stage_seconds time spent per call of each stage',
+                 f'# TYPE {PREFIX}_stage_seconds histogram']
+        for name, histogram in sorted(self.histograms.items()):
+            with histogram._lock:
+                counts, total, count = list(histogram.counts), histogram.sum, histogram.count
+            cumulative = 0
+            for bound, bucket_count in zip(list(histogram.buckets) + ['+Inf'], counts):
+                cumulative += bucket_count
+                lines.append(f'{PREFIX}_stage_seconds_bucket{{stage="{name}",le="{bound}"}} {cumulative}')
+            lines.append(f'{PREFIX}_stage_seconds_sum{{stage="{name}"}} {total}')
+            lines.append(f'{PREFIX}_stage_seconds_count{{stage="{name}"}} {count}')
+        typed = set()
+        # the samples of one metric must be contiguous
+        for key, labels, value in sorted(self.collect(), key=lambda sample: sample[0]):
+            if key not in typed:
+                lines.append(f'# TYPE {PREFIX}_{key} gauge')
+                typed.add(key)
+            label_text = ','.join(f'{label}="{escape(label_value)}"' for label, label_value in sorted(labels.items()))
+            lines.append(f'{PREFIX}_{key}{{{label_text}}} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        """! @return one line with the calls, p50 and p95 in milliseconds of every stage."""
+        parts = []
+        for name, histogram in sorted(self.histograms.items()):
+            if histogram.count:
+                parts.append(f"{name} n={histogram.count} p50={1000 * histogram.quantile(0.5):.1f}ms "
+                             f"p95={1000 * histogram.quantile(0.95):.1f}ms")
+        return ' | '.join(parts)
+
+    def serve(self, port, host='127.0.0.1'):
+        """! serves /metrics over HTTP in a background thread.
+
+        @param port port to listen on (0 picks a free one, see the returned server's server_port).
+
+        @return the HTTP server.
+        """
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.exposition().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self._server
+
+    def log_every(self, interval_s, log=print):
+        """! logs the summary line every interval_s seconds in a background thread."""
+        def run():
+            while not self._stop_logging.wait(interval_s):
+                line = self.summary()
+                if line:
+                    log("metrics: " + line)
+        self._stop_logging.clear()
+        self._logger = threading.Thread(target=run, daemon=True)
+        self._logger.start()
+
+    def stop(self):
+        """! stops the HTTP endpoint and the log line."""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        self._stop_logging.set()
+
+
+#! metrics shared by every module, enabled by 'metrics_enabled'
+metrics = Metrics(enabled=vehicle_det_config.get('metrics_enabled', False))
+#! startup timings of the process, marked by main.py and start_models, and the first frame by the frame loops (main, VehicleStream.process_frame, the pipeline's detection worker and the service's requests)
+startup = StartupTimer()
+metrics.register_collector('startup', startup.stats)
+
+
+def timed(name):
+    """! decorator timing every call of a function as the stage name (no-op when the metrics are disabled)."""
+    return metrics.timed(name)
+
+
+def stage(name):
+    """! @return a context manager timing the block as one call of the stage (no-op when the metrics are disabled)."""
+    return metrics.stage(name)
+
+
+def register_collector(name, collect, **labels):
+    """! exports the numeric values of collect() at every scrape (no-op when the metrics are disabled)."""
+    metrics.register_collector(name, collect, **labels)
+
+
+def unregister_collector(name, **labels):
+    """! stops exporting a collector, e.g. the stats of a stream that was closed."""
+    metrics.unregister_collector(name, **labels)
+
+
+def start_metrics():
+    """! starts the endpoint on 'metrics_port' and the log line every 'metrics_log_interval_s' seconds, when enabled."""
+    if not metrics.enabled:
+        return
+    if vehicle_det_config.get('metrics_port', 0):
+        metrics.serve(vehicle_det_config['metrics_port'], vehicle_det_config.get('metrics_host', '127.0.0.1'))
+    if vehicle_det_config.get('metrics_log_interval_s', 0):
+        metrics.log_every(vehicle_det_config['metrics_log_interval_s'])
@@ -0,0 +1,244 @@
+"""! @brief module responsible for loading every model once and sharing it between the pipeline stages."""
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+import vehicle_metrics
+from vehicle_config import vehicle_det_config
+
+#! config keys of the models that are loaded from a path in main_config.json
+MODEL_KEYS = ['general_features_model', 'generic_nationality_model', 'europe_nationality_model', 'color_model']
+#! key of the EasyOCR reader (it has no weights path in main_config.json)
+OCR_KEY = 'ocr_reader'
+
+
+def load_yolo(path):
+    """! loads an ultralytics YOLO model.
+
+    @param path path to the .pt weights.
+
+    @return the YOLO model.
+    """
+    # torch, ultralytics and easyocr take seconds to import, they are only imported when a model is loaded
+    from ultralytics import YOLO
+    return YOLO(path)
+
+
+def load_color_model(path):
+    """! loads the pickled torch color classifier and puts it in eval mode.
+
+    @param path path to the pickled torch module.
+
+    @return the color model.
+    """
+    import torch
+    model = torch.load(path, map_location="cpu", weights_only=False)
+    model.eval()
+    for parameter in model.parameters():
+        parameter.requires_grad_(False)
+    return model
+
+
+def load_model(key, path, backend='torch'):
+    """! loads one of MODEL_KEYS on the backend selected for its stage.
+
+    @param key the config key of the model.
+    @param path path to the original weights.
+    @param backend 'torch' or one of the export formats of vehicle_backends.
+
+    @return the loaded model.
+    """
+    if backend == 'torch':
+        return load_color_model(path) if key == 'color_model' else load_yolo(path)
+    # the exporters and runtimes are only imported when a stage uses them
+    import vehicle_backends
+    return vehicle_backends.load_exported(key, path, backend)
+
+
+def load_ocr_reader(languages):
+    """! creates the EasyOCR reader (weights are downloaded/loaded once per reader).
+
+    @param languages list of the languages the reader recognizes.
+
+    @return the EasyOCR reader.
+    """
+    import easyocr
+    return easyocr.Reader(languages, gpu=False)
+
+
+def warm_up_yolo(model):
+    """! runs a YOLO model once on a blank frame, which fuses its layers and allocates its buffers."""
+    model.predict(np.zeros((640, 640, 3), dtype=np.uint8), verbose=False)
+
+
+def warm_up_color_model(model):
+    """! runs the color model once on a blank crop."""
+    import torch
+    with torch.no_grad():
+        model(torch.zeros(1, 3, 224, 224))
+
+
+def warm_up_ocr_reader(reader):
+    """! runs the EasyOCR recognizer once on a blank plate."""
+    reader.recognize(np.zeros((32, 128), dtype=np.uint8))
+
+
+class ModelRegistry:
+    """! thread-safe registry that loads each model once and hands it to every stage.
+
+    Models are keyed by their path in main_config.json, so two config keys pointing at
+    the same weights share one instance. Load time and per-call inference time are
+    recorded separately.
+    """
+
+    def __init__(self, config, loaders=None):
+        """! creates an empty registry.
+
+        @param config the parsed main_config.json.
+        @param loaders optional dict {config key: callable(path)} overriding the default loaders.
+        """
+        self.config = config
+        # 'model_backends' selects per stage the torch weights or their ONNX/TorchScript/OpenVINO export
+        backends = config.get('model_backends', {})
+        self.loaders = {key: functools.partial(load_model, key, backend=backends.get(key, 'torch')) for key in MODEL_KEYS}
+        self.loaders[OCR_KEY] = load_ocr_reader
+        if loaders:
+            self.loaders.update(loaders)
+        self.warmers = {key: warm_up_color_model if key == 'color_model' else warm_up_yolo for key in MODEL_KEYS}
+        self.warmers[OCR_KEY] = warm_up_ocr_reader
+        self._warm_up_times = {}
+        self._models = {}
+        self._load_times = {}
+        self._inference_stats = {}
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._inference_locks = {}
+
+    def _source(self, key):
+        """! returns what the model of a config key is loaded from (its path, or the OCR languages)."""
+        if key == OCR_KEY:
+            return ('easyocr',) + tuple(self.config.get('ocr_languages', ['en']))
+        if key not in self.config:
+            raise KeyError(f"'{key}' is not defined in 'main_config.json'.")
+        return self.config[key]
+
+    def get(self, key):
+        """! returns the model of a config key, loading it on first use.
+
+        @param key one of MODEL_KEYS or OCR_KEY.
+
+        @return the loaded model.
+        """
+        source = self._source(key)
+        model = self._models.get(source)
+        if model is not None:
+            return model
+        with self._lock:
+            key_lock = self._key_locks.setdefault(source, threading.Lock())
+        with key_lock:
+            model = self._models.get(source)
+            if model is None:
+                start = time.perf_counter()
+                argument = list(source[1:]) if key == OCR_KEY else source
+                model = self.loaders[key](argument)
+                self._load_times[key] = time.perf_counter() - start
+                self._models[source] = model
+        return model
+
+    def preload(self, keys=None):
+        """! eagerly loads the models (all of them by default) so no stage pays the load on its first vehicle.
+
+        @param keys optional list of config keys to load.
+        """
+        for key in keys or MODEL_KEYS + [OCR_KEY]:
+            self.get(key)
+
+    def warm_up(self, keys=None):
+        """! loads the models and runs each one once on a blank input, so the first vehicle pays neither the load nor the lazy initialization.
+
+        The warm-up calls are not counted as inferences.
+
+        @param keys optional list of config keys to warm up.
+        """
+        for key in keys or MODEL_KEYS + [OCR_KEY]:
+            model = self.get(key)
+            start = time.perf_counter()
+            with self.lock(key):
+                self.warmers[key](model)
+            self._warm_up_times[key] = time.perf_counter() - start
+
+    def is_loaded(self, key):
+        """! tells whether the model of a config key is already in memory."""
+        return self._source(key) in self._models
+
+    def lock(self, key):
+        """! returns the lock serializing the inference calls of a model (the models are not thread safe)."""
+        source = self._source(key)
+        with self._lock:
+            return self._inference_locks.setdefault(source, threading.Lock())
+
+    @contextmanager
+    def inference(self, key):
+        """! context manager around one inference call of a model.
+
+        Calls to the same model are serialized while different models run in parallel; the recorded
+        duration excludes the time spent waiting for the model.
+        """
+        with self.lock(key):
+            start = time.perf_counter()
+            try:
+                yield
+            finally:
+                self.record_inference(key, time.perf_counter() - start)
+
+    def record_inference(self, key, seconds):
+        """! adds one inference duration to the statistics of a model and to its 'inference:<key>' histogram."""
+        vehicle_metrics.metrics.observe('inference:' + key, seconds)
+        with self._lock:
+            stats = self._inference_stats.setdefault(key, [0, 0.0])
+            stats[0] += 1
+            stats[1] += seconds
+
+    def report(self):
+        """! summarizes load time and inference time per model.
+
+        @return dict {key: {'load_s', 'warm_up_s', 'calls', 'inference_total_s', 'inference_mean_s'}}.
+        """
+        report = {}
+        with self._lock:
+            for key in set(self._load_times) | set(self._inference_stats):
+                calls, total = self._inference_stats.get(key, [0, 0.0])
+                report[key] = {
+                    'load_s': self._load_times.get(key),
+                    'warm_up_s': self._warm_up_times.get(key),
+                    'calls': calls,
+                    'inference_total_s': total,
+                    'inference_mean_s': total / calls if calls else None,
+                }
+        return report
+
+    def clear(self):
+        """! drops every loaded model and the recorded statistics."""
+        with self._lock:
+            self._models.clear()
+            self._load_times.clear()
+            self._warm_up_times.clear()
+            self._inference_stats.clear()
+
+
+#! registry shared by all the modules of the project
+registry = ModelRegistry(vehicle_det_config)
+
+
+def start_models(warm_up=False):
+    """! loads every model of the shared registry at startup and marks the startup phases.
+
+    @param warm_up also run each model once, so the first frame pays none of their lazy initialization.
+    """
+    registry.preload()
+    vehicle_metrics.startup.mark('models_loaded')
+    if warm_up:
+        registry.warm_up()
+        vehicle_metrics.startup.mark('warm_up')
@@ -0,0 +1,88 @@
+"""! @brief module responsible for gating the general features model on motion, so idle frames skip detection."""
+import time
+import cv2
+from vehicle_config import vehicle_det_config
+
+
+class MotionGate:
+    """! decides, frame by frame, whether the general features model needs to run.
+
+    A background subtractor runs on a downscaled grayscale copy of the frame. The gate opens when
+    the foreground covers more than area_threshold of the frame and stays open for hold_frames
+    frames and cooldown_s seconds after the last motion, so a vehicle that stops at the barrier
+    keeps being detected.
+    """
+
+    def __init__(self, scale=0.25, area_threshold=0.01, hold_frames=15, cooldown_s=2.0, clock=time.monotonic):
+        """! @param scale downscaling factor applied to the frame before the background subtraction.
+        @param area_threshold fraction of the frame the foreground must cover to count as motion.
+        @param hold_frames frames the gate stays open after the last motion.
+        @param cooldown_s seconds the gate stays open after the last motion.
+        @param clock function returning the current time in seconds.
+        """
+        self.scale = scale
+        self.area_threshold = area_threshold
+        self.hold_frames = hold_frames
+        self.cooldown_s = cooldown_s
+        self.clock = clock
+        self.bg_subtractor = cv2.createBackgroundSubtractorMOG2(detectShadows=False)
+        self.frames = 0
+        self.skipped = 0
+        self.frames_since_motion = None
+        self.last_motion_at = None
+
+    def foreground_ratio(self, frame):
+        """! applies the background subtraction to the downscaled frame.
+
+        @param frame image array (BGR).
+
+        @return the fraction of the frame covered by the foreground.
+        """
+        small = cv2.resize(frame, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+        if small.ndim == 3:
+            small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        fg_mask = self.bg_subtractor.apply(small)
+        # the median blur removes the isolated pixels caused by sensor noise and compression
+        fg_mask = cv2.medianBlur(fg_mask, 3)
+        return cv2.countNonZero(fg_mask) / fg_mask.size
+
+    def should_detect(self, frame):
+        """! feeds a frame to the gate.
+
+        @param frame image array (BGR).
+
+        @return True if the general features model should run on this frame.
+        """
+        self.frames += 1
+        now = self.clock()
+        if self.foreground_ratio(frame) > self.area_threshold:
+            self.frames_since_motion = 0
+            self.last_motion_at = now
+            return True
+        if self.frames_since_motion is not None:
+            self.frames_since_motion += 1
+            if self.frames_since_motion <= self.hold_frames or now - self.last_motion_at < self.cooldown_s:
+                return True
+        self.skipped += 1
+        return False
+
+    def stats(self):
+        """! @return the number of frames seen and skipped, and the fraction of skipped frames."""
+        return {
+            'gate_frames': self.frames,
+            'gate_skipped': self.skipped,
+            'gate_skipped_ratio': self.skipped / self.frames if self.frames else 0.0,
+        }
+
+
+def create_motion_gate():
+    """! creates the motion gate configured in main_config.json.
+
+    @return a MotionGate, or None if 'motion_gate_enabled' is false.
+    """
+    if not vehicle_det_config.get('motion_gate_enabled', False):
+        return None
+    return MotionGate(scale=vehicle_det_config.get('motion_gate_scale', 0.25),
+                      area_threshold=vehicle_det_config.get('motion_gate_area_threshold', 0.01),
+                      hold_frames=vehicle_det_config.get('motion_gate_hold_frames', 15),
+                      cooldown_s=vehicle_det_config.get('motion_gate_cooldown_s', 2.0))
@@ -1,20 +1,24 @@
 """! @brief module responsible for connecting to mqtt broker and sending the json message."""
 
+import os
 import json
+import time
+import queue
 import random
+import hashlib
+import threading
 from paho.mqtt import client as mqtt_client
 import uuid
+import vehicle_metrics
+import vehicle_config
 
-try:
-    with open('MQTT_config.json') as f:
-        config = json.load(f)
-except :
-    raise FileNotFoundError("The file 'MQTT_config.json' was not found.")
+config = vehicle_config.load_config('MQTT_config.json')
 
 # Global Constants for the MQTT part
 broker = config['broker_address']
 port = config['port']
 topic = config['topic']
+qos = config.get('qos', 1)
 # Generate a Client ID with the publish prefix.
 client_id = f'publish-{random.randint(0, 1000)}'
 
@@ -24,15 +28,17 @@ def connect_mqtt():
     client.connect(broker, port)
     return client
 
-def features_to_json(features_list):
+@vehicle_metrics.timed('build_features_message')
+def build_features_message(features_list, uid=None):
     """organizes the identified features of the vehicle into a json message.
 
-    @param file_path path to the video or camera.
+    @param features_list the vehicle's features ['car'/'truck', 'LP', 'brand' , 'nationality' , 'color'].
+    @param uid identifier of the passage, e.g. the one recorded in the event store (a new uuid4 by default).
 
     @return a json message.
-    """   
+    """
     values_list = features_list
-    uid = str(uuid.uuid4()) #! Generating a random UUID for uid
+    uid = uid or str(uuid.uuid4()) #! Generating a random UUID for uid
     
     json_data = {
         "activity": "Monitoring",
@@ -57,11 +63,249 @@ def features_to_json(features_list):
     }
 
     # Convert the dictionary to a JSON string
-    json_message = json.dumps(json_data, indent=4)
-    connect_mqtt().publish("features_message", json_message)
+    return json.dumps(json_data, indent=4)
+
+@vehicle_metrics.timed('features_to_json')
+def features_to_json(features_list, client=None):
+    """organizes the identified features of the vehicle into a json message and publishes it.
+
+    @param features_list the vehicle's features ['car'/'truck', 'LP', 'brand' , 'nationality' , 'color'].
+    @param client an already connected MQTT client to reuse; a new connection is opened if None.
+    """   
+    json_message = build_features_message(features_list)
+    if client is None:
+        client = connect_mqtt()
+    client.publish(topic, json_message)
 
 def run(features_list):
     """ sends the json message using MQTT"""
     client = connect_mqtt()
     client.loop_start()
-    features_to_json(features_list) 
\ No newline at end of file
+    features_to_json(features_list, client)
+
+
+class MessageSpool:
+    """! bounded disk spool keeping the messages that could not be published.
+
+    Each message is one file named by an increasing sequence number, so the spool survives a
+    restart and is flushed in publishing order; the oldest messages are evicted when it is full.
+    """
+
+    def __init__(self, directory, max_messages=1000):
+        """! @param directory where the spooled messages are written (created if missing).
+        @param max_messages number of messages kept before the oldest ones are evicted.
+        """
+        self.directory = directory
+        self.max_messages = max_messages
+        self.evicted = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._files = sorted(name for name in os.listdir(directory) if name.endswith('.msg'))
+        self._next = int(self._files[-1][:-4]) + 1 if self._files else 0
+
+    def __len__(self):
+        with self._lock:
+            return len(self._files)
+
+    def append(self, payload):
+        """! writes a message to the spool, evicting the oldest one if the spool is full."""
+        with self._lock:
+            name = f"{self._next:012d}.msg"
+            self._next += 1
+            temporary = os.path.join(self.directory, name + '.tmp')
+            with open(temporary, 'w') as f:
+                f.write(payload)
+            # the rename makes the message visible only once it is completely written
+            os.replace(temporary, os.path.join(self.directory, name))
+            self._files.append(name)
+            while len(self._files) > self.max_messages:
+                os.remove(os.path.join(self.directory, self._files.pop(0)))
+                self.evicted += 1
+
+    def peek(self, count):
+        """! @return up to count (name, payload) of the oldest spooled messages."""
+        with self._lock:
+            names = self._files[:count]
+        messages = []
+        for name in names:
+            with open(os.path.join(self.directory, name)) as f:
+                messages.append((name, f.read()))
+        return messages
+
+    def remove(self, names):
+        """! removes the messages that were published."""
+        with self._lock:
+            for name in names:
+                if name in self._files:
+                    self._files.remove(name)
+                    os.remove(os.path.join(self.directory, name))
+
+
+def spool_name(source):
+    """! names the spool subdirectory of a source, so the publishers of several cameras never share a spool.
+
+    @param source the video's path, camera index or RTSP url (hashed, as urls may hold credentials).
+    """
+    return 'source-' + hashlib.sha1(str(source).encode()).hexdigest()[:12]
+
+
+class MQTTPublisher:
+    """! long-lived MQTT publisher with automatic reconnect, an asynchronous publish queue and a disk spool.
+
+    One connection is kept for the whole process. publish() only queues the message; a worker
+    thread publishes it while the broker is reachable and spools it to disk otherwise, and the
+    spool is flushed in bulk as soon as the connection comes back.
+    """
+
+    def __init__(self, broker_address=None, broker_port=None, publish_topic=None, publish_qos=None, spool_dir=None,
+                 spool_max_messages=None, queue_size=None, flush_batch=100, reconnect_delays_s=None, client_factory=None,
+                 source=None):
+        """! @param broker_address, broker_port the broker (MQTT_config.json by default).
+        @param publish_topic topic of the messages (MQTT_config.json by default).
+        @param publish_qos QoS of the messages: 0, 1 or 2.
+        @param spool_dir directory of the disk spool.
+        @param spool_max_messages number of spooled messages kept during an outage.
+        @param queue_size number of messages waiting in memory before they go to the spool.
+        @param flush_batch messages published per flush of the spool.
+        @param reconnect_delays_s (min, max) seconds between reconnection attempts, doubled after each failure.
+        @param client_factory callable() returning a paho client (for tests).
+        @param source the source this publisher is dedicated to: its spool is a subdirectory of spool_dir of its own.
+        """
+        self.broker = broker_address or broker
+        self.port = broker_port or port
+        self.topic = publish_topic or topic
+        self.qos = publish_qos if publish_qos is not None else qos
+        spool_dir = spool_dir or config.get('spool_dir', 'mqtt_spool')
+        # a spool's sequence numbers and file list belong to one publisher, so two publishers never share a directory
+        if source is not None:
+            spool_dir = os.path.join(spool_dir, spool_name(source))
+        self.spool = MessageSpool(spool_dir, spool_max_messages or config.get('spool_max_messages', 1000))
+        self.flush_batch = flush_batch
+        self.reconnect_delays_s = reconnect_delays_s or (config.get('reconnect_min_delay_s', 1), config.get('reconnect_max_delay_s', 30))
+        self.client_factory = client_factory or (lambda: mqtt_client.Client(f'publish-{random.randint(0, 1000)}'))
+        self.published = 0
+        self.spooled = 0
+        self.reconnects = 0
+        self._queue = queue.Queue(queue_size or config.get('publish_queue_size', 1000))
+        self._connected = threading.Event()
+        self._stopping = threading.Event()
+        self._client = None
+        self._worker = None
+
+    def _on_connect(self, client, userdata, flags, rc):
+        """! paho callback: the connection is up, the worker flushes the spool."""
+        if rc == 0:
+            self._connected.set()
+
+    def _on_disconnect(self, client, userdata, rc):
+        """! paho callback: the connection dropped, paho reconnects in the background."""
+        self._connected.clear()
+        if rc != 0:
+            self.reconnects += 1
+
+    def start(self):
+        """! connects in the background and starts the publish worker.
+
+        @return the publisher itself.
+        """
+        self._client = self.client_factory()
+        self._client.on_connect = self._on_connect
+        self._client.on_disconnect = self._on_disconnect
+        self._client.reconnect_delay_set(min_delay=self.reconnect_delays_s[0], max_delay=self.reconnect_delays_s[1])
+        self._client.connect_async(self.broker, self.port)
+        self._client.loop_start()
+        self._worker = threading.Thread(target=self._work, name='mqtt-publisher', daemon=True)
+        self._worker.start()
+        return self
+
+    def publish(self, json_message):
+        """! queues a message; it goes to the spool if the queue is full."""
+        try:
+            self._queue.put_nowait(json_message)
+        except queue.Full:
+            self._spool(json_message)
+
+    def publish_features(self, features_list, uid=None):
+        """! queues the json message of a vehicle's features.
+
+        @param uid identifier of the passage (a new uuid4 by default).
+        """
+        self.publish(build_features_message(features_list, uid))
+
+    def _spool(self, json_message):
+        self.spool.append(json_message)
+        self.spooled += 1
+
+    @vehicle_metrics.timed('mqtt_send')
+    def _send(self, json_message):
+        """! publishes one message on the live connection.
+
+        @return True if paho accepted it.
+        """
+        info = self._client.publish(self.topic, json_message, qos=self.qos)
+        if info.rc != mqtt_client.MQTT_ERR_SUCCESS:
+            return False
+        self.published += 1
+        return True
+
+    def _flush_spool(self):
+        """! publishes the spooled messages in bulk, oldest first, while the connection stays up."""
+        while self._connected.is_set():
+            messages = self.spool.peek(self.flush_batch)
+            if not messages:
+                return
+            sent = []
+            for name, payload in messages:
+                if not self._send(payload):
+                    break
+                sent.append(name)
+            self.spool.remove(sent)
+            if len(sent) < len(messages):
+                return
+
+    def _work(self):
+        """! publish worker: sends the queued messages, spools them while the broker is unreachable."""
+        while not (self._stopping.is_set() and self._queue.empty()):
+            if self._connected.is_set() and len(self.spool):
+                self._flush_spool()
+            try:
+                json_message = self._queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            # the spool is flushed first so messages keep their order
+            if not self._connected.is_set() or len(self.spool) or not self._send(json_message):
+                self._spool(json_message)
+
+    def flush(self, timeout=5.0):
+        """! waits until the queue and the spool are empty or the timeout expired.
+
+        @return True if everything was published.
+        """
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self._queue.empty() and not len(self.spool):
+                return True
+            time.sleep(0.01)
+        return False
+
+    def stop(self, timeout=5.0):
+        """! publishes what it can within the timeout, keeps the rest in the spool and disconnects."""
+        if self._connected.is_set():
+            self.flush(timeout)
+        self._stopping.set()
+        if self._worker is not None:
+            self._worker.join()
+        if self._client is not None:
+            self._client.loop_stop()
+            self._client.disconnect()
+
+    def stats(self):
+        """! @return published, spooled and evicted message counts, spool size and reconnects."""
+        return {
+            'published': self.published,
+            'spooled': self.spooled,
+            'spool_size': len(self.spool),
+            'spool_evicted': self.spool.evicted,
+            'reconnects': self.reconnects,
+            'connected': self._connected.is_set(),
+        }
@@ -0,0 +1,190 @@
+"""! @brief minimal in-process MQTT 3.1.1 broker, used by the tests and the benchmarks in place of mosquitto.
+
+It handles CONNECT, PUBLISH (QoS 0 and 1), SUBSCRIBE, PINGREQ and DISCONNECT, records every
+message it receives and forwards it to the matching subscribers. It is not meant for production.
+"""
+import socket
+import struct
+import threading
+
+
+def _read_exactly(connection, size):
+    """! reads size bytes from the socket, or returns None if it was closed."""
+    data = b''
+    while len(data) < size:
+        chunk = connection.recv(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+
+def _read_packet(connection):
+    """! reads one MQTT control packet.
+
+    @return (packet type, flags, body) or None if the connection was closed.
+    """
+    header = _read_exactly(connection, 1)
+    if header is None:
+        return None
+    remaining, multiplier = 0, 1
+    while True:
+        byte = _read_exactly(connection, 1)
+        if byte is None:
+            return None
+        remaining += (byte[0] & 127) * multiplier
+        if not byte[0] & 128:
+            break
+        multiplier *= 128
+    body = _read_exactly(connection, remaining) if remaining else b''
+    if body is None:
+        return None
+    return header[0] >> 4, header[0] & 0x0F, body
+
+
+def _encode_packet(packet_type, flags, body):
+    """! encodes an MQTT control packet."""
+    remaining = len(body)
+    encoded_length = b''
+    while True:
+        byte = remaining % 128
+        remaining //= 128
+        encoded_length += bytes([byte | 128 if remaining else byte])
+        if not remaining:
+            break
+    return bytes([(packet_type << 4) | flags]) + encoded_length + body
+
+
+def topic_matches(subscription, topic):
+    """! tells whether a topic matches a subscription filter with '+' and '#' wildcards."""
+    subscription_levels, topic_levels = subscription.split('/'), topic.split('/')
+    for index, level in enumerate(subscription_levels):
+        if level == '#':
+            return True
+        if index >= len(topic_levels) or (level != '+' and level != topic_levels[index]):
+            return False
+    return len(subscription_levels) == len(topic_levels)
+
+
+class StandInBroker:
+    """! MQTT broker listening on localhost in a background thread."""
+
+    def __init__(self, host='127.0.0.1', port=0):
+        """! @param host address to listen on.
+        @param port port to listen on (0 picks a free one, see self.port).
+        """
+        self.host = host
+        self.port = port
+        #! list of (topic, payload bytes, qos) received from the clients
+        self.messages = []
+        self.connections = 0
+        self._subscriptions = []
+        self._lock = threading.Lock()
+        self._message_event = threading.Condition(self._lock)
+        self._server = None
+        self._clients = set()
+        self._running = False
+
+    def start(self):
+        """! starts listening and accepting clients."""
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind((self.host, self.port))
+        self.port = self._server.getsockname()[1]
+        self._server.listen()
+        self._running = True
+        threading.Thread(target=self._accept, daemon=True).start()
+        return self
+
+    def stop(self):
+        """! closes the listening socket and every client connection."""
+        self._running = False
+        if self._server is not None:
+            self._server.close()
+        with self._lock:
+            clients = list(self._clients)
+        for connection in clients:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            connection.close()
+
+    def wait_for_messages(self, count, timeout=5.0):
+        """! waits until count messages were received.
+
+        @return True if they arrived in time.
+        """
+        with self._message_event:
+            return self._message_event.wait_for(lambda: len(self.messages) >= count, timeout)
+
+    def _accept(self):
+        """! accepts the clients, one thread each."""
+        while self._running:
+            try:
+                connection, _ = self._server.accept()
+            except OSError:
+                return
+            with self._lock:
+                self._clients.add(connection)
+            threading.Thread(target=self._serve, args=(connection,), daemon=True).start()
+
+    def _serve(self, connection):
+        """! handles the packets of one client."""
+        try:
+            while True:
+                packet = _read_packet(connection)
+                if packet is None:
+                    return
+                packet_type, flags, body = packet
+                if packet_type == 1:  # CONNECT
+                    with self._lock:
+                        self.connections += 1
+                    connection.sendall(_encode_packet(2, 0, b'\x00\x00'))
+                elif packet_type == 3:  # PUBLISH
+                    self._handle_publish(connection, flags, body)
+                elif packet_type == 8:  # SUBSCRIBE
+                    packet_id = body[:2]
+                    position, granted = 2, b''
+                    while position < len(body):
+                        (length,) = struct.unpack('!H', body[position:position + 2])
+                        subscription = body[position + 2:position + 2 + length].decode()
+                        granted += bytes([min(body[position + 2 + length], 1)])
+                        position += 3 + length
+                        with self._lock:
+                            self._subscriptions.append((subscription, connection))
+                    connection.sendall(_encode_packet(9, 0, packet_id + granted))
+                elif packet_type == 12:  # PINGREQ
+                    connection.sendall(_encode_packet(13, 0, b''))
+                elif packet_type == 14:  # DISCONNECT
+                    return
+        except OSError:
+            return
+        finally:
+            with self._lock:
+                self._clients.discard(connection)
+                self._subscriptions = [(subscription, client) for subscription, client in self._subscriptions if client is not connection]
+            connection.close()
+
+    def _handle_publish(self, connection, flags, body):
+        """! records a message, acknowledges it (QoS 1) and forwards it to the subscribers."""
+        qos = (flags >> 1) & 0x03
+        (length,) = struct.unpack('!H', body[:2])
+        topic = body[2:2 + length].decode()
+        position = 2 + length
+        if qos:
+            packet_id = body[position:position + 2]
+            position += 2
+        payload = body[position:]
+        with self._message_event:
+            self.messages.append((topic, payload, qos))
+            subscribers = [client for subscription, client in self._subscriptions if topic_matches(subscription, topic)]
+            self._message_event.notify_all()
+        if qos:
+            connection.sendall(_encode_packet(4, 0, packet_id))
+        forwarded = _encode_packet(3, 0, struct.pack('!H', length) + topic.encode() + payload)
+        for subscriber in subscribers:
+            try:
+                subscriber.sendall(forwarded)
+            except OSError:
+                pass
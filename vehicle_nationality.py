@@ -0,0 +1,172 @@
+"""! @brief module responsible for the nationality cascade: generic model first, Europe model only when needed, results cached by plate."""
+import time
+import threading
+from collections import OrderedDict
+import numpy as np
+import vehicle_models
+from vehicle_config import vehicle_det_config
+
+#! classes of the generic nationality model
+nationality_list = ['europe','america','qatar','tunisia','egypt','UAE','libya']
+#! class id of 'europe' in the generic nationality model
+EUROPE_CLASS = nationality_list.index('europe')
+#! classes of the Europe nationality model
+europe_nationality_list = ['Poland','Italy','France','Spain','Belgium','Germany','Romania','Turkey']
+
+
+def best_class_confidences(results):
+    """! keeps the best confidence of every class detected by a yolo model.
+
+    @param results the results of the yolo model.
+
+    @return dict {class id: confidence}.
+    """
+    best = {}
+    for result in results:
+        boxes = result.boxes.cpu().numpy()
+        for class_id, confidence in zip(np.asarray(boxes.cls).ravel(), np.asarray(boxes.conf).ravel()):
+            class_id = int(class_id)
+            best[class_id] = max(best.get(class_id, 0.0), float(confidence))
+    return best
+
+
+class NationalityCache:
+    """! LRU cache of the nationality of the plates seen recently, with an expiry per entry."""
+
+    def __init__(self, max_size=1024, ttl_s=3600.0, clock=time.monotonic):
+        """! @param max_size number of plates kept, the least recently used one is evicted first.
+        @param ttl_s seconds after which a cached nationality is predicted again (0 keeps it forever).
+        @param clock function returning the current time in seconds.
+        """
+        self.max_size = max_size
+        self.ttl_s = ttl_s
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        # the enrichment workers of the pipeline share the cache
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, plate_key):
+        """! @return the cached nationality of the plate, or None."""
+        with self._lock:
+            entry = self._entries.get(plate_key)
+            if entry is not None and (not self.ttl_s or self.clock() - entry[1] <= self.ttl_s):
+                self._entries.move_to_end(plate_key)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                del self._entries[plate_key]
+            self.misses += 1
+            return None
+
+    def put(self, plate_key, nationality):
+        """! caches the nationality of a plate."""
+        with self._lock:
+            self._entries[plate_key] = (nationality, self.clock())
+            self._entries.move_to_end(plate_key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def hit_rate(self):
+        """! @return the fraction of lookups answered by the cache."""
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+class NationalityCascade:
+    """! predicts the nationality of a plate with as little inference as possible.
+
+    The generic model runs once per plate. A nationality other than 'europe' that beats 'europe' by
+    at least europe_margin is final, and the Europe model is skipped. Otherwise the Europe model
+    runs: after a 'europe' win, however narrow, it picks the country; after a narrow win of
+    another nationality over 'europe', its country is kept only if it is more confident than the
+    generic model. Results are cached by normalized plate, so a returning vehicle costs no
+    inference at all.
+    """
+
+    def __init__(self, europe_margin=None, cache=None, registry=None):
+        """! @param europe_margin confidence by which another nationality must beat 'europe' for the Europe model to be skipped.
+        @param cache the NationalityCache (one configured from main_config.json by default).
+        @param registry the model registry (the shared one by default).
+        """
+        self.europe_margin = europe_margin if europe_margin is not None else vehicle_det_config.get('nationality_europe_margin', 0.15)
+        self.cache = cache if cache is not None else NationalityCache(vehicle_det_config.get('nationality_cache_size', 1024),
+                                                                      vehicle_det_config.get('nationality_cache_ttl_s', 3600.0))
+        self.registry = registry
+        self.generic_runs = 0
+        self.europe_runs = 0
+
+    def _registry(self):
+        return self.registry if self.registry is not None else vehicle_models.registry
+
+    def _run(self, model_key, image):
+        """! runs a nationality model on the plate crop.
+
+        @return dict {class id: best confidence}.
+        """
+        registry = self._registry()
+        model = registry.get(model_key)
+        with registry.inference(model_key):
+            return best_class_confidences(model.predict(image))
+
+    def classify(self, image):
+        """! predicts the nationality of a plate crop, without the cache.
+
+        @param image the license plate crop (BGR array).
+
+        @return the country name OR "america" as a default value.
+        """
+        self.generic_runs += 1
+        confidences = self._run('generic_nationality_model', image)
+        if not confidences:
+            return "america"
+        best = max(confidences, key=confidences.get)
+        nationality = nationality_list[best]
+        if best != EUROPE_CLASS and (EUROPE_CLASS not in confidences
+                                     or confidences[best] - confidences[EUROPE_CLASS] >= self.europe_margin):
+            return nationality
+        # 'europe' won, or another nationality barely beat it: the Europe model decides
+        self.europe_runs += 1
+        europe_confidences = self._run('europe_nationality_model', image)
+        if best != EUROPE_CLASS:
+            if europe_confidences and max(europe_confidences.values()) > confidences[best]:
+                return europe_nationality_list[max(europe_confidences, key=europe_confidences.get)]
+            return nationality
+        if europe_confidences:
+            return europe_nationality_list[max(europe_confidences, key=europe_confidences.get)]
+        return "france"
+
+    def predict(self, image, plate_key=None):
+        """! predicts the nationality of a plate crop, through the cache when the plate was read.
+
+        @param image the license plate crop (BGR array).
+        @param plate_key the normalized plate content, or None if it is unknown.
+
+        @return the country name.
+        """
+        if plate_key:
+            nationality = self.cache.get(plate_key)
+            if nationality is not None:
+                return nationality
+        nationality = self.classify(image)
+        if plate_key:
+            self.cache.put(plate_key, nationality)
+        return nationality
+
+    def stats(self):
+        """! @return the runs of each model and the cache's hits, misses and hit rate."""
+        return {
+            'nationality_generic_runs': self.generic_runs,
+            'nationality_europe_runs': self.europe_runs,
+            'nationality_cache_hits': self.cache.hits,
+            'nationality_cache_misses': self.cache.misses,
+            'nationality_cache_hit_rate': self.cache.hit_rate(),
+        }
+
+
+#! nationality cascade shared by every module
+nationality_cascade = NationalityCascade()
@@ -0,0 +1,150 @@
+"""! @brief module responsible for reading batches of license plate crops with one shared EasyOCR reader."""
+import time
+from collections import deque
+import cv2
+import numpy as np
+import vehicle_models
+from vehicle_config import vehicle_det_config
+
+#! characters a plate may hold, the recognizer never outputs anything else
+PLATE_ALLOWLIST = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+#! rows of padding between two crops stacked for one recognition call
+STACK_GAP = 4
+
+
+def to_gray(crop):
+    """! @return the crop as a 2-D uint8 grayscale array."""
+    if crop.ndim == 3:
+        return cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY)
+    return crop
+
+
+def stack_crops(crops):
+    """! stacks grayscale crops vertically into one image, so they go through one recognize call.
+
+    The call prepares the image once; EasyOCR (1.7) still runs the recognizer on the boxes one at a
+    time on CPU, and only batches them on GPU, so on CPU the stacking saves the call overhead at most.
+
+    @param crops list of 2-D grayscale arrays.
+
+    @return (stacked image, list of [x_min, x_max, y_min, y_max] boxes, one per crop, in EasyOCR's horizontal_list format).
+    """
+    width = max(crop.shape[1] for crop in crops)
+    height = sum(crop.shape[0] for crop in crops) + STACK_GAP * (len(crops) - 1)
+    stacked = np.zeros((height, width), dtype=np.uint8)
+    boxes = []
+    top = 0
+    for crop in crops:
+        stacked[top:top + crop.shape[0], :crop.shape[1]] = crop
+        boxes.append([0, crop.shape[1], top, top + crop.shape[0]])
+        top += crop.shape[0] + STACK_GAP
+    return stacked, boxes
+
+
+class PlateOCR:
+    """! OCR stage of the plates: one EasyOCR reader kept alive, crops read in batches.
+
+    A plate crop is already just the plate, so by default EasyOCR's text detector (CRAFT) is
+    skipped and the whole crop goes straight to the recognizer, restricted to the plate characters.
+    The per-plate latency of the last readings is kept for the stats.
+    """
+
+    def __init__(self, allowlist=None, skip_detection=None, batch_size=None, registry=None, latency_window=1000):
+        """! @param allowlist characters the recognizer may output ('' to allow everything).
+        @param skip_detection go straight to recognition on the whole crop instead of detecting text boxes first.
+        @param batch_size crops recognized per call.
+        @param registry the model registry holding the reader (the shared one by default).
+        @param latency_window number of per-plate latencies kept for the percentiles.
+        """
+        self.allowlist = allowlist if allowlist is not None else vehicle_det_config.get('ocr_allowlist', PLATE_ALLOWLIST)
+        self.skip_detection = skip_detection if skip_detection is not None else vehicle_det_config.get('ocr_skip_detection', True)
+        self.batch_size = batch_size or vehicle_det_config.get('ocr_batch_size', 8)
+        self.registry = registry
+        self.plates = 0
+        self.batches = 0
+        self.latencies = deque(maxlen=latency_window)
+
+    def _registry(self):
+        return self.registry if self.registry is not None else vehicle_models.registry
+
+    def _recognize(self, reader, crops):
+        """! reads a batch of grayscale crops with the recognizer only, in one recognize call (see stack_crops).
+
+        @return list of (text, score), ('', 0.0) for a crop that gave nothing.
+        """
+        stacked, boxes = stack_crops(crops)
+        detections = reader.recognize(stacked, horizontal_list=boxes, free_list=[], allowlist=self.allowlist or None,
+                                      batch_size=len(crops), reformat=False)
+        # each result carries the box it was read from, its top row tells which crop it belongs to
+        index_of_top = {box[2]: index for index, box in enumerate(boxes)}
+        readings = [('', 0.0)] * len(crops)
+        for bbox, text, score in detections:
+            index = index_of_top.get(int(bbox[0][1]))
+            if index is not None:
+                text = ''.join(text.upper().split())
+                readings[index] = (text, float(score) if text else 0.0)
+        return readings
+
+    def _detect_and_recognize(self, reader, crop):
+        """! reads one crop with the text detector first, joining the text boxes from left to right.
+
+        @return (text, score) where score is the OCR scores averaged over the characters.
+        """
+        detections = reader.readtext(crop, allowlist=self.allowlist or None)
+        lp_text = ''
+        weighted_score = 0.0
+        for bbox, text, score in sorted(detections, key=lambda detection: detection[0][0][0]):
+            lp_text += text.upper()
+            weighted_score += score * len(text)
+        return lp_text, weighted_score / len(lp_text) if lp_text else 0.0
+
+    def read_plates(self, crops):
+        """! reads a list of plate crops.
+
+        @param crops list of plate crops (BGR or grayscale arrays).
+
+        @return list of (plate text, score), in the order of the crops; ('', 0.0) for an empty crop.
+        """
+        registry = self._registry()
+        reader = registry.get(vehicle_models.OCR_KEY)
+        readings = [('', 0.0)] * len(crops)
+        # an empty crop (a degenerate box) cannot be read, and would fail the whole batch it is stacked with
+        indices = [index for index, crop in enumerate(crops) if crop.size]
+        for start in range(0, len(indices), self.batch_size):
+            batch_indices = indices[start:start + self.batch_size]
+            batch = [to_gray(crops[index]) for index in batch_indices]
+            started = time.perf_counter()
+            with registry.inference(vehicle_models.OCR_KEY):
+                if self.skip_detection:
+                    batch_readings = self._recognize(reader, batch)
+                else:
+                    batch_readings = [self._detect_and_recognize(reader, crop) for crop in batch]
+            for index, reading in zip(batch_indices, batch_readings):
+                readings[index] = reading
+            per_plate = (time.perf_counter() - started) / len(batch)
+            self.latencies.extend([per_plate] * len(batch))
+            self.plates += len(batch)
+            self.batches += 1
+        return readings
+
+    def read_plate(self, crop):
+        """! reads one plate crop.
+
+        @return (plate text, score).
+        """
+        return self.read_plates([crop])[0]
+
+    def stats(self):
+        """! @return plates and batches read, and the mean, p50 and p95 latency per plate in milliseconds."""
+        latencies = np.array(self.latencies) * 1000
+        return {
+            'ocr_plates': self.plates,
+            'ocr_batches': self.batches,
+            'ocr_ms_per_plate': float(latencies.mean()) if latencies.size else 0.0,
+            'ocr_p50_ms': float(np.percentile(latencies, 50)) if latencies.size else 0.0,
+            'ocr_p95_ms': float(np.percentile(latencies, 95)) if latencies.size else 0.0,
+        }
+
+
+#! OCR stage shared by every module
+plate_ocr = PlateOCR()
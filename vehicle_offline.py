@@ -0,0 +1,218 @@
+"""! @brief module responsible for reprocessing archived videos and images offline, sharded across a process pool."""
+import os
+import csv
+import glob
+import json
+import time
+import multiprocessing
+import cv2
+import vehicle_models
+import vehicle_stream
+from vehicle_config import vehicle_det_config
+
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv', '.mpg', '.mpeg', '.webm')
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+#! files listing one input per line
+MANIFEST_EXTENSIONS = ('.txt', '.lst')
+#! columns of the results, in the order of the json message of vehicle_mqtt
+FIELDS = ['source', 'vehicle', 'class', 'registration', 'brand', 'country', 'color']
+
+
+def is_media(path):
+    """! tells whether a path is a video or an image the pipeline can read."""
+    return path.lower().endswith(VIDEO_EXTENSIONS + IMAGE_EXTENSIONS)
+
+
+def collect_inputs(inputs):
+    """! expands directories, glob patterns and manifests into the list of files to process.
+
+    @param inputs list of directories, files, glob patterns or manifests (.txt/.lst, one input per line).
+
+    @return the media files, sorted within each input, without duplicates.
+    """
+    files = []
+    for item in inputs:
+        if os.path.isdir(item):
+            found = sorted(os.path.join(root, name) for root, _, names in os.walk(item) for name in names)
+        elif os.path.isfile(item) and item.lower().endswith(MANIFEST_EXTENSIONS):
+            with open(item) as f:
+                lines = [line.strip() for line in f if line.strip() and not line.startswith('#')]
+            # the paths of a manifest are relative to the manifest
+            found = collect_inputs([os.path.join(os.path.dirname(item), line) for line in lines])
+        elif os.path.isfile(item):
+            found = [item]
+        else:
+            found = sorted(glob.glob(item, recursive=True))
+        files += [path for path in found if is_media(path)]
+    return list(dict.fromkeys(files))
+
+
+def init_worker(threads, preload=True):
+    """! pool initializer: every worker loads the models once and keeps its share of the cores.
+
+    @param threads number of threads torch and OpenCV may use in this worker.
+    @param preload load every model now rather than on the first file.
+    """
+    import torch
+    torch.set_num_threads(threads)
+    cv2.setNumThreads(threads)
+    if preload:
+        vehicle_models.registry.preload()
+
+
+def process_file(path):
+    """! finds every vehicle of a video or an image.
+
+    @param path the file.
+
+    @return (path, list of ['car'/'truck', 'LP', 'brand', 'nationality', 'color'], error message or None).
+    """
+    vehicles = []
+    try:
+        stream = vehicle_stream.VehicleStream(path, publish=vehicles.append, stats_interval_frames=0)
+        if path.lower().endswith(IMAGE_EXTENSIONS):
+            frame = cv2.imread(path)
+            if frame is None:
+                raise FileNotFoundError(f"The image '{path}' could not be read.")
+            # a single image has no motion to gate on nor frames to track, vote over or select from
+            stream.motion_gate, stream.tracker, stream.voting, stream.quality = None, None, False, None
+            model = vehicle_models.registry.get('general_features_model')
+            with vehicle_models.registry.inference('general_features_model'):
+                results = model.predict(frame)
+            stream.process_frame(frame, results, 1, cv2.createBackgroundSubtractorMOG2())
+        else:
+            stream.run()
+    except Exception as error:
+        return path, vehicles, f"{type(error).__name__}: {error}"
+    return path, vehicles, None
+
+
+class ResultWriter:
+    """! appends the vehicles to a JSONL or CSV file (chosen by the extension) and checkpoints the finished sources.
+
+    The checkpoint lists one finished source per line and is written after the source's rows are on
+    disk, so after a crash the rows of the unfinished sources are dropped and those sources are redone.
+    """
+
+    def __init__(self, output, resume=True):
+        """! @param output path of the .jsonl or .csv results.
+        @param resume keep the results and the checkpoint of a previous run instead of starting over.
+        """
+        self.output = output
+        self.checkpoint = output + '.checkpoint'
+        self.csv = output.lower().endswith('.csv')
+        if not resume:
+            for path in (self.output, self.checkpoint):
+                if os.path.exists(path):
+                    os.remove(path)
+        self.done = self._read_checkpoint()
+        self._drop_unfinished()
+        new_file = not os.path.exists(self.output) or os.path.getsize(self.output) == 0
+        self._file = open(self.output, 'a', newline='')
+        self._writer = csv.DictWriter(self._file, FIELDS) if self.csv else None
+        if self.csv and new_file:
+            self._writer.writeheader()
+        self._checkpoint_file = open(self.checkpoint, 'a')
+
+    def _read_checkpoint(self):
+        if not os.path.exists(self.checkpoint):
+            return set()
+        with open(self.checkpoint) as f:
+            return {line.rstrip('\n') for line in f if line.strip()}
+
+    def _read_rows(self):
+        with open(self.output, newline='') as f:
+            if self.csv:
+                return list(csv.DictReader(f))
+            return [json.loads(line) for line in f if line.strip()]
+
+    def _drop_unfinished(self):
+        """! rewrites the results without the rows of the sources missing from the checkpoint."""
+        if not os.path.exists(self.output) or os.path.getsize(self.output) == 0:
+            return
+        rows = self._read_rows()
+        kept = [row for row in rows if row['source'] in self.done]
+        if len(kept) == len(rows):
+            return
+        temporary = self.output + '.tmp'
+        with open(temporary, 'w', newline='') as f:
+            self._write_rows(f, kept)
+        os.replace(temporary, self.output)
+
+    def _write_rows(self, f, rows):
+        if self.csv:
+            writer = csv.DictWriter(f, FIELDS)
+            writer.writeheader()
+            writer.writerows(rows)
+        else:
+            for row in rows:
+                f.write(json.dumps(row) + '\n')
+
+    def write(self, path, vehicles):
+        """! writes the vehicles of a finished source then records it in the checkpoint.
+
+        Sources that failed are recorded too, so a corrupt file is reported once rather than retried on every resume.
+        """
+        rows = [dict(zip(FIELDS, [path, index] + list(vehicle))) for index, vehicle in enumerate(vehicles)]
+        if self.csv:
+            self._writer.writerows(rows)
+        else:
+            self._file.writelines(json.dumps(row) + '\n' for row in rows)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._checkpoint_file.write(path + '\n')
+        self._checkpoint_file.flush()
+        os.fsync(self._checkpoint_file.fileno())
+        self.done.add(path)
+
+    def close(self):
+        self._file.close()
+        self._checkpoint_file.close()
+
+
+def run_batch(inputs, output, workers=None, resume=True, process=process_file):
+    """! processes every input file across a pool of workers, streaming the vehicles to the output.
+
+    @param inputs directories, files, glob patterns or manifests.
+    @param output path of the .jsonl or .csv results.
+    @param workers number of worker processes (all the cores by default, 1 runs in this process).
+    @param resume skip the sources already in the checkpoint of a previous run.
+    @param process function(path) returning (path, vehicles, error), run by the workers.
+
+    @return the batch statistics.
+    """
+    files = collect_inputs(inputs)
+    writer = ResultWriter(output, resume)
+    pending = [path for path in files if path not in writer.done]
+    workers = workers or vehicle_det_config.get('offline_workers', 0) or os.cpu_count()
+    workers = max(1, min(workers, len(pending)))
+    stats = {'files': len(files), 'skipped': len(files) - len(pending), 'processed': 0, 'failed': 0, 'vehicles': 0}
+    started = time.monotonic()
+    pool = None
+    try:
+        if workers == 1:
+            if process is process_file and pending:
+                vehicle_models.registry.preload()
+            finished = map(process, pending)
+        else:
+            # spawn gives every worker a clean torch/OpenMP state, the models are loaded by the initializer
+            pool = multiprocessing.get_context('spawn').Pool(workers, initializer=init_worker,
+                                                             initargs=(max(1, (os.cpu_count() or 1) // workers), process is process_file))
+            finished = pool.imap_unordered(process, pending)
+        for path, vehicles, error in finished:
+            writer.write(path, vehicles)
+            stats['processed'] += 1
+            stats['vehicles'] += len(vehicles)
+            if error is not None:
+                stats['failed'] += 1
+                print(f"{path}: {error}")
+            else:
+                print(f"{path}: {len(vehicles)} vehicles")
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        writer.close()
+    stats['workers'] = workers
+    stats['files_per_s'] = stats['processed'] / max(time.monotonic() - started, 1e-9)
+    return stats
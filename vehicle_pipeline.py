@@ -0,0 +1,495 @@
+"""! @brief module responsible for the multi-threaded pipeline: capture, detection and enrichment run on separate workers."""
+import os
+import time
+import queue
+import threading
+import multiprocessing
+from collections import deque
+import cv2
+import vehicle_models
+import vehicle_features
+import vehicle_stream
+import vehicle_motion
+import vehicle_frames
+import vehicle_metrics
+import vehicle_tracker
+import vehicle_shm
+import vehicle_quality
+from vehicle_config import vehicle_det_config
+
+#! backpressure policies of a BoundedQueue
+POLICIES = ['block', 'drop_oldest', 'skip_n']
+
+
+class BoundedQueue:
+    """! bounded FIFO between two pipeline stages with a configurable backpressure policy.
+
+    - 'block': the producer waits for a free slot.
+    - 'drop_oldest': the oldest queued item is discarded to make room for the new one.
+    - 'skip_n': when the queue is full the new item and the next skip_n - 1 ones are discarded.
+    """
+
+    def __init__(self, maxsize, policy='block', skip_n=1):
+        """! @param maxsize number of items the queue holds.
+        @param policy one of POLICIES.
+        @param skip_n items discarded in a row by the 'skip_n' policy.
+        """
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown backpressure policy '{policy}', expected one of {POLICIES}.")
+        self.maxsize = maxsize
+        self.policy = policy
+        self.skip_n = max(skip_n, 1)
+        self.dropped = 0
+        self._items = deque()
+        self._skip_remaining = 0
+        self._closed = False
+        self._condition = threading.Condition()
+
+    def put(self, item):
+        """! adds an item according to the backpressure policy.
+
+        @param item the item (never None).
+
+        @return True if the item was queued, False if it was discarded.
+        """
+        with self._condition:
+            if self._closed:
+                return False
+            if self.policy == 'skip_n' and self._skip_remaining > 0:
+                self._skip_remaining -= 1
+                self.dropped += 1
+                return False
+            if len(self._items) >= self.maxsize:
+                if self.policy == 'block':
+                    while len(self._items) >= self.maxsize and not self._closed:
+                        self._condition.wait()
+                    if self._closed:
+                        return False
+                elif self.policy == 'drop_oldest':
+                    self._items.popleft()
+                    self.dropped += 1
+                else:
+                    self._skip_remaining = self.skip_n - 1
+                    self.dropped += 1
+                    return False
+            self._items.append(item)
+            self._condition.notify_all()
+            return True
+
+    def get(self, timeout=None):
+        """! removes the oldest item, waiting for one if the queue is empty.
+
+        @param timeout optional maximum wait in seconds.
+
+        @return the item, or None once the queue is closed and drained (or on timeout).
+        """
+        with self._condition:
+            end = None if timeout is None else time.monotonic() + timeout
+            while not self._items and not self._closed:
+                remaining = None if end is None else end - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self._condition.wait(remaining)
+            if not self._items:
+                return None
+            item = self._items.popleft()
+            self._condition.notify_all()
+            return item
+
+    def close(self):
+        """! stops accepting items; consumers drain what is left then get None."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def qsize(self):
+        """! @return the number of queued items."""
+        with self._condition:
+            return len(self._items)
+
+
+def enrich_shared_frame(ring, task):
+    """! enriches a vehicle whose frame is in a slot of the ring, then releases the slot.
+
+    @param ring the FrameRing.
+    @param task (slot, final_features, (xyxy, cls, conf), frame_number, contours) sent by the detection worker.
+
+    @return ['car'/'truck', 'LP', 'brand', 'nationality', 'color'] or None.
+    """
+    slot, final_features, detections, frame_number, contours = task
+    try:
+        frame, _ = ring.read(slot)
+        results = [vehicle_shm.SharedResult(frame, *detections)]
+        return vehicle_stream.enrich_features(final_features, frame, results, frame_number, contours)
+    finally:
+        ring.release(slot)
+
+
+def enrichment_process(ring, tasks, vehicles, threads, index=0, working=None, enrich=enrich_shared_frame):
+    """! enrichment process: reads the frames from the ring without copying them and sends back the complete vehicles.
+
+    A task that raises is reported and the process moves on to the next one, so one failing model
+    call does not leave the queued tasks holding their slots.
+
+    @param ring the FrameRing the detection worker writes the frames to.
+    @param tasks queue of the tasks of enrich_shared_frame, None to stop.
+    @param vehicles queue of the messages to the parent: ('vehicle', features_list), ('error', description) and ('stopped', index).
+    @param threads number of threads torch and OpenCV may use in this process.
+    @param index the number of this process.
+    @param working shared array where the process writes the slot it is enriching (-1 when idle), so the parent can free it if the process dies.
+    @param enrich function(ring, task) run on every task (a module-level function, it is pickled by name).
+    """
+    import vehicle_offline
+    vehicle_offline.init_worker(threads, preload=False)
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            if working is not None:
+                working[index] = task[0]
+            try:
+                features_list = enrich(ring, task)
+            except Exception as error:
+                vehicles.put(('error', f"{type(error).__name__}: {error}"))
+                features_list = None
+            finally:
+                if working is not None:
+                    working[index] = -1
+            if features_list is not None:
+                vehicles.put(('vehicle', features_list))
+    finally:
+        vehicles.put(('stopped', index))
+        ring.close()
+
+
+class VehiclePipeline:
+    """! runs capture, detection and enrichment (OCR, nationality, color) on separate threads.
+
+    A capture thread feeds a detection worker through a bounded frame queue; frames holding a
+    vehicle are handed through a bounded enrichment queue to a pool of enrichment workers, so a
+    slow plate read never stalls the capture or the detection of the next vehicle.
+
+    With enrichment_processes, the enrichment runs in that many processes instead, out of the GIL.
+    The frames holding a vehicle are written to a shared memory FrameRing and only the slot number,
+    the boxes and the contours are pickled; a full ring drops the frame, unless the enrichment
+    policy is 'block'. A process that dies gets the slot it was enriching freed; once none is left,
+    the capture stops and the frames still queued are dropped rather than blocking the detection.
+
+    With the quality selector, the detection worker only forwards the best scored frames of the
+    vehicle's window; the enrichment workers then enrich each of them.
+    """
+
+    def __init__(self, source, on_vehicle, enrichment_workers=None, frame_queue_size=None, frame_policy=None,
+                 enrichment_queue_size=None, enrichment_policy=None, skip_n=None, enrichment_processes=None):
+        """! @param source the video's path, camera index or RTSP url.
+        @param on_vehicle callable(features_list) called by the enrichment workers for every complete vehicle.
+        @param enrichment_workers number of enrichment threads.
+        @param frame_queue_size size of the queue between capture and detection.
+        @param frame_policy backpressure policy of the frame queue.
+        @param enrichment_queue_size size of the queue between detection and enrichment.
+        @param enrichment_policy backpressure policy of the enrichment queue.
+        @param skip_n items discarded in a row by the 'skip_n' policy.
+        @param enrichment_processes number of enrichment processes fed through the shared memory ring (0 uses the enrichment threads).
+        """
+        self.source = source
+        self.on_vehicle = on_vehicle
+        skip_n = skip_n if skip_n is not None else vehicle_det_config.get('pipeline_skip_n', 5)
+        self.enrichment_workers = enrichment_workers or vehicle_det_config.get('pipeline_enrichment_workers', 2)
+        self.enrichment_processes = enrichment_processes if enrichment_processes is not None else \
+            vehicle_det_config.get('pipeline_enrichment_processes', 0)
+        self.frame_queue = BoundedQueue(frame_queue_size or vehicle_det_config.get('pipeline_frame_queue_size', 8),
+                                        frame_policy or vehicle_det_config.get('pipeline_frame_policy', 'drop_oldest'), skip_n)
+        self.enrichment_queue = BoundedQueue(enrichment_queue_size or vehicle_det_config.get('pipeline_enrichment_queue_size', 4),
+                                             enrichment_policy or vehicle_det_config.get('pipeline_enrichment_policy', 'drop_oldest'), skip_n)
+        self.frames_captured = 0
+        self.frames_detected = 0
+        self.vehicles = 0
+        self._counters_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = []
+        self._started_at = None
+        self.ring = None
+        self._ring_stats = {}
+        self._tasks = None
+        self._vehicles = None
+        self._processes = []
+        self._working = None
+        self._enrichment_failed = threading.Event()
+        #! function run by the enrichment processes on every task
+        self.enrich_task = enrich_shared_frame
+        self.enrichment_errors = 0
+        self.detection_errors = 0
+        self.processes_died = 0
+        self.enrichment_lost = 0
+        self.motion_gate = vehicle_motion.create_motion_gate()
+        self.sampler = vehicle_frames.create_frame_sampler(source)
+        self.quality = vehicle_quality.create_quality_selector()
+        # queue depths and dropped frames on the metrics endpoint
+        vehicle_metrics.register_collector('pipeline', self.stats, source=source)
+
+    def capture(self, cap):
+        """! capture thread: reads frames as fast as the source delivers them, decoding only the ones the sampler keeps."""
+        frame_number = 0
+        try:
+            while not self._stop.is_set():
+                frame, consumed = vehicle_frames.read_frame(cap, self.sampler)
+                frame_number += consumed
+                self.frames_captured += consumed
+                if frame is None:
+                    break
+                self.frame_queue.put((frame_number, frame))
+        finally:
+            cap.release()
+            self.frame_queue.close()
+
+    def detect(self, model, bg_subtractor):
+        """! detection worker: runs the general features model and forwards the frames holding a vehicle.
+
+        A frame whose detection or dispatch raises (e.g. a frame larger than the ring's slots) is
+        counted and skipped. Should the worker end anyway, the capture is stopped and the frame
+        queue closed, so a capture blocked on it with the 'block' policy returns.
+        """
+        try:
+            while True:
+                item = self.frame_queue.get()
+                if item is None:
+                    break
+                try:
+                    self.detect_frame(model, bg_subtractor, *item)
+                except Exception as error:
+                    self.detection_errors += 1
+                    print(f"detection error: {type(error).__name__}: {error}")
+            if self.quality is not None:
+                for _, tasks in self.quality.flush():
+                    for task in tasks:
+                        try:
+                            self.dispatch(task)
+                        except Exception as error:
+                            self.detection_errors += 1
+                            print(f"detection error: {type(error).__name__}: {error}")
+        finally:
+            self._stop.set()
+            self.frame_queue.close()
+            self.enrichment_queue.close()
+            for _ in self._processes:
+                self._tasks.put(None)
+
+    def detect_frame(self, model, bg_subtractor, frame_number, frame):
+        """! runs the general features model on one frame and dispatches the enrichment of the frames it releases."""
+        if self.motion_gate is not None and not self.motion_gate.should_detect(frame):
+            if self.sampler is not None:
+                self.sampler.observe(False)
+            return
+        with vehicle_models.registry.inference('general_features_model'):
+            results = model.predict(frame, **vehicle_frames.predict_options())
+        vehicle_metrics.startup.mark('first_frame')
+        if self.sampler is not None:
+            self.sampler.observe(vehicle_frames.has_detections(results))
+        self.frames_detected += 1
+        final_features = vehicle_features.filter_process_objects(results)
+        released = self.quality.expire(frame_number) if self.quality is not None else []
+        if final_features is not None:
+            # the background subtractor is stateful, so it is applied here in frame order
+            contours = vehicle_stream.foreground_contours(bg_subtractor, frame)
+            task = (final_features, frame, results, frame_number, contours)
+            if self.quality is None:
+                self.dispatch(task)
+            else:
+                score = self.quality.scorer.score(frame, *vehicle_quality.best_plate_box(results))
+                released += self.quality.offer(None, frame_number, score, task)
+        for _, tasks in released:
+            for task in tasks:
+                self.dispatch(task)
+
+    def dispatch(self, task):
+        """! hands (final_features, frame, results, frame_number, contours) to the enrichment threads or processes."""
+        if self.ring is None:
+            self.enrichment_queue.put(task)
+        else:
+            self.share(*task)
+
+    def share(self, final_features, frame, results, frame_number, contours):
+        """! writes a frame to the ring and sends its slot, boxes and contours to the enrichment processes."""
+        slot = None
+        while slot is None and not self._enrichment_failed.is_set():
+            # with the 'block' policy the wait is sliced, so it ends if the last enrichment process dies
+            slot = self.ring.write(frame, frame_number, timeout=0.1 if self.enrichment_queue.policy == 'block' else 0)
+            if self.enrichment_queue.policy != 'block':
+                break
+        if self._enrichment_failed.is_set():
+            if slot is not None:
+                self.ring.release(slot)
+            self.enrichment_lost += 1
+            return
+        if slot is not None:
+            self._tasks.put((slot, final_features, vehicle_tracker.extract_detections(results), frame_number, list(contours)))
+
+    def collect(self):
+        """! collector thread: hands the vehicles found by the enrichment processes to on_vehicle, and watches the processes."""
+        running = set(range(len(self._processes)))
+        while running:
+            try:
+                kind, value = self._vehicles.get(timeout=0.5)
+            except queue.Empty:
+                self._reap(running)
+                continue
+            if kind == 'stopped':
+                running.discard(value)
+            elif kind == 'error':
+                self.enrichment_errors += 1
+                print("enrichment error:", value)
+            else:
+                with self._counters_lock:
+                    self.vehicles += 1
+                try:
+                    self.on_vehicle(value)
+                except Exception as error:
+                    self.enrichment_errors += 1
+                    print(f"enrichment error: {type(error).__name__}: {error}")
+        if self.processes_died:
+            self._fail_enrichment()
+
+    def _reap(self, running):
+        """! frees the slot of every enrichment process that died without stopping (killed, out of memory...)."""
+        for index in list(running):
+            process = self._processes[index]
+            if process.exitcode is None or process.exitcode == 0:
+                continue
+            running.discard(index)
+            self.processes_died += 1
+            print(f"enrichment process {index} died with exit code {process.exitcode}")
+            slot = self._working[index]
+            if slot >= 0:
+                self._working[index] = -1
+                try:
+                    self.ring.release(slot)
+                except ValueError:
+                    # it died right after releasing the slot itself
+                    pass
+
+    def _fail_enrichment(self):
+        """! no enrichment process is left: stops the capture and frees the slots of the frames still queued."""
+        self._enrichment_failed.set()
+        self._stop.set()
+        while True:
+            try:
+                task = self._tasks.get(timeout=0.1)
+            except queue.Empty:
+                return
+            if task is not None:
+                self.ring.release(task[0])
+                self.enrichment_lost += 1
+
+    def enrich(self):
+        """! enrichment worker: reads the plate, predicts the nationality and the color.
+
+        A frame whose enrichment or publication raises is counted and skipped, so the worker keeps
+        consuming the queue (with the 'block' policy, dead workers would stall the detection).
+        """
+        while True:
+            task = self.enrichment_queue.get()
+            if task is None:
+                break
+            try:
+                features_list = vehicle_stream.enrich_features(*task)
+                if features_list is not None:
+                    with self._counters_lock:
+                        self.vehicles += 1
+                    self.on_vehicle(features_list)
+            except Exception as error:
+                with self._counters_lock:
+                    self.enrichment_errors += 1
+                print(f"enrichment error: {type(error).__name__}: {error}")
+
+    def start(self):
+        """! loads the models, opens the source and starts every worker."""
+        model = vehicle_models.registry.get('general_features_model')
+        cap = cv2.VideoCapture(self.source)
+        bg_subtractor = cv2.createBackgroundSubtractorMOG2()
+        self._started_at = time.monotonic()
+        self._threads = [threading.Thread(target=self.capture, args=(cap,), name='capture', daemon=True),
+                         threading.Thread(target=self.detect, args=(model, bg_subtractor), name='detection', daemon=True)]
+        if self.enrichment_processes:
+            self.start_processes(frame_shape=(int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)), int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), 3))
+            self._threads.append(threading.Thread(target=self.collect, name='collector', daemon=True))
+        else:
+            self._threads += [threading.Thread(target=self.enrich, name=f'enrichment-{i}', daemon=True)
+                              for i in range(self.enrichment_workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def start_processes(self, frame_shape):
+        """! creates the frame ring and starts the enrichment processes.
+
+        @param frame_shape shape of the source's frames ('shm_frame_shape' when the source does not tell).
+        """
+        if not all(frame_shape):
+            frame_shape = vehicle_det_config.get('shm_frame_shape', [1080, 1920, 3])
+        context = multiprocessing.get_context('spawn')
+        # every frame in a task or being enriched holds a slot, plus one per process for the next frame
+        slots = vehicle_det_config.get('shm_ring_slots', 0) or self.enrichment_queue.maxsize + 2 * self.enrichment_processes
+        self.ring = vehicle_shm.FrameRing(slots, frame_shape, lock=context.Lock())
+        self._tasks = context.Queue()
+        self._vehicles = context.Queue()
+        threads = max(1, (os.cpu_count() or 1) // self.enrichment_processes)
+        self._working = context.Array('i', [-1] * self.enrichment_processes)
+        self._processes = [context.Process(target=enrichment_process, name=f'enrichment-{i}', daemon=True,
+                                           args=(self.ring, self._tasks, self._vehicles, threads, i, self._working, self.enrich_task))
+                           for i in range(self.enrichment_processes)]
+        for process in self._processes:
+            process.start()
+
+    def join(self):
+        """! waits for every worker to finish (the source ended or stop() was called)."""
+        for thread in self._threads:
+            thread.join()
+        for process in self._processes:
+            process.join()
+        if self.ring is not None:
+            self._ring_stats = self.ring.stats()
+            self.ring.close()
+            self.ring = None
+
+    def run(self):
+        """! runs the pipeline until the source ends.
+
+        @return the pipeline statistics.
+        """
+        self.start()
+        try:
+            self.join()
+        except KeyboardInterrupt:
+            self.stop()
+            self.join()
+        return self.stats()
+
+    def stop(self):
+        """! stops the capture; queued frames and vehicles are still processed."""
+        self._stop.set()
+
+    def stats(self):
+        """! @return frame counts, drops per queue, queue depths and throughput."""
+        elapsed = max(time.monotonic() - self._started_at, 1e-9) if self._started_at else 1e-9
+        ring_stats = self.ring.stats() if self.ring is not None else self._ring_stats
+        stats = {
+            'frames_captured': self.frames_captured,
+            'frames_detected': self.frames_detected,
+            'frames_dropped': self.frame_queue.dropped,
+            'enrichment_dropped': self.enrichment_queue.dropped + ring_stats.get('ring_dropped', 0) + self.enrichment_lost,
+            'detection_errors': self.detection_errors,
+            'enrichment_errors': self.enrichment_errors,
+            'enrichment_processes_died': self.processes_died,
+            'frame_queue_depth': self.frame_queue.qsize(),
+            'enrichment_queue_depth': self.enrichment_queue.qsize(),
+            'vehicles': self.vehicles,
+            'frames_per_s': self.frames_detected / elapsed,
+        }
+        stats.update(ring_stats)
+        if self.motion_gate is not None:
+            stats.update(self.motion_gate.stats())
+        if self.sampler is not None:
+            stats.update(self.sampler.stats())
+        if self.quality is not None:
+            stats.update(self.quality.stats())
+        return stats
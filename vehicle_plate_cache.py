@@ -0,0 +1,139 @@
+"""! @brief module responsible for caching the plate results by a perceptual hash of the plate crop."""
+import time
+import threading
+from collections import OrderedDict
+import cv2
+import numpy as np
+from vehicle_config import vehicle_det_config
+
+
+def dhash(crop, hash_size=16, tolerance=3):
+    """! computes the difference hash of a crop.
+
+    The crop is reduced to a (hash_size, hash_size + 1) grayscale thumbnail and every bit tells
+    whether a pixel is brighter than its right neighbour by more than tolerance. The tolerance keeps
+    the flat background of the plate at 0, so sensor noise and compression barely change the hash.
+
+    @param crop image array (BGR or grayscale).
+    @param hash_size side of the hash in bits.
+    @param tolerance gray levels a pixel must exceed its neighbour by to set its bit.
+
+    @return the hash as an int of hash_size * hash_size bits.
+    """
+    if crop.ndim == 3:
+        crop = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY)
+    thumbnail = cv2.resize(crop, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA).astype(np.int16)
+    bits = np.packbits(thumbnail[:, 1:] - thumbnail[:, :-1] > tolerance)
+    return int.from_bytes(bits.tobytes(), 'big')
+
+
+def hamming(hash_a, hash_b):
+    """! @return the number of bits that differ between two hashes."""
+    return bin(hash_a ^ hash_b).count('1')
+
+
+class PlateCache:
+    """! remembers the (LP, nationality) of the plate crops of the vehicles seen recently.
+
+    Every entry belongs to a scope, the (camera, track id) of its vehicle, and a crop whose hash is
+    within max_distance bits of a cached crop of the same scope is considered the same plate, so
+    the near-identical crops of one passage are read once. The cache is bounded (oldest entry first
+    out) and its entries expire after ttl_s seconds.
+
+    A thumbnail cannot tell apart two plates differing by a single character (two such plates can
+    even share their hash), so no max_distance keeps two vehicles apart: only the scope does. A
+    crop without a scope is neither looked up nor cached; the stream passes none when it enriches a
+    track again for a better crop, which would hash close to the crop read before.
+    """
+
+    def __init__(self, max_size=256, ttl_s=5.0, max_distance=12, hash_size=16, clock=time.monotonic):
+        """! @param max_size number of crops kept.
+        @param ttl_s seconds a result stays valid.
+        @param max_distance largest Hamming distance between two hashes of the same plate.
+        @param hash_size side of the dHash in bits.
+        @param clock function returning the current time in seconds.
+        """
+        self.max_size = max_size
+        self.ttl_s = ttl_s
+        self.max_distance = max_distance
+        self.hash_size = hash_size
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _expire(self, now):
+        """! drops the entries older than ttl_s (the oldest ones are at the front)."""
+        while self._entries:
+            key, (_, stored_at) = next(iter(self._entries.items()))
+            if now - stored_at <= self.ttl_s:
+                return
+            del self._entries[key]
+
+    def lookup(self, crop, scope=None):
+        """! looks a crop up among the cached crops of its vehicle.
+
+        @param crop the license plate crop.
+        @param scope identifies the vehicle the crop belongs to, e.g. (camera, track id).
+
+        @return (key of the crop, cached result or None); the key is None for an empty crop or without a scope.
+        """
+        if crop.size == 0 or scope is None:
+            self.misses += 1
+            return None, None
+        key = (scope, dhash(crop, self.hash_size))
+        with self._lock:
+            self._expire(self.clock())
+            best, best_distance = None, self.max_distance + 1
+            for cached_scope, cached_hash in self._entries:
+                if cached_scope != scope:
+                    continue
+                distance = hamming(key[1], cached_hash)
+                if distance < best_distance:
+                    best, best_distance = (cached_scope, cached_hash), distance
+            if best is None:
+                self.misses += 1
+                return key, None
+            self.hits += 1
+            return key, self._entries[best][0]
+
+    def store(self, key, result):
+        """! caches the result of a crop, evicting the oldest entry if the cache is full.
+
+        @param key the key returned by lookup.
+        @param result the (LP, nationality) read on the crop.
+        """
+        if key is None:
+            return
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (result, self.clock())
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        """! @return hits, misses, hit rate and size of the cache."""
+        lookups = self.hits + self.misses
+        return {
+            'plate_cache_hits': self.hits,
+            'plate_cache_misses': self.misses,
+            'plate_cache_hit_rate': self.hits / lookups if lookups else 0.0,
+            'plate_cache_size': len(self._entries),
+        }
+
+
+def create_plate_cache():
+    """! creates the plate cache configured in main_config.json.
+
+    @return a PlateCache, or None if 'plate_cache_enabled' is false.
+    """
+    if not vehicle_det_config.get('plate_cache_enabled', False):
+        return None
+    return PlateCache(max_size=vehicle_det_config.get('plate_cache_size', 256),
+                      ttl_s=vehicle_det_config.get('plate_cache_ttl_s', 5.0),
+                      max_distance=vehicle_det_config.get('plate_cache_max_distance', 12),
+                      hash_size=vehicle_det_config.get('plate_cache_hash_size', 16))
@@ -0,0 +1,182 @@
+"""! @brief module responsible for scoring the plate of a frame and keeping the best frames of a vehicle for the enrichment."""
+import heapq
+import itertools
+import cv2
+import numpy as np
+import vehicle_tracker
+from vehicle_config import vehicle_det_config
+
+
+def best_plate_box(results):
+    """! finds the most confident plate box of the general features model's results.
+
+    @return (box [x1, y1, x2, y2], confidence), or (None, 0.0) if no plate was detected.
+    """
+    xyxy, cls, conf = vehicle_tracker.extract_detections(results)
+    plates = np.flatnonzero(cls == vehicle_tracker.LP_CLASS)
+    if not plates.size:
+        return None, 0.0
+    best = plates[np.argmax(conf[plates])]
+    return xyxy[best], float(conf[best])
+
+
+class FrameQualityScorer:
+    """! scores how readable the plate of a frame is, from its box and a few cheap statistics of its pixels.
+
+    Each factor is in [0, 1] and the score is their product times the plate confidence, so one bad
+    factor is enough to rank a frame low: the plate's area (up to target_area), its aspect ratio
+    (within aspect_range), its sharpness (variance of the Laplacian, up to sharpness_target) and its
+    brightness (mean gray level within brightness_range). The sharpness is measured on the crop
+    resized to a fixed height, so it does not grow with the size of the plate; the whole score
+    costs a fraction of a millisecond, against tens for the OCR it spares.
+    """
+
+    def __init__(self, min_area=400, target_area=4000, aspect_range=(1.5, 6.0), sharpness_target=300.0,
+                 brightness_range=(40, 220), height=32):
+        """! @param min_area plates smaller than this many pixels score 0.
+        @param target_area area from which a plate is large enough for the OCR.
+        @param aspect_range (lowest, highest) width / height of a plate seen from the front.
+        @param sharpness_target Laplacian variance from which a plate is sharp.
+        @param brightness_range (darkest, brightest) mean gray level of a well exposed plate.
+        @param height height the crop is resized to before measuring its sharpness.
+        """
+        self.min_area = min_area
+        self.target_area = target_area
+        self.aspect_range = aspect_range
+        self.sharpness_target = sharpness_target
+        self.brightness_range = brightness_range
+        self.height = height
+
+    def factors(self, frame, lp_box):
+        """! measures the factors of the score.
+
+        @param frame image array (BGR) the plate was detected on.
+        @param lp_box the plate box [x1, y1, x2, y2].
+
+        @return dict {'area', 'aspect', 'sharpness', 'brightness'} of values in [0, 1].
+        """
+        frame_height, frame_width = frame.shape[:2]
+        x1, y1, x2, y2 = [int(round(float(value))) for value in lp_box[:4]]
+        x1, y1 = max(x1, 0), max(y1, 0)
+        x2, y2 = min(x2, frame_width), min(y2, frame_height)
+        width, height = x2 - x1, y2 - y1
+        if width <= 0 or height <= 0 or width * height < self.min_area:
+            return {'area': 0.0, 'aspect': 0.0, 'sharpness': 0.0, 'brightness': 0.0}
+        low, high = self.aspect_range
+        aspect = width / height
+        gray = frame[y1:y2, x1:x2]
+        if gray.ndim == 3:
+            gray = cv2.cvtColor(gray, cv2.COLOR_BGR2GRAY)
+        gray = cv2.resize(gray, (max(int(round(width * self.height / height)), 1), self.height), interpolation=cv2.INTER_AREA)
+        darkest, brightest = self.brightness_range
+        brightness = float(gray.mean())
+        return {
+            'area': min(width * height / self.target_area, 1.0),
+            'aspect': min(aspect / low, high / aspect, 1.0),
+            'sharpness': min(float(cv2.Laplacian(gray, cv2.CV_64F).var()) / self.sharpness_target, 1.0),
+            'brightness': max(min(brightness / darkest, (255 - brightness) / (255 - brightest), 1.0), 0.0),
+        }
+
+    def score(self, frame, lp_box, lp_conf=1.0):
+        """! @return the quality of the plate of a frame in [0, 1], 0 if there is no plate box."""
+        if lp_box is None:
+            return 0.0
+        return float(np.prod(list(self.factors(frame, lp_box).values()))) * lp_conf
+
+
+class QualitySelector:
+    """! keeps the top_k best scored candidate frames of every vehicle over a sliding window of frames.
+
+    The window of a vehicle opens with its first candidate scoring at least min_score and closes
+    window_frames frames later, or once the vehicle was not offered a candidate for window_frames
+    frames (it left). Only the candidates of a closed window are released to the enrichment, best
+    first, so OCR, nationality and color run on the clearest plates rather than on the first one.
+    The candidates are kept in a heap of top_k items, the others are dropped as soon as they are beaten.
+    """
+
+    def __init__(self, scorer=None, top_k=1, window_frames=5, min_score=0.2):
+        """! @param scorer the FrameQualityScorer (the default one by default).
+        @param top_k candidates released per window.
+        @param window_frames length of a window in frames.
+        @param min_score candidates scoring less are rejected at once.
+        """
+        self.scorer = scorer or FrameQualityScorer()
+        self.top_k = top_k
+        self.window_frames = window_frames
+        self.min_score = min_score
+        self.candidates = 0
+        self.rejected = 0
+        self.selected = 0
+        # vehicle -> [first frame number, last frame number, heap of (score, order, candidate)]
+        self._windows = {}
+        self._order = itertools.count()
+
+    def offer(self, key, frame_number, score, candidate):
+        """! offers a candidate frame of a vehicle.
+
+        @param key identifies the vehicle (e.g. its track id).
+        @param frame_number the number of the frame.
+        @param score the quality of the frame.
+        @param candidate what the enrichment needs of the frame, returned as is once selected.
+
+        @return list of (key, [candidate, ...] best first) of the windows closed by this frame.
+        """
+        released = self.expire(frame_number)
+        self.candidates += 1
+        if score < self.min_score:
+            self.rejected += 1
+            return released
+        window = self._windows.setdefault(key, [frame_number, frame_number, []])
+        window[1] = frame_number
+        heapq.heappush(window[2], (score, next(self._order), candidate))
+        if len(window[2]) > self.top_k:
+            heapq.heappop(window[2])
+        if frame_number - window[0] + 1 >= self.window_frames:
+            released.append(self._release(key))
+        return released
+
+    def expire(self, frame_number):
+        """! closes the windows of the vehicles not offered a candidate for window_frames frames.
+
+        @return list of (key, [candidate, ...] best first) of the windows closed.
+        """
+        gone = [key for key, window in self._windows.items() if frame_number - window[1] >= self.window_frames]
+        return [self._release(key) for key in gone]
+
+    def flush(self):
+        """! closes every window, e.g. at the end of the stream.
+
+        @return list of (key, [candidate, ...] best first) of the windows closed.
+        """
+        return [self._release(key) for key in list(self._windows)]
+
+    def _release(self, key):
+        heap = self._windows.pop(key)[2]
+        self.selected += len(heap)
+        return key, [candidate for _, _, candidate in sorted(heap, reverse=True)]
+
+    def stats(self):
+        """! @return candidate frames offered, rejected for their quality, and selected for the enrichment."""
+        return {
+            'quality_candidates': self.candidates,
+            'quality_rejected': self.rejected,
+            'quality_selected': self.selected,
+        }
+
+
+def create_quality_selector():
+    """! creates the quality selector configured in main_config.json.
+
+    @return a QualitySelector, or None if 'quality_selection_enabled' is false.
+    """
+    if not vehicle_det_config.get('quality_selection_enabled', False):
+        return None
+    scorer = FrameQualityScorer(min_area=vehicle_det_config.get('quality_min_plate_area', 400),
+                                target_area=vehicle_det_config.get('quality_target_plate_area', 4000),
+                                aspect_range=tuple(vehicle_det_config.get('quality_plate_aspect_range', [1.5, 6.0])),
+                                sharpness_target=vehicle_det_config.get('quality_sharpness_target', 300.0),
+                                brightness_range=tuple(vehicle_det_config.get('quality_brightness_range', [40, 220])))
+    return QualitySelector(scorer,
+                           top_k=vehicle_det_config.get('quality_top_k', 1),
+                           window_frames=vehicle_det_config.get('quality_window_frames', 5),
+                           min_score=vehicle_det_config.get('quality_min_score', 0.2))
@@ -0,0 +1,309 @@
+"""! @brief module responsible for the INT8 variants of the models: quantization, calibration and the latency/memory/accuracy report."""
+import os
+import json
+import time
+import cv2
+import numpy as np
+import psutil
+import vehicle_models
+import vehicle_backends
+import vehicle_color
+import vehicle_frames
+import vehicle_offline
+from vehicle_config import vehicle_det_config
+
+#! backend of the quantized variants in 'model_backends'
+INT8_BACKEND = 'onnx_int8'
+#! quantization modes: weights only, or weights and activations calibrated on sample images
+MODES = ['dynamic', 'static']
+#! prefix of the plate crops written to 'debug_crops_dir' by vehicle_license
+PLATE_CROP_PREFIX = 'LP_cropped'
+
+
+def read_video_frames(path, count):
+    """! reads count frames spread evenly over a video."""
+    cap = cv2.VideoCapture(path)
+    step = max(1, int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) // max(count, 1))
+    frames = []
+    index = 0
+    while len(frames) < count:
+        ret = cap.grab()
+        if not ret:
+            break
+        if index % step == 0:
+            ret, frame = cap.retrieve()
+            if ret:
+                frames.append(frame)
+        index += 1
+    cap.release()
+    return frames
+
+
+def sample_images(key, limit=None):
+    """! reads the images a model is calibrated and timed on.
+
+    The general features model sees the frames of 'quantization_calibration_dir' (images or videos).
+    The other models see crops: the plate crops (LP_cropped*) of 'quantization_crops_dir' for the
+    nationality models and the other crops for the color model. 'quantization_crops_dir' defaults to
+    'debug_crops_dir', where the pipeline writes both, and to the frames when neither is set.
+
+    @param key one of vehicle_models.MODEL_KEYS.
+    @param limit maximum number of images ('quantization_calibration_images' by default).
+
+    @return list of BGR images.
+    """
+    limit = limit or vehicle_det_config.get('quantization_calibration_images', 100)
+    directory = vehicle_det_config.get('quantization_calibration_dir', '')
+    crops_dir = vehicle_det_config.get('quantization_crops_dir', '') or vehicle_det_config.get('debug_crops_dir', '')
+    plates = None
+    if key != 'general_features_model' and crops_dir:
+        directory, plates = crops_dir, key != 'color_model'
+    if not directory or not os.path.isdir(directory):
+        raise FileNotFoundError(f"No calibration images for '{key}', set 'quantization_calibration_dir' in 'main_config.json'.")
+    images = []
+    for path in vehicle_offline.collect_inputs([directory]):
+        if plates is not None and os.path.basename(path).startswith(PLATE_CROP_PREFIX) != plates:
+            continue
+        if path.lower().endswith(vehicle_offline.IMAGE_EXTENSIONS):
+            image = cv2.imread(path)
+            if image is not None:
+                images.append(image)
+        else:
+            images += read_video_frames(path, limit - len(images))
+        if len(images) >= limit:
+            break
+    return images[:limit]
+
+
+def yolo_input_size(key):
+    """! @return the side of the square input the YOLO model is exported and calibrated at."""
+    return (key == 'general_features_model' and vehicle_det_config.get('inference_size', 0)) or 640
+
+
+def model_input(key, image):
+    """! prepares an image like the model's own preprocessing does.
+
+    @return float32 array of shape (1, 3, height, width).
+    """
+    if key == 'color_model':
+        return vehicle_color.preprocess_color_image(image)[None].numpy()
+    from ultralytics.data.augment import LetterBox
+    size = yolo_input_size(key)
+    letterboxed = LetterBox((size, size), auto=False)(image=image)
+    return np.ascontiguousarray(letterboxed[..., ::-1].transpose(2, 0, 1))[None].astype(np.float32) / 255
+
+
+class CalibrationReader:
+    """! feeds the calibration images to ONNX Runtime's static quantization (duck-types CalibrationDataReader)."""
+
+    def __init__(self, input_name, inputs):
+        """! @param input_name name of the model's input.
+        @param inputs list of preprocessed arrays.
+        """
+        self.input_name = input_name
+        self.inputs = inputs
+        self._next = 0
+
+    def get_next(self):
+        if self._next >= len(self.inputs):
+            return None
+        self._next += 1
+        return {self.input_name: self.inputs[self._next - 1]}
+
+    def rewind(self):
+        self._next = 0
+
+
+def head_nodes(key, path, graph):
+    """! lists the nodes of the YOLO detection head, which stays in float.
+
+    The head concatenates box coordinates in pixels with class scores in [0, 1]: one INT8 scale for
+    both loses either the boxes or the scores.
+
+    @return the names of the nodes of the last ultralytics module (empty for the color model).
+    """
+    if key == 'color_model':
+        return []
+    prefix = f"/model.{len(vehicle_models.load_yolo(path).model.model) - 1}/"
+    return [node.name for node in graph.node if node.name.startswith(prefix)]
+
+
+def quantize_model(key, path, mode=None, images=None):
+    """! writes the INT8 variant of a model next to its weights ('<stem>.int8.onnx').
+
+    The model is exported to ONNX first if needed, then quantized by ONNX Runtime: 'dynamic' stores
+    the weights of the fully connected layers in INT8 and quantizes their activations on the fly,
+    'static' quantizes every layer with activation scales calibrated on sample images, which is what
+    speeds up the convolutions.
+
+    @param key one of vehicle_models.MODEL_KEYS.
+    @param path path to the original weights.
+    @param mode 'dynamic' or 'static' ('quantization_mode' by default).
+    @param images optional calibration images (read by sample_images by default).
+
+    @return the path of the quantized model.
+    """
+    import onnx
+    from onnxruntime import quantization
+    mode = mode or vehicle_det_config.get('quantization_mode', 'static')
+    if mode not in MODES:
+        raise ValueError(f"Unknown quantization mode '{mode}', expected one of {MODES}.")
+    onnx_path = vehicle_backends.exported_path(path, 'onnx')
+    if not os.path.exists(onnx_path):
+        vehicle_backends.export_model(key, path, 'onnx')
+    target = vehicle_backends.exported_path(path, INT8_BACKEND)
+    prepared = target + '.prepared.onnx'
+    # onnx shape inference and graph optimization; the symbolic shapes of the dynamic axes are not needed on CPU
+    quantization.quant_pre_process(onnx_path, prepared, skip_symbolic_shape=True)
+    try:
+        graph = onnx.load(prepared).graph
+        excluded = head_nodes(key, path, graph)
+        if mode == 'dynamic':
+            # ConvInteger is slower than the float convolution on CPU, only the fully connected layers gain
+            quantization.quantize_dynamic(prepared, target, op_types_to_quantize=['MatMul', 'Gemm'], per_channel=True,
+                                          weight_type=quantization.QuantType.QInt8, nodes_to_exclude=excluded)
+        else:
+            images = images if images is not None else sample_images(key)
+            reader = CalibrationReader(graph.input[0].name, [model_input(key, image) for image in images])
+            quantization.quantize_static(prepared, target, reader, quant_format=quantization.QuantFormat.QDQ,
+                                         per_channel=True, activation_type=quantization.QuantType.QUInt8,
+                                         weight_type=quantization.QuantType.QInt8, nodes_to_exclude=excluded)
+    finally:
+        os.remove(prepared)
+    # ultralytics reads the class names, stride and input size from the metadata of the export
+    source, quantized = onnx.load(onnx_path), onnx.load(target)
+    if source.metadata_props and not quantized.metadata_props:
+        quantized.metadata_props.extend(source.metadata_props)
+        onnx.save(quantized, target)
+    return target
+
+
+def file_size_mb(path):
+    """! @return the size of a model file or directory in MB."""
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names) / 2**20
+    return os.path.getsize(path) / 2**20
+
+
+def inference_function(key, model):
+    """! @return function(image) running one inference of the model the way its stage does."""
+    if key == 'color_model':
+        import torch
+
+        def classify(image):
+            with torch.no_grad():
+                return model(vehicle_color.preprocess_color_image(image)[None])
+        return classify
+    options = vehicle_frames.predict_options() if key == 'general_features_model' else {}
+    return lambda image: model.predict(image, verbose=False, **options)
+
+
+def color_accuracy(model, directory):
+    """! top-1 accuracy of a color model on a folder holding one subfolder of images per color."""
+    import torch
+    correct = total = 0
+    names = [color.lower() for color in vehicle_color.colors]
+    for label in sorted(os.listdir(directory)):
+        if label.lower() not in names:
+            continue
+        for path in vehicle_offline.collect_inputs([os.path.join(directory, label)]):
+            image = cv2.imread(path)
+            if image is None:
+                continue
+            with torch.no_grad():
+                logits = model(vehicle_color.preprocess_color_image(image)[None])
+            correct += int(torch.argmax(logits, dim=1)[0]) == names.index(label.lower())
+            total += 1
+    return correct / total if total else None
+
+
+def accuracy(key, model, validation):
+    """! measures a model on its labeled validation set.
+
+    @param validation folder of color subfolders for the color model, ultralytics dataset yaml for the YOLO models.
+
+    @return (metric name, value), value None without a validation set.
+    """
+    if key == 'color_model':
+        return 'top1', color_accuracy(model, validation) if validation else None
+    if not validation:
+        return 'map50', None
+    metrics = model.val(data=validation, imgsz=yolo_input_size(key), batch=1, plots=False, verbose=False)
+    return 'map50', float(metrics.box.map50)
+
+
+def measure(key, path, backend, images, validation=None, runs=50):
+    """! loads one variant of a model and measures it.
+
+    @param key one of vehicle_models.MODEL_KEYS.
+    @param path path to the original weights.
+    @param backend 'torch' or one of vehicle_backends.BACKENDS.
+    @param images images to time the inference on.
+    @param validation labeled validation set (see accuracy), or None.
+    @param runs number of timed inferences.
+
+    @return dict with the file size, load time (up to the first inference), resident memory growth, latency p50/p95 and accuracy.
+    """
+    process = psutil.Process()
+    rss = process.memory_info().rss
+    start = time.perf_counter()
+    model = vehicle_models.load_model(key, path, backend)
+    infer = inference_function(key, model)
+    # ultralytics loads the exports on the first call, which also allocates the buffers
+    infer(images[0])
+    load_s = time.perf_counter() - start
+    durations = []
+    for index in range(runs):
+        start = time.perf_counter()
+        infer(images[index % len(images)])
+        durations.append((time.perf_counter() - start) * 1000)
+    metric, value = accuracy(key, model, validation)
+    return {
+        'backend': backend,
+        'size_mb': file_size_mb(vehicle_backends.exported_path(path, backend)),
+        'load_s': load_s,
+        'rss_growth_mb': (process.memory_info().rss - rss) / 2**20,
+        'latency_p50_ms': float(np.percentile(durations, 50)),
+        'latency_p95_ms': float(np.percentile(durations, 95)),
+        metric: value,
+    }
+
+
+def compare(baseline, candidate):
+    """! @return the speedup, size ratio, memory and accuracy differences of candidate over baseline."""
+    delta = {
+        'speedup': baseline['latency_p50_ms'] / candidate['latency_p50_ms'],
+        'size_ratio': candidate['size_mb'] / baseline['size_mb'],
+        'rss_growth_mb': candidate['rss_growth_mb'] - baseline['rss_growth_mb'],
+    }
+    for metric in ('top1', 'map50'):
+        if baseline.get(metric) is not None and candidate.get(metric) is not None:
+            delta[metric] = candidate[metric] - baseline[metric]
+    return delta
+
+
+def quantization_report(keys=None, mode=None, output=None, runs=50):
+    """! quantizes the models and compares the INT8 variants with the torch models.
+
+    The labeled validation sets are listed by model key in 'quantization_validation'.
+
+    @param keys optional list of config keys (every one of vehicle_models.MODEL_KEYS by default).
+    @param mode 'dynamic' or 'static' ('quantization_mode' by default).
+    @param output optional path the report is written to as JSON.
+    @param runs number of timed inferences per variant.
+
+    @return dict {key: {'torch': measures, 'onnx_int8': measures, 'delta': compare}}.
+    """
+    validation = vehicle_det_config.get('quantization_validation', {})
+    report = {}
+    for key in keys or vehicle_models.MODEL_KEYS:
+        path = vehicle_det_config[key]
+        images = sample_images(key)
+        quantize_model(key, path, mode, images)
+        report[key] = {backend: measure(key, path, backend, images, validation.get(key), runs)
+                       for backend in ('torch', INT8_BACKEND)}
+        report[key]['delta'] = compare(report[key]['torch'], report[key][INT8_BACKEND])
+    if output:
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=4)
+    return report
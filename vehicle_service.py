@@ -0,0 +1,254 @@
+"""! @brief module responsible for the on-demand recognition service: snapshots submitted over a local HTTP endpoint."""
+import json
+import asyncio
+import threading
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+import vehicle_models
+import vehicle_features
+import vehicle_stream
+import vehicle_batching
+import vehicle_frames
+import vehicle_mqtt
+import vehicle_metrics
+from vehicle_config import vehicle_det_config
+
+#! reason phrases of the status codes the service answers with
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 413: 'Payload Too Large',
+           422: 'Unprocessable Entity', 500: 'Internal Server Error', 503: 'Service Unavailable'}
+
+
+def decode_image(data):
+    """! decodes an encoded image (JPEG, PNG, BMP...).
+
+    @return the BGR image array, None if the bytes are not an image.
+    """
+    if not data:
+        return None
+    return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+
+def recognize_snapshot(frame, results, frame_number):
+    """! identifies the vehicle of one snapshot from the results of the general features model.
+
+    A snapshot has no background to subtract, so the color model only sees the vehicle's box.
+
+    @return ['car'/'truck', 'LP', 'brand', 'nationality', 'color'] or None if no complete vehicle was found.
+    """
+    final_features = vehicle_features.filter_process_objects(results)
+    if final_features is None:
+        return None
+    return vehicle_stream.enrich_features(final_features, frame, results, frame_number, [])
+
+
+def http_response(status, body, keep_alive=True, headers=None):
+    """! @return the bytes of an HTTP/1.1 response with a JSON body."""
+    body = body.encode() if isinstance(body, str) else body
+    lines = [f'HTTP/1.1 {status} {REASONS.get(status, "")}', 'Content-Type: application/json',
+             f'Content-Length: {len(body)}', 'Connection: ' + ('keep-alive' if keep_alive else 'close')]
+    lines += [f'{name}: {value}' for name, value in (headers or {}).items()]
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body
+
+
+def error_body(message):
+    return json.dumps({'error': message})
+
+
+class RecognitionService:
+    """! answers single snapshots with the features of their vehicle, with the models kept warm.
+
+    POST /recognize takes the encoded image as the request body and answers the json message of
+    vehicle_mqtt.build_features_message, or 422 when the snapshot holds no complete vehicle. GET
+    /health answers the statistics. The event loop only parses and answers the requests: decoding and
+    enrichment run on a bounded thread pool, and the general features model sees the snapshots of the
+    concurrent requests in one batch through a BatchInferenceServer. Requests beyond queue_size in
+    flight are answered 503 at once rather than queued without bound.
+    """
+
+    def __init__(self, host=None, port=None, workers=None, queue_size=None, max_batch_size=None, max_wait_s=None,
+                 model=None, max_body_mb=None):
+        """! @param host interface to listen on.
+        @param port port to listen on (0 picks a free one, see self.port once started).
+        @param workers threads decoding the images and enriching the vehicles.
+        @param queue_size maximum number of requests in flight.
+        @param max_batch_size maximum number of snapshots per predict call.
+        @param max_wait_s maximum time a snapshot waits for the batch to fill.
+        @param model the general features model (loaded from the registry by default).
+        @param max_body_mb largest image accepted, in MB.
+        """
+        self.host = host or vehicle_det_config.get('service_host', '127.0.0.1')
+        self.port = port if port is not None else vehicle_det_config.get('service_port', 8080)
+        self.queue_size = queue_size or vehicle_det_config.get('service_queue_size', 64)
+        self.max_body_bytes = int((max_body_mb or vehicle_det_config.get('service_max_body_mb', 10)) * 2**20)
+        self.executor = ThreadPoolExecutor(max_workers=workers or vehicle_det_config.get('service_workers', 4),
+                                           thread_name_prefix='recognition')
+        model = model if model is not None else vehicle_models.registry.get('general_features_model')
+        self.batcher = vehicle_batching.BatchInferenceServer(model, max_batch_size, max_wait_s)
+        self.requests = 0
+        self.vehicles = 0
+        self.rejected = 0
+        self.errors = 0
+        self.in_flight = 0
+        self._frame_numbers = itertools.count(1)
+        self._server = None
+        self._loop = None
+        self._thread = None
+        vehicle_metrics.register_collector('service', self.stats)
+
+    async def recognize(self, data):
+        """! recognizes the vehicle of an encoded snapshot.
+
+        @return (status code, json body).
+        """
+        if self.in_flight >= self.queue_size:
+            self.rejected += 1
+            return 503, error_body("too many requests in flight")
+        self.in_flight += 1
+        self.requests += 1
+        loop = asyncio.get_running_loop()
+        try:
+            with vehicle_metrics.stage('service_request'):
+                frame = await loop.run_in_executor(self.executor, decode_image, data)
+                if frame is None:
+                    return 400, error_body("the request body is not an image")
+                results = [await asyncio.wrap_future(self.batcher.submit(frame))]
+                vehicle_metrics.startup.mark('first_frame')
+                features_list = await loop.run_in_executor(self.executor, recognize_snapshot, frame, results,
+                                                           next(self._frame_numbers))
+            if features_list is None:
+                return 422, error_body("no complete vehicle found")
+            self.vehicles += 1
+            return 200, vehicle_mqtt.build_features_message(features_list)
+        except Exception as error:
+            self.errors += 1
+            return 500, error_body(f"{type(error).__name__}: {error}")
+        finally:
+            self.in_flight -= 1
+
+    async def route(self, method, path, body):
+        """! @return (status code, json body) of one request."""
+        path = path.split('?')[0]
+        if path == '/recognize':
+            if method != 'POST':
+                return 405, error_body("use POST with the image as the body")
+            return await self.recognize(body)
+        if path == '/health':
+            return 200, json.dumps(self.stats())
+        return 404, error_body(f"unknown path '{path}'")
+
+    async def handle_connection(self, reader, writer):
+        """! serves the requests of one keep-alive connection."""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, path, version = request_line.decode('latin-1').split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if not line.strip():
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+                length = int(headers.get('content-length', 0))
+                if length > self.max_body_bytes:
+                    # the body is not read, so the connection cannot be reused
+                    writer.write(http_response(413, error_body(f"images are limited to {self.max_body_bytes} bytes"), False))
+                    await writer.drain()
+                    break
+                body = await reader.readexactly(length) if length else b''
+                status, payload = await self.route(method, path, body)
+                extra = {'Retry-After': 1} if status == 503 else None
+                writer.write(http_response(status, payload, keep_alive, extra))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except ValueError:
+            writer.write(http_response(400, error_body("malformed request"), False))
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            # the client went away mid-request, or the service is stopping
+            pass
+        finally:
+            writer.close()
+
+    def warm_up(self):
+        """! loads every model and runs each one once, so the first request pays neither.
+
+        The general features model of the batches also runs once with their predict options, which
+        its first batch would otherwise pay for; none of these runs counts as an inference.
+        """
+        vehicle_models.start_models(warm_up=True)
+        with vehicle_models.registry.lock(self.batcher.model_key):
+            self.batcher.model.predict([np.zeros((640, 640, 3), dtype=np.uint8)], **vehicle_frames.predict_options())
+
+    def start(self, warm_up=True):
+        """! starts the batch inference server and the event loop serving the endpoint in a background thread.
+
+        @param warm_up load and run the models before accepting requests.
+
+        @return the service, listening on self.port.
+        """
+        self.batcher.start()
+        if warm_up:
+            self.warm_up()
+        ready = threading.Event()
+
+        def serve():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            self._server = self._loop.run_until_complete(asyncio.start_server(self.handle_connection, self.host, self.port))
+            self.port = self._server.sockets[0].getsockname()[1]
+            ready.set()
+            try:
+                self._loop.run_forever()
+            finally:
+                self._server.close()
+                # the connections still open are dropped
+                tasks = asyncio.all_tasks(self._loop)
+                for task in tasks:
+                    task.cancel()
+                self._loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+                self._loop.close()
+
+        self._thread = threading.Thread(target=serve, name='recognition-service', daemon=True)
+        self._thread.start()
+        ready.wait()
+        return self
+
+    def run(self):
+        """! serves until interrupted.
+
+        @return the statistics of the service.
+        """
+        self.start()
+        print(f"recognition service listening on http://{self.host}:{self.port}/recognize")
+        try:
+            self._thread.join()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+        return self.stats()
+
+    def stop(self):
+        """! stops the endpoint, then the batch inference server and the workers."""
+        if self._loop is not None and self._loop.is_running():
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+        self.batcher.stop()
+        self.executor.shutdown()
+
+    def stats(self):
+        """! @return number of requests, vehicles found, requests rejected and failed, requests in flight and the batching statistics."""
+        return {
+            'requests': self.requests,
+            'vehicles': self.vehicles,
+            'rejected': self.rejected,
+            'errors': self.errors,
+            'in_flight': self.in_flight,
+            'mean_batch_size': self.batcher.stats()['mean_batch_size'],
+        }
@@ -0,0 +1,184 @@
+"""! @brief module responsible for the shared-memory ring of frame slots passed between the pipeline's processes."""
+import time
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
+
+#! metadata of a slot, stored in front of the frames in the shared block
+SLOT_DTYPE = np.dtype([('refcount', np.int32), ('camera_id', np.int32), ('frame_number', np.int64),
+                       ('timestamp', np.float64), ('shape', np.int32, 3)])
+#! alignment of the frame slots in bytes
+ALIGNMENT = 64
+
+
+def _aligned(size):
+    return -(-size // ALIGNMENT) * ALIGNMENT
+
+
+class FrameRing:
+    """! fixed number of frame slots in one shared memory block, passed between processes without pickling the frames.
+
+    A producer writes a frame in a free slot (or decodes into it) and hands the slot number to the
+    consumers, which get a zero-copy read-only numpy view of the frame and its metadata (frame number,
+    camera id, timestamp). Each slot is reference counted: the write holds one reference, retain()
+    adds one per extra consumer, and the slot is free again once every holder called release().
+    The ring is created by the producer's process and attached to when it is pickled to a child
+    process; the creator unlinks it.
+    """
+
+    def __init__(self, slots, frame_shape, lock=None, name=None):
+        """! @param slots number of frames the ring holds.
+        @param frame_shape largest (height, width, channels) of a frame.
+        @param lock multiprocessing lock guarding the reference counts (a new one by default).
+        @param name name of an existing block to attach to (a new block is created by default).
+        """
+        self.slots = slots
+        self.frame_shape = tuple(frame_shape)
+        self.slot_bytes = _aligned(int(np.prod(self.frame_shape)))
+        self.lock = lock if lock is not None else multiprocessing.get_context('spawn').Lock()
+        self.dropped = 0
+        self._cursor = 0
+        self._owner = name is None
+        if self._owner:
+            size = _aligned(slots * SLOT_DTYPE.itemsize) + slots * self.slot_bytes
+            self._shm = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            self._shm = shared_memory.SharedMemory(name=name)
+        self._map()
+        if self._owner:
+            self.meta[:] = 0
+
+    def _map(self):
+        self.meta = np.ndarray((self.slots,), dtype=SLOT_DTYPE, buffer=self._shm.buf)
+        self._frames = np.ndarray((self.slots, self.slot_bytes), dtype=np.uint8, buffer=self._shm.buf,
+                                  offset=_aligned(self.slots * SLOT_DTYPE.itemsize))
+
+    def __getstate__(self):
+        return {'slots': self.slots, 'frame_shape': self.frame_shape, 'lock': self.lock, 'name': self._shm.name}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def _acquire(self, timeout):
+        """! takes the next free slot with one reference, waiting up to timeout seconds (None waits forever).
+
+        @return the slot, None if every slot stayed in use.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self.lock:
+                for step in range(self.slots):
+                    slot = (self._cursor + step) % self.slots
+                    if self.meta['refcount'][slot] == 0:
+                        self.meta['refcount'][slot] = 1
+                        self._cursor = slot + 1
+                        return slot
+            if deadline is not None and time.monotonic() >= deadline:
+                return None
+            # the consumers are other processes, polling keeps the release a plain decrement
+            time.sleep(0.001)
+
+    def _view(self, slot, shape):
+        return self._frames[slot, :int(np.prod(shape))].reshape(shape)
+
+    def reserve(self, shape, timeout=0):
+        """! takes a free slot for a producer that decodes the frame in place (e.g. cap.read(view)).
+
+        @param shape (height, width, channels) of the frame, at most frame_shape.
+        @param timeout seconds to wait for a free slot (0 returns at once, None waits forever).
+
+        @return (slot, writable view), or (None, None) if no slot was free.
+        """
+        if int(np.prod(shape)) > self.slot_bytes:
+            raise ValueError(f"A frame of shape {tuple(shape)} does not fit the slots of shape {self.frame_shape}.")
+        slot = self._acquire(timeout)
+        if slot is None:
+            self.dropped += 1
+            return None, None
+        self.meta['shape'][slot] = shape
+        return slot, self._view(slot, tuple(shape))
+
+    def commit(self, slot, frame_number, camera_id=0, timestamp=None):
+        """! records the metadata of the frame written in a reserved slot."""
+        self.meta['frame_number'][slot] = frame_number
+        self.meta['camera_id'][slot] = camera_id
+        self.meta['timestamp'][slot] = timestamp if timestamp is not None else time.time()
+
+    def write(self, frame, frame_number, camera_id=0, timestamp=None, timeout=0):
+        """! copies a frame in a free slot.
+
+        @param frame uint8 image array.
+        @param frame_number the number of the frame.
+        @param camera_id the camera the frame comes from.
+        @param timestamp capture time in seconds (now by default).
+        @param timeout seconds to wait for a free slot (0 returns at once, None waits forever).
+
+        @return the slot holding one reference for the caller, None if no slot was free (the frame is dropped).
+        """
+        slot, view = self.reserve(frame.shape, timeout)
+        if slot is None:
+            return None
+        np.copyto(view, frame)
+        self.commit(slot, frame_number, camera_id, timestamp)
+        return slot
+
+    def read(self, slot):
+        """! @return (read-only view of the frame of a slot, {'frame_number', 'camera_id', 'timestamp'})."""
+        meta = self.meta[slot]
+        frame = self._view(slot, tuple(int(side) for side in meta['shape']))
+        frame.flags.writeable = False
+        return frame, {'frame_number': int(meta['frame_number']), 'camera_id': int(meta['camera_id']),
+                       'timestamp': float(meta['timestamp'])}
+
+    def retain(self, slot, count=1):
+        """! adds references to a slot, one per extra consumer it is handed to."""
+        with self.lock:
+            self.meta['refcount'][slot] += count
+
+    def release(self, slot):
+        """! drops one reference; the slot is free once its last reference is released."""
+        with self.lock:
+            if self.meta['refcount'][slot] <= 0:
+                raise ValueError(f"Slot {slot} of the frame ring was released more times than it was held.")
+            self.meta['refcount'][slot] -= 1
+
+    def stats(self):
+        """! @return number of slots, slots in use and frames dropped because every slot was in use."""
+        return {'ring_slots': self.slots, 'ring_slots_in_use': int(np.count_nonzero(self.meta['refcount'])),
+                'ring_dropped': self.dropped}
+
+    def close(self):
+        """! detaches from the block (the views read from the ring must not be used afterwards); the creator also frees it."""
+        self.meta = self._frames = None
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+
+
+class SharedBoxes:
+    """! boxes of a frame as numpy arrays, with the part of the ultralytics Boxes interface the enrichment reads."""
+
+    def __init__(self, xyxy, cls, conf):
+        self.xyxy = xyxy
+        self.cls = cls
+        self.conf = conf
+
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return self
+
+    def __len__(self):
+        return len(self.cls)
+
+
+class SharedResult:
+    """! picklable stand-in of an ultralytics Results: its boxes, and its frame read from a ring slot."""
+
+    def __init__(self, orig_img, xyxy, cls, conf):
+        """! @param orig_img the frame the boxes were detected on.
+        @param xyxy, cls, conf the boxes, as returned by vehicle_tracker.extract_detections.
+        """
+        self.orig_img = orig_img
+        self.boxes = SharedBoxes(xyxy, cls, conf)
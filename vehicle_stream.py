@@ -0,0 +1,504 @@
+"""! @brief module responsible for the continuous streaming mode: one event per vehicle passage on an unbounded stream."""
+import os
+import time
+import uuid
+import threading
+import cv2
+import vehicle_color
+import vehicle_license
+import vehicle_initialize_detection
+import vehicle_features
+import vehicle_mqtt
+import vehicle_ocr
+import vehicle_nationality
+import vehicle_motion
+import vehicle_frames
+import vehicle_tracker
+import vehicle_voting
+import vehicle_quality
+import vehicle_metrics
+import vehicle_event_store
+from vehicle_config import vehicle_det_config
+
+area_threshold = 200
+
+
+def foreground_contours(bg_subtractor, frame):
+    """! applies the background subtraction to a frame and returns the contours of the foreground.
+
+    @param bg_subtractor the background subtractor of the stream.
+    @param frame image array of the frame.
+
+    @return the contours of the foreground mask.
+    """
+    fg_mask = bg_subtractor.apply(frame)
+    fg_mask = cv2.threshold(fg_mask, 120, 255, cv2.THRESH_BINARY)[1]
+    contours, _ = cv2.findContours(fg_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    return contours
+
+
+def enrich_features(final_features, frame, results, frame_number, contours):
+    """! completes the features found by the general features model with the plate, nationality and color.
+
+    @param final_features ['car'/'truck', 'LP', 'brand'] as returned by filter_process_objects.
+    @param frame image array of the frame.
+    @param results the results of the general features model on the frame.
+    @param frame_number the number of the frame.
+    @param contours the foreground contours of the frame.
+
+    @return ['car'/'truck', 'LP', 'brand', 'nationality', 'color'] or None if the plate or color could not be identified.
+    """
+    try:
+        plate = vehicle_license.recognize_license_plate(results, frame_number)
+    except Exception:
+        # the plate was too small or blurred in this frame, the next ones will do better
+        return None
+    if plate is None:
+        return None
+    # the color model sees the vehicle's box, the foreground contours are only a fallback
+    vehicle_box = vehicle_features.select_vehicle_box(results)
+    color = vehicle_color.identify_vehicle_color(frame, contours, area_threshold, frame_number, vehicle_box=vehicle_box)
+    if color is None:
+        return None
+    final_features = list(final_features)
+    final_features[1] = plate[0]
+    final_features.append(plate[1])
+    final_features.append(color)
+    return final_features
+
+
+def identify_features(frame, results, frame_number, bg_subtractor):
+    """! identifies the 5 features of the vehicle in one frame.
+
+    @param frame image array of the frame.
+    @param results the results of the general features model on the frame.
+    @param frame_number the number of the frame.
+    @param bg_subtractor the background subtractor of the stream.
+
+    @return ['car'/'truck', 'LP', 'brand', 'nationality', 'color'] or None if the frame does not hold a complete vehicle.
+    """
+    final_features = vehicle_features.filter_process_objects(results)
+    if final_features is None:
+        return None
+    contours = foreground_contours(bg_subtractor, frame)
+    return enrich_features(final_features, frame, results, frame_number, contours)
+
+
+class PassageDeduplicator:
+    """! remembers the plates seen recently so that a vehicle is published once per passage.
+
+    A plate is considered the same passage as long as it keeps being seen with gaps shorter than dedup_seconds.
+    """
+
+    def __init__(self, dedup_seconds, clock=time.monotonic):
+        """! @param dedup_seconds gap after which the same plate counts as a new passage.
+        @param clock function returning the current time in seconds.
+        """
+        self.dedup_seconds = dedup_seconds
+        self.clock = clock
+        self.last_seen = {}
+
+    def is_new_passage(self, plate):
+        """! records a sighting of a plate.
+
+        @param plate the plate content.
+
+        @return True if this sighting starts a new passage.
+        """
+        now = self.clock()
+        key = vehicle_license.normalize_plate(plate)
+        # forget the plates whose passage is over, so memory stays bounded on an unbounded stream
+        expired = [seen_plate for seen_plate, seen_at in self.last_seen.items() if now - seen_at > self.dedup_seconds]
+        for seen_plate in expired:
+            del self.last_seen[seen_plate]
+        is_new = key not in self.last_seen
+        self.last_seen[key] = now
+        return is_new
+
+
+class StreamStats:
+    """! throughput counters of a stream."""
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.started_at = clock()
+        self.frames = 0
+        self.vehicles = 0
+        self.duplicates = 0
+        self.enrichments = 0
+        self.corrections = 0
+
+    def as_dict(self):
+        """! @return frames, vehicles, duplicates, enrichments, frames/s and vehicles/hour since the stream started."""
+        elapsed = max(self.clock() - self.started_at, 1e-9)
+        return {
+            'frames': self.frames,
+            'vehicles': self.vehicles,
+            'duplicates': self.duplicates,
+            'enrichments': self.enrichments,
+            'corrections': self.corrections,
+            'frames_per_s': self.frames / elapsed,
+            'vehicles_per_hour': self.vehicles * 3600 / elapsed,
+        }
+
+
+class VehicleStream:
+    """! processes a camera/RTSP/file stream continuously and emits one event per vehicle passage.
+
+    The models and the MQTT client are created once and reused for every vehicle.
+    """
+
+    def __init__(self, source, publish=None, dedup_seconds=None, reconnect_attempts=None, stats_interval_frames=None,
+                 publisher=None):
+        """! @param source the video's path, camera index or RTSP url.
+        @param publish callable(features_list) called once per passage; defaults to publishing over a persistent MQTT client.
+        @param publisher started MQTTPublisher shared with other streams (not stopped by close()), instead of one of its own.
+        @param dedup_seconds gap after which the same plate counts as a new passage.
+        @param reconnect_attempts how many times a live source is reopened after a read failure.
+        @param stats_interval_frames print the throughput every this many frames (0 disables it).
+        """
+        self.source = source
+        self.publish = publish
+        self.dedup = PassageDeduplicator(dedup_seconds if dedup_seconds is not None else vehicle_det_config.get('stream_dedup_seconds', 30))
+        self.reconnect_attempts = reconnect_attempts if reconnect_attempts is not None else vehicle_det_config.get('stream_reconnect_attempts', 5)
+        self.stats_interval_frames = stats_interval_frames if stats_interval_frames is not None else vehicle_det_config.get('stream_stats_interval_frames', 500)
+        self.stats = StreamStats()
+        self.motion_gate = vehicle_motion.create_motion_gate()
+        self.sampler = vehicle_frames.create_frame_sampler(source)
+        self.tracker = None
+        if vehicle_det_config.get('tracker_enabled', False):
+            self.tracker = vehicle_tracker.VehicleTracker(iou_threshold=vehicle_det_config.get('tracker_iou_threshold', 0.3),
+                                                          max_missed=vehicle_det_config.get('tracker_max_missed', 15))
+        self.reenrich_improvement = vehicle_det_config.get('tracker_reenrich_improvement', 1.5)
+        self.voting = vehicle_det_config.get('voting_enabled', False)
+        # only the best scored frames of a vehicle are enriched (None when 'quality_selection_enabled' is false)
+        self.quality = vehicle_quality.create_quality_selector()
+        # passages of every stream of the process, kept across restarts (None when 'event_store_enabled' is false)
+        self.event_store = vehicle_event_store.shared_event_store()
+        self.repeat_seconds = vehicle_det_config.get('event_store_repeat_seconds', 300)
+        self.publisher = publisher
+        self._owns_publisher = publisher is None
+        self.running = False
+        # handle_features is called from several enrichment workers in the threaded pipeline
+        self._lock = threading.Lock()
+        # throughput, gated and grabbed frames, OCR latency and cache hits on the metrics endpoint
+        vehicle_metrics.register_collector('stream', self.stats_dict, source=source)
+
+    def _publish(self, features_list, uid):
+        """! publishes one passage through the persistent MQTT publisher, which buffers it during an outage.
+
+        @param uid identifier of the passage, sent in the message and recorded in the event store.
+        """
+        if self.publish is not None:
+            self.publish(features_list)
+            return
+        if self.publisher is None:
+            self.publisher = vehicle_mqtt.MQTTPublisher(source=self.source).start()
+        self.publisher.publish_features(features_list, uid)
+
+    def handle_features(self, features_list, uid=None):
+        """! publishes the features if they belong to a new passage.
+
+        With the event store, a plate that already passed in front of this camera within
+        'event_store_repeat_seconds' (e.g. a car backing up to the barrier, or a restart of the
+        stream) is a duplicate too. Every published passage is recorded under the uid of its
+        message, and every duplicate refreshes the plate's last sighting, so a car lingering longer
+        than the window is not published again.
+
+        @param features_list the 5 features of a vehicle.
+        @param uid identifier given to the passage (a new uuid4 by default).
+
+        @return True if an event was emitted.
+        """
+        with self._lock:
+            if not self.dedup.is_new_passage(features_list[1]) or (
+                    self.event_store is not None
+                    and self.event_store.seen_within(features_list[1], self.repeat_seconds, camera=self.source)):
+                self.stats.duplicates += 1
+                if self.event_store is not None:
+                    self.event_store.refresh(features_list[1], camera=self.source)
+                return False
+            uid = uid or str(uuid.uuid4())
+            self._publish(features_list, uid)
+            if self.event_store is not None:
+                self.event_store.record(features_list, camera=self.source, uid=uid)
+            self.stats.vehicles += 1
+            return True
+
+    def process_frame(self, frame, results, frame_number, bg_subtractor):
+        """! identifies the vehicles of a frame and publishes the new passages.
+
+        Without the tracker the frame is handled on its own; with it, OCR, nationality and color
+        run once per track, and again only when a clearly better plate crop appears. With voting,
+        they run on every frame of a track until its accumulated features converge, or until
+        voting_max_frames frames did not give every feature a vote, then stop.
+        The color model runs once per frame on the boxes of all the tracks that need it.
+        With the quality selector, the frames are offered to it instead and only the best frames of
+        every vehicle's window are enriched; with voting, it only skips the unreadable plates.
+
+        @param frame image array of the frame.
+        @param results the results of the general features model on the frame.
+        @param frame_number the number of the frame.
+        @param bg_subtractor the background subtractor of the stream.
+        """
+        vehicle_metrics.startup.mark('first_frame')
+        self.stats.frames += 1
+        if self.tracker is None and self.quality is not None:
+            self.select_frame(frame, results, frame_number, bg_subtractor)
+            return
+        if self.tracker is None:
+            features_list = identify_features(frame, results, frame_number, bg_subtractor)
+            if features_list is not None:
+                self.stats.enrichments += 1
+                self.handle_features(features_list)
+            return
+        tracks = self.tracker.update(*vehicle_tracker.extract_detections(results))
+        if self.voting:
+            selected = [track for track in tracks if not track.published and track.is_complete()
+                        and not (track.accumulator is not None and track.accumulator.abandoned)]
+            if self.quality is not None:
+                # every frame counts in the vote, only the plates the OCR cannot read are left out
+                selected = [track for track in selected
+                            if self.quality.scorer.score(frame, track.lp_box, track.lp_conf) >= self.quality.min_score]
+        else:
+            selected = [track for track in tracks if track.is_complete() and track.needs_enrichment(self.reenrich_improvement)]
+            if self.quality is not None:
+                self.select_tracks(selected, frame, frame_number)
+                return
+        if not selected:
+            return
+        self.stats.enrichments += len(selected)
+        if self.voting:
+            # the plates and the colors of all the vehicles of the frame are read in one batch each
+            LP_crops = [vehicle_features.crop_box(frame, track.lp_box) for track in selected]
+            readings = vehicle_license.read_license_plates_with_score(LP_crops)
+            color_probabilities = vehicle_color.identify_vehicle_colors(frame, [track.box for track in selected], area_threshold,
+                                                                        frame_number, probabilities=True)
+            for track, LP_crop, reading, probabilities in zip(selected, LP_crops, readings, color_probabilities):
+                self.vote_track(track, LP_crop, reading, probabilities)
+            return
+        for track, features_list in self.enrich_tracks(selected, frame, frame_number):
+            self.publish_track(track, features_list)
+
+    def publish_track(self, track, features_list, quality=None):
+        """! records the enrichment of a track, publishes its features the first time and corrects them after.
+
+        A re-enrichment on a better plate crop that changes the features is published as a
+        correction of the passage of the track (see publish_correction).
+        """
+        previous = track.features
+        track.mark_enriched(features_list, quality)
+        if not track.published:
+            track.published = True
+            uid = str(uuid.uuid4())
+            if self.handle_features(features_list, uid):
+                track.passage_uid = uid
+        elif track.passage_uid is not None and features_list != previous:
+            self.publish_correction(track.passage_uid, features_list)
+
+    def publish_correction(self, uid, features_list):
+        """! publishes the corrected features of a passage already published.
+
+        The message carries the uid of the passage, so the receiver updates it rather than counting
+        a new vehicle; the corrected passage is recorded in the event store under the same uid, and
+        its plate counts as seen by the dedup, so it is not published again as a new passage.
+
+        @param uid identifier of the published passage.
+        @param features_list the corrected 5 features of the vehicle.
+        """
+        with self._lock:
+            self.dedup.is_new_passage(features_list[1])
+            self._publish(features_list, uid)
+            if self.event_store is not None:
+                self.event_store.record(features_list, camera=self.source, uid=uid)
+            self.stats.corrections += 1
+
+    def select_frame(self, frame, results, frame_number, bg_subtractor):
+        """! offers a frame holding a complete vehicle to the quality selector, then enriches the frames it selects.
+
+        Without the tracker the camera is assumed to see one vehicle at a time, so all the frames
+        are candidates of the same vehicle.
+        """
+        released = self.quality.expire(frame_number)
+        final_features = vehicle_features.filter_process_objects(results)
+        if final_features is not None:
+            contours = foreground_contours(bg_subtractor, frame)
+            score = self.quality.scorer.score(frame, *vehicle_quality.best_plate_box(results))
+            released += self.quality.offer(None, frame_number, score, (final_features, frame, results, frame_number, contours))
+        self.enrich_selected(released)
+
+    def enrich_selected(self, released):
+        """! enriches the selected frames of every closed window, best first, until one identifies the vehicle.
+
+        @param released list of (key, [(final_features, frame, results, frame_number, contours), ...]).
+        """
+        for _, candidates in released:
+            for candidate in candidates:
+                self.stats.enrichments += 1
+                features_list = enrich_features(*candidate)
+                if features_list is not None:
+                    self.handle_features(features_list)
+                    break
+
+    def select_tracks(self, tracks, frame, frame_number):
+        """! offers the current frame of every track needing an enrichment to the quality selector, then enriches the frames it selects."""
+        released = self.quality.expire(frame_number)
+        for track in tracks:
+            score = self.quality.scorer.score(frame, track.lp_box, track.lp_conf)
+            candidate = (track, frame, frame_number, track.lp_box, track.box, track.plate_quality())
+            released += self.quality.offer(track.track_id, frame_number, score, candidate)
+        self.enrich_selected_tracks(released)
+
+    def enrich_selected_tracks(self, released):
+        """! enriches the selected frames of the tracks, best first, until each track is identified.
+
+        Every round takes the best remaining frame of each track; the tracks whose frames are the
+        same are enriched in one batch.
+
+        @param released list of (track id, [(track, frame, frame_number, plate box, vehicle box, plate quality), ...]).
+        """
+        pending = [list(candidates) for _, candidates in released if candidates]
+        while pending:
+            frames = {}
+            for candidates in pending:
+                track, frame, frame_number, lp_box, box, quality = candidates.pop(0)
+                frames.setdefault(frame_number, (frame, []))[1].append((track, (lp_box, box), quality))
+            identified = set()
+            for frame_number, (frame, selected) in frames.items():
+                self.stats.enrichments += len(selected)
+                qualities = {id(track): quality for track, _, quality in selected}
+                enriched = self.enrich_tracks([track for track, _, _ in selected], frame, frame_number,
+                                              [boxes for _, boxes, _ in selected])
+                for track, features_list in enriched:
+                    self.publish_track(track, features_list, qualities[id(track)])
+                    identified.add(id(track))
+            pending = [candidates for candidates in pending if candidates and id(candidates[0][0]) not in identified]
+
+    def flush_selected(self):
+        """! enriches the best frames of the windows still open, e.g. at the end of the stream."""
+        released = self.quality.flush()
+        if self.tracker is None:
+            self.enrich_selected(released)
+        else:
+            self.enrich_selected_tracks(released)
+
+    def enrich_tracks(self, tracks, frame, frame_number, boxes=None):
+        """! reads the plates of the tracks in one batch, predicts their nationality and, in one batch, the vehicles' colors.
+
+        @param boxes (plate box, vehicle box) of every track on this frame (their current boxes by default).
+
+        @return list of (track, ['car'/'truck', 'LP', 'brand', 'nationality', 'color']) for the tracks whose plate and color were identified.
+        """
+        boxes = boxes or [(track.lp_box, track.box) for track in tracks]
+        # the plates of all the tracks are read in one OCR batch
+        LP_crops = [vehicle_features.crop_box(frame, lp_box) for lp_box, _ in boxes]
+        # a track enriched before is only enriched again for a better crop, which the plate cache would answer with the old reading
+        scopes = [(self.source, track.track_id) if track.enriched_quality is None else None for track in tracks]
+        recognized = vehicle_license.recognize_plate_crops(LP_crops, frame_number, scopes=scopes)
+        read = [(track, plate, box) for track, plate, (_, box) in zip(tracks, recognized, boxes) if plate is not None]
+        # the color model only runs for the vehicles whose plate could be read
+        colors = vehicle_color.identify_vehicle_colors(frame, [box for _, _, box in read], area_threshold, frame_number)
+        enriched = []
+        for (track, (plate, nationality), _), color in zip(read, colors):
+            if color is None:
+                continue
+            final_features = track.detected_features()
+            final_features[1] = plate
+            enriched.append((track, final_features + [nationality, color]))
+        return enriched
+
+    def vote_track(self, track, LP_crop, reading, color_probabilities):
+        """! adds the current frame of a track to its accumulator and publishes the result once it converged.
+
+        @param LP_crop the track's plate crop in the current frame.
+        @param reading (plate text, OCR score) of the crop.
+        @param color_probabilities the softmax of the color model on the track's box, or None.
+        """
+        if track.accumulator is None:
+            track.accumulator = vehicle_voting.VehicleAccumulator()
+        accumulator = track.accumulator
+        plate, plate_score = reading
+        nationality = None
+        # short readings only lower the plate vote, the nationality model is kept for readable plates
+        if len(plate) >= accumulator.min_plate_length:
+            nationality = vehicle_license.predict_generic_nationality(LP_crop, plate)
+        accumulator.add_frame(*track.frame_type, *track.frame_brand, plate, plate_score, nationality, color_probabilities)
+        if accumulator.converged():
+            if accumulator.abandoned:
+                # nothing reliable to publish, and process_frame stops querying the models for this track
+                return
+            features_list = accumulator.result()
+            accumulator.emitted = True
+            track.mark_enriched(features_list)
+            track.published = True
+            self.handle_features(features_list)
+
+    def _is_live(self):
+        """! tells whether the source is a live camera/stream rather than a file that simply ends."""
+        return not (isinstance(self.source, str) and os.path.isfile(self.source))
+
+    def run(self, max_frames=None):
+        """! runs until the stream ends, stop() is called or max_frames frames were processed.
+
+        @param max_frames optional limit on the number of frames.
+
+        @return the throughput statistics.
+        """
+        model, cap, bg_subtractor = vehicle_initialize_detection.initialize_components(self.source)
+        frame_number = 0
+        failures = 0
+        self.running = True
+        try:
+            while self.running and (max_frames is None or self.stats.frames < max_frames):
+                try:
+                    frame, results, frame_number = vehicle_initialize_detection.object_detection_loop(model, cap, frame_number, self.motion_gate, self.sampler)
+                except Exception:
+                    if not self._is_live() or failures >= self.reconnect_attempts:
+                        break
+                    # a live stream dropped: reopen it and keep the loaded models
+                    failures += 1
+                    cap.release()
+                    time.sleep(vehicle_det_config.get('stream_reconnect_delay_s', 2))
+                    cap = cv2.VideoCapture(self.source)
+                    continue
+                failures = 0
+                self.process_frame(frame, results, frame_number, bg_subtractor)
+                if self.stats_interval_frames and self.stats.frames % self.stats_interval_frames == 0:
+                    print("stream stats:", self.stats_dict())
+            if self.quality is not None:
+                self.flush_selected()
+        finally:
+            self.running = False
+            cap.release()
+            self.close()
+        return self.stats_dict()
+
+    def stats_dict(self):
+        """! @return the throughput statistics, with the motion gate's skipped frames, the frames grabbed without decoding, the OCR latency per plate and the hit rates of the plate and nationality caches."""
+        stats = self.stats.as_dict()
+        if self.motion_gate is not None:
+            stats.update(self.motion_gate.stats())
+        if self.sampler is not None:
+            stats.update(self.sampler.stats())
+        stats.update(vehicle_ocr.plate_ocr.stats())
+        stats.update(vehicle_nationality.nationality_cascade.stats())
+        if vehicle_license.plate_cache is not None:
+            stats.update(vehicle_license.plate_cache.stats())
+        if self.quality is not None:
+            stats.update(self.quality.stats())
+        if self.event_store is not None:
+            stats.update(self.event_store.stats())
+        if self.publisher is not None:
+            stats.update({'mqtt_' + key: value for key, value in self.publisher.stats().items()})
+        return stats
+
+    def stop(self):
+        """! asks the stream to stop after the current frame."""
+        self.running = False
+
+    def close(self):
+        """! flushes and closes the MQTT publisher, if one was started; unsent passages stay in the spool."""
+        vehicle_metrics.unregister_collector('stream', source=self.source)
+        if self.publisher is not None and self._owns_publisher:
+            self.publisher.stop()
+            self.publisher = None
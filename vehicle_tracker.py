@@ -0,0 +1,259 @@
+"""! @brief module responsible for tracking vehicles across frames, so each vehicle is enriched once."""
+import numpy as np
+import vehicle_features
+
+#! class ids of the general features model
+VEHICLE_CLASSES = (0, 1)
+LP_CLASS = 2
+
+
+def extract_detections(results):
+    """! collects the boxes of the general features model's results.
+
+    @param results the results of the yolo general features model.
+
+    @return (xyxy, cls, conf) numpy arrays of shape (N, 4), (N,), (N,).
+    """
+    xyxy, cls, conf = [np.zeros((0, 4), dtype=np.float32)], [np.zeros(0)], [np.zeros(0)]
+    for result in results:
+        boxes = result.boxes.cpu().numpy()
+        xyxy.append(np.asarray(boxes.xyxy, dtype=np.float32).reshape(-1, 4))
+        cls.append(np.asarray(boxes.cls))
+        conf.append(np.asarray(boxes.conf))
+    return np.concatenate(xyxy), np.concatenate(cls).astype(int), np.concatenate(conf).astype(float)
+
+
+def iou_matrix(boxes_a, boxes_b):
+    """! computes the intersection over union of every pair of boxes.
+
+    @param boxes_a (N, 4) array of xyxy boxes.
+    @param boxes_b (M, 4) array of xyxy boxes.
+
+    @return (N, M) array of IoUs.
+    """
+    boxes_a = boxes_a[:, None, :]
+    boxes_b = boxes_b[None, :, :]
+    width = np.clip(np.minimum(boxes_a[..., 2], boxes_b[..., 2]) - np.maximum(boxes_a[..., 0], boxes_b[..., 0]), 0, None)
+    height = np.clip(np.minimum(boxes_a[..., 3], boxes_b[..., 3]) - np.maximum(boxes_a[..., 1], boxes_b[..., 1]), 0, None)
+    intersection = width * height
+    area_a = (boxes_a[..., 2] - boxes_a[..., 0]) * (boxes_a[..., 3] - boxes_a[..., 1])
+    area_b = (boxes_b[..., 2] - boxes_b[..., 0]) * (boxes_b[..., 3] - boxes_b[..., 1])
+    return intersection / np.maximum(area_a + area_b - intersection, 1e-9)
+
+
+def containment_matrix(children, parents):
+    """! computes which fraction of every child box lies inside every parent box.
+
+    @param children (N, 4) array of xyxy boxes (plates, brand logos).
+    @param parents (M, 4) array of xyxy boxes (vehicles).
+
+    @return (N, M) array of intersection / child area.
+    """
+    children_b = children[:, None, :]
+    parents_b = parents[None, :, :]
+    width = np.clip(np.minimum(children_b[..., 2], parents_b[..., 2]) - np.maximum(children_b[..., 0], parents_b[..., 0]), 0, None)
+    height = np.clip(np.minimum(children_b[..., 3], parents_b[..., 3]) - np.maximum(children_b[..., 1], parents_b[..., 1]), 0, None)
+    child_area = (children_b[..., 2] - children_b[..., 0]) * (children_b[..., 3] - children_b[..., 1])
+    return width * height / np.maximum(child_area, 1e-9)
+
+
+def greedy_match(scores, threshold):
+    """! matches rows to columns by decreasing score, each row and column at most once.
+
+    @param scores (N, M) array of association scores (higher is better).
+    @param threshold minimum score of a match.
+
+    @return list of (row, column) pairs.
+    """
+    matches = []
+    if scores.size == 0:
+        return matches
+    used_rows, used_columns = set(), set()
+    order = np.argsort(-scores, axis=None)
+    for row, column in zip(*np.unravel_index(order, scores.shape)):
+        if scores[row, column] < threshold:
+            break
+        if row in used_rows or column in used_columns:
+            continue
+        used_rows.add(row)
+        used_columns.add(column)
+        matches.append((int(row), int(column)))
+    return matches
+
+
+class Track:
+    """! one vehicle followed across frames, with its plate and brand boxes and its enrichment state."""
+
+    def __init__(self, track_id, box, class_id, conf):
+        self.track_id = track_id
+        self.box = box
+        self.hits = 1
+        self.missed = 0
+        #! summed confidence per vehicle class and per brand, the best one wins
+        self.type_scores = {class_id: conf}
+        self.brand_scores = {}
+        #! (class id, confidence) of the vehicle and of its brand in the current frame
+        self.frame_type = (class_id, conf)
+        self.frame_brand = (None, 0.0)
+        self.lp_box = None
+        self.lp_conf = 0.0
+        #! best confidence of a brand box over the whole track
+        self.brand_conf = 0.0
+        self.enriched_quality = None
+        self.enrichments = 0
+        self.features = None
+        self.published = False
+        #! uid of the passage published for the track, reused by its corrections
+        self.passage_uid = None
+        self.accumulator = None
+
+    def update(self, box, class_id, conf):
+        """! moves the track to its new box."""
+        self.box = box
+        self.hits += 1
+        self.missed = 0
+        self.type_scores[class_id] = self.type_scores.get(class_id, 0.0) + conf
+        self.frame_type = (class_id, conf)
+        self.frame_brand = (None, 0.0)
+        self.lp_box = None
+        self.lp_conf = 0.0
+
+    def attach(self, box, class_id, conf):
+        """! attaches a plate or brand box detected inside the vehicle in the current frame."""
+        if class_id == LP_CLASS:
+            if conf > self.lp_conf:
+                self.lp_box, self.lp_conf = box, conf
+        else:
+            self.brand_scores[class_id] = self.brand_scores.get(class_id, 0.0) + conf
+            self.brand_conf = max(self.brand_conf, conf)
+            if conf > self.frame_brand[1]:
+                self.frame_brand = (class_id, conf)
+
+    def vehicle_class(self):
+        """! @return the most likely vehicle class id (car/truck)."""
+        return max(self.type_scores, key=self.type_scores.get)
+
+    def brand_class(self):
+        """! @return the most likely brand class id, or None if no brand was seen."""
+        if not self.brand_scores:
+            return None
+        return max(self.brand_scores, key=self.brand_scores.get)
+
+    def plate_quality(self):
+        """! @return a score of the current plate crop: its area weighted by the plate confidence."""
+        if self.lp_box is None:
+            return 0.0
+        x1, y1, x2, y2 = self.lp_box
+        return float((x2 - x1) * (y2 - y1) * self.lp_conf)
+
+    def is_complete(self, lp_threshold=0.5, brand_threshold=0.45):
+        """! tells whether the current frame shows the plate clearly enough and the brand was recognized on the track."""
+        return self.lp_conf > lp_threshold and self.brand_conf > brand_threshold
+
+    def needs_enrichment(self, improvement=1.5):
+        """! tells whether OCR, nationality and color should run for this track on the current frame.
+
+        @param improvement factor by which the plate quality must beat the enriched one to run again.
+
+        @return True for a track never enriched, or when a clearly better plate crop appears.
+        """
+        if self.enriched_quality is None:
+            return True
+        return self.plate_quality() > self.enriched_quality * improvement
+
+    def mark_enriched(self, features, quality=None):
+        """! records the result of an enrichment.
+
+        @param features the 5 features identified.
+        @param quality plate quality of the enriched frame (the current frame's by default).
+        """
+        self.enriched_quality = self.plate_quality() if quality is None else quality
+        self.enrichments += 1
+        self.features = features
+
+    def detected_features(self):
+        """! @return ['car'/'truck', 'LP', 'brand'] in the same form as filter_process_objects."""
+        return [vehicle_features.class_names[self.vehicle_class()], 'LP', vehicle_features.class_names[self.brand_class()]]
+
+
+class VehicleTracker:
+    """! SORT-style tracker running on the CPU over the general features model's boxes.
+
+    Vehicle boxes are associated to the tracks by IoU and, for the ones left, by centroid
+    distance; plate and brand boxes are then attached to the vehicle that contains them.
+    """
+
+    def __init__(self, iou_threshold=0.3, max_centroid_distance=0.5, max_missed=15):
+        """! @param iou_threshold minimum IoU to associate a box to a track.
+        @param max_centroid_distance maximum centroid distance, relative to the track's diagonal, for the fallback association.
+        @param max_missed frames a track survives without being detected.
+        """
+        self.iou_threshold = iou_threshold
+        self.max_centroid_distance = max_centroid_distance
+        self.max_missed = max_missed
+        self.tracks = []
+        self.next_id = 1
+
+    def _centroid_scores(self, track_boxes, boxes):
+        """! returns 1 - (centroid distance / track diagonal) for every track/box pair."""
+        track_centers = (track_boxes[:, None, :2] + track_boxes[:, None, 2:]) / 2
+        centers = (boxes[None, :, :2] + boxes[None, :, 2:]) / 2
+        diagonals = np.hypot(track_boxes[:, 2] - track_boxes[:, 0], track_boxes[:, 3] - track_boxes[:, 1])[:, None]
+        return 1 - np.linalg.norm(track_centers - centers, axis=2) / np.maximum(diagonals, 1e-9)
+
+    def update(self, xyxy, cls, conf, min_conf=0.3):
+        """! feeds the detections of a frame.
+
+        @param xyxy (N, 4) array of boxes.
+        @param cls (N,) array of class ids.
+        @param conf (N,) array of confidences.
+        @param min_conf detections below this confidence are ignored.
+
+        @return the tracks detected in this frame.
+        """
+        keep = conf > min_conf
+        xyxy, cls, conf = xyxy[keep], cls[keep], conf[keep]
+        is_vehicle = np.isin(cls, VEHICLE_CLASSES)
+        vehicle_boxes = xyxy[is_vehicle]
+        vehicle_cls, vehicle_conf = cls[is_vehicle], conf[is_vehicle]
+
+        track_boxes = np.array([track.box for track in self.tracks], dtype=np.float32).reshape(-1, 4)
+        matches = greedy_match(iou_matrix(track_boxes, vehicle_boxes), self.iou_threshold)
+        matched_tracks = {row for row, _ in matches}
+        matched_boxes = {column for _, column in matches}
+        left_tracks = [row for row in range(len(self.tracks)) if row not in matched_tracks]
+        left_boxes = [column for column in range(len(vehicle_boxes)) if column not in matched_boxes]
+        if left_tracks and left_boxes:
+            scores = self._centroid_scores(track_boxes[left_tracks], vehicle_boxes[left_boxes])
+            for row, column in greedy_match(scores, 1 - self.max_centroid_distance):
+                matches.append((left_tracks[row], left_boxes[column]))
+                matched_boxes.add(left_boxes[column])
+
+        current = []
+        for row, column in matches:
+            track = self.tracks[row]
+            track.update(vehicle_boxes[column], int(vehicle_cls[column]), float(vehicle_conf[column]))
+            current.append((track, column))
+        current_ids = {id(track) for track, _ in current}
+        for track in self.tracks:
+            if id(track) not in current_ids:
+                track.missed += 1
+        for column in range(len(vehicle_boxes)):
+            if column not in matched_boxes:
+                track = Track(self.next_id, vehicle_boxes[column], int(vehicle_cls[column]), float(vehicle_conf[column]))
+                self.next_id += 1
+                self.tracks.append(track)
+                current.append((track, column))
+        self.tracks = [track for track in self.tracks if track.missed <= self.max_missed]
+
+        # attach every plate and brand box to the vehicle box that contains most of it
+        child_boxes = xyxy[~is_vehicle]
+        child_cls, child_conf = cls[~is_vehicle], conf[~is_vehicle]
+        if current and len(child_boxes):
+            current_boxes = vehicle_boxes[[column for _, column in current]]
+            containment = containment_matrix(child_boxes, current_boxes)
+            for child in range(len(child_boxes)):
+                parent = int(np.argmax(containment[child]))
+                if containment[child, parent] > 0.5:
+                    current[parent][0].attach(child_boxes[child], int(child_cls[child]), float(child_conf[child]))
+        return [track for track, _ in current]
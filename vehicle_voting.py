@@ -0,0 +1,132 @@
+"""! @brief module responsible for voting over several frames of a vehicle, so its features stabilize without re-running the models."""
+from collections import defaultdict
+import numpy as np
+import vehicle_features
+import vehicle_color
+from vehicle_config import vehicle_det_config
+
+
+def vote_plate(readings):
+    """! votes a plate character by character over several OCR readings.
+
+    The readings of the length with the highest total score are aligned position by position and
+    each position keeps the character with the highest summed score.
+
+    @param readings list of (plate text, OCR score).
+
+    @return (plate, confidence) where confidence is the weakest position's share of the votes, or ('', 0.0).
+    """
+    by_length = defaultdict(list)
+    for text, score in readings:
+        if text:
+            by_length[len(text)].append((text, score))
+    if not by_length:
+        return '', 0.0
+    length = max(by_length, key=lambda candidate: sum(score for _, score in by_length[candidate]))
+    plate, confidence = '', 1.0
+    for position in range(length):
+        votes = defaultdict(float)
+        for text, score in by_length[length]:
+            votes[text[position]] += score
+        character = max(votes, key=votes.get)
+        plate += character
+        confidence = min(confidence, votes[character] / max(sum(votes.values()), 1e-9))
+    # readings of other lengths disagree with the vote
+    total = sum(score for _, score in readings)
+    return plate, confidence * sum(score for _, score in by_length[length]) / max(total, 1e-9)
+
+
+class VehicleAccumulator:
+    """! collects the per-frame results of one vehicle until its features converge.
+
+    Plates are voted character by character (weighted by the OCR score), type and brand by summed
+    detection confidence, nationality by summed plate score and color by averaging the softmax of
+    the color model. Once converged, the result is emitted and the models are no longer queried.
+    """
+
+    def __init__(self, min_frames=None, max_frames=None, plate_confidence=None, color_confidence=None, min_plate_length=4):
+        """! @param min_frames frames collected before the result may be emitted.
+        @param max_frames frames after which the result is emitted even if it did not converge.
+        @param plate_confidence plate vote confidence needed to converge.
+        @param color_confidence mean probability of the winning color needed to converge.
+        @param min_plate_length readings shorter than this are ignored.
+        """
+        self.min_frames = min_frames or vehicle_det_config.get('voting_min_frames', 3)
+        self.max_frames = max_frames or vehicle_det_config.get('voting_max_frames', 10)
+        self.plate_confidence = plate_confidence if plate_confidence is not None else vehicle_det_config.get('voting_plate_confidence', 0.6)
+        self.color_confidence = color_confidence if color_confidence is not None else vehicle_det_config.get('voting_color_confidence', 0.5)
+        self.min_plate_length = min_plate_length
+        self.frames = 0
+        self.plate_readings = []
+        self.type_scores = defaultdict(float)
+        self.brand_scores = defaultdict(float)
+        self.nationality_scores = defaultdict(float)
+        self.color_sum = None
+        self.color_frames = 0
+        self.emitted = False
+        #! max_frames were collected without every feature getting a vote, the models are no longer queried
+        self.abandoned = False
+
+    def add_frame(self, type_id=None, type_conf=0.0, brand_id=None, brand_conf=0.0, plate=None, plate_score=0.0,
+                  nationality=None, color_probabilities=None):
+        """! adds what one frame shows of the vehicle; any part may be missing.
+
+        @param type_id, type_conf the vehicle class id (car/truck) and its detection confidence.
+        @param brand_id, brand_conf the brand class id and its detection confidence.
+        @param plate, plate_score the OCR'd plate and its score.
+        @param nationality the nationality predicted from the plate.
+        @param color_probabilities the softmax of the color model.
+        """
+        self.frames += 1
+        if type_id is not None:
+            self.type_scores[type_id] += type_conf
+        if brand_id is not None:
+            self.brand_scores[brand_id] += brand_conf
+        if plate is not None and len(plate) >= self.min_plate_length:
+            self.plate_readings.append((plate, plate_score))
+            if nationality is not None:
+                self.nationality_scores[nationality] += plate_score
+        if color_probabilities is not None:
+            color_probabilities = np.asarray(color_probabilities, dtype=float)
+            self.color_sum = color_probabilities if self.color_sum is None else self.color_sum + color_probabilities
+            self.color_frames += 1
+
+    def plate(self):
+        """! @return (plate, confidence) voted so far."""
+        return vote_plate(self.plate_readings)
+
+    def color(self):
+        """! @return (color, mean probability) voted so far, or (None, 0.0)."""
+        if self.color_sum is None:
+            return None, 0.0
+        mean = self.color_sum / self.color_frames
+        best = int(mean.argmax())
+        return vehicle_color.colors[best], float(mean[best])
+
+    def is_complete(self):
+        """! tells whether every feature has at least one vote."""
+        return bool(self.type_scores and self.brand_scores and self.plate_readings and self.nationality_scores and self.color_sum is not None)
+
+    def converged(self):
+        """! tells whether the voting is over: every feature is confident, or max_frames was reached.
+
+        A vehicle still incomplete after max_frames (e.g. its plate was never read) is abandoned
+        rather than voted on forever; result() is then None.
+        """
+        if self.frames >= self.max_frames:
+            self.abandoned = not self.is_complete()
+            return True
+        if not self.is_complete():
+            return False
+        return (self.frames >= self.min_frames and self.plate()[1] >= self.plate_confidence
+                and self.color()[1] >= self.color_confidence)
+
+    def result(self):
+        """! @return ['car'/'truck', 'LP', 'brand', 'nationality', 'color'] voted so far, or None if incomplete."""
+        if not self.is_complete():
+            return None
+        return [vehicle_features.class_names[max(self.type_scores, key=self.type_scores.get)],
+                self.plate()[0],
+                vehicle_features.class_names[max(self.brand_scores, key=self.brand_scores.get)],
+                max(self.nationality_scores, key=self.nationality_scores.get),
+                self.color()[0]]